@@ -0,0 +1,270 @@
+import unittest
+import numpy as np
+
+SMALL_FIELD = 8
+LARGE_FIELD = 16
+
+# Formy zapisu liczby rzeczywistej w polu karty
+_FIXED = 0          # 1234.5  /  .30125
+_EXPONENT = 1       # 2.0123+11
+_POINT_END = 2      # 20123.+7
+
+# Największa liczba cyfr znaczących, którą float64 oddaje bez strat w mantysie całkowitej
+_MAX_DIGITS = 15
+
+
+def _n_digits(x):
+    '''Liczba cyfr dziesiętnych nieujemnych liczb całkowitych (tablica), 0 -> 1.'''
+    x = np.asarray(x, dtype=np.float64)
+    out = np.ones(x.shape, dtype=np.int64)
+    for i in range(1, 23):
+        out += x >= 10.0 ** i
+    return out
+
+
+def _decompose(values, width):
+    '''
+    Rozkłada wartości na (znak, mantysa całkowita M, wykładnik k, forma) tak, że wartość = +-M * 10**k,
+    a tekst karty ma możliwie najwięcej cyfr znaczących mieszcząc się w `width` znakach.
+
+    Wszystkie operacje są wektorowe - pętla idzie po liczbie cyfr, a nie po osobnikach.
+    '''
+    v = np.atleast_1d(np.asarray(values, dtype=np.float64))
+    if not np.all(np.isfinite(v)):
+        raise ValueError("Wartości NaN/inf nie mają zapisu w karcie NASTRAN.")
+
+    neg = v < 0
+    a = np.abs(v)
+    s = neg.astype(np.int64)
+    nonzero = a > 0
+
+    # Wykładnik dziesiętny p: 10**p <= a < 10**(p+1)
+    with np.errstate(divide='ignore'):
+        p = np.where(nonzero, np.floor(np.log10(np.where(nonzero, a, 1.0))), 0).astype(np.int64)
+    p -= (10.0 ** p.astype(np.float64) > a) & nonzero
+    p += (10.0 ** (p + 1).astype(np.float64) <= a) & nonzero
+
+    M = np.zeros(v.shape, dtype=np.float64)
+    k = np.zeros(v.shape, dtype=np.int64)
+    form = np.full(v.shape, _FIXED, dtype=np.int64)
+    done = ~nonzero  # zero zapisujemy jako "0."
+
+    for d in range(min(width - 1, _MAX_DIGITS), 0, -1):
+        todo = ~done
+        if not todo.any():
+            break
+        k0 = p - d + 1
+        scaled = np.where(k0 >= 0, a / 10.0 ** np.maximum(k0, 0), a * 10.0 ** np.maximum(-k0, 0))
+        m = np.rint(scaled)
+        kk = k0.copy()
+
+        # Zaokrąglenie w górę do potęgi dziesięciu (np. 99999.7 -> 100000)
+        carry = m >= 10.0 ** d
+        m = np.where(carry, m / 10.0, m)
+        kk += carry
+
+        # Końcowe zera mantysy nic nie wnoszą - przenosimy je do wykładnika
+        for _ in range(d):
+            trailing = (m > 0) & (np.fmod(m, 10.0) == 0)
+            if not trailing.any():
+                break
+            m = np.where(trailing, m / 10.0, m)
+            kk += trailing
+
+        nd = _n_digits(m)
+        p_eff = kk + nd - 1
+        len_fixed = np.where(kk >= 0, s + nd + kk + 1, s + 1 + np.maximum(nd, -kk))
+        len_exponent = s + nd + 2 + _n_digits(np.abs(p_eff))
+        len_point_end = np.where(kk != 0, s + nd + 2 + _n_digits(np.abs(kk)), width + 1)
+
+        lengths = np.stack([len_fixed, len_exponent, len_point_end])
+        best = np.argmin(lengths, axis=0)  # przy remisie wygrywa forma o niższym kodzie
+        fits = todo & (np.min(lengths, axis=0) <= width)
+
+        M = np.where(fits, m, M)
+        k = np.where(fits, kk, k)
+        form = np.where(fits, best, form)
+        done |= fits
+
+    if not done.all():
+        raise ValueError(f"Wartości {v[~done]} nie mieszczą się w polu o szerokości {width}.")
+
+    return neg, M, k, form
+
+
+def _format_one(neg, m, k, form):
+    sign = '-' if neg else ''
+    digits = str(int(m))
+    if form == _FIXED:
+        if k >= 0:
+            return f"{sign}{digits}{'0' * k}."
+        digits = digits.rjust(-k, '0')
+        whole, frac = digits[:len(digits) + k], digits[len(digits) + k:]
+        return f"{sign}{whole}.{frac}"
+    if form == _EXPONENT:
+        p = k + len(digits) - 1
+        return f"{sign}{digits[0]}.{digits[1:]}{'+' if p >= 0 else '-'}{abs(p)}"
+    return f"{sign}{digits}.{'+' if k >= 0 else '-'}{abs(k)}"
+
+
+def encode_reals(values, width=SMALL_FIELD):
+    '''
+    Encode real numbers as NASTRAN field strings with the maximum precision the field width allows.
+
+    values (array-like): values to encode (e.g. Young's modulus of a whole population)
+    width (int): field width - 8 (small field / free field) or 16 (large field)
+
+    Example:
+
+    encode_reals([2.0123456e11, 0.3]) -> ['20123.+7', '.3']
+    '''
+    neg, M, k, form = _decompose(values, width)
+    return np.array([_format_one(*row) for row in zip(neg.tolist(), M.tolist(), k.tolist(), form.tolist())])
+
+
+def encode_real(value, width=SMALL_FIELD):
+    '''Scalar version of encode_reals.'''
+    return str(encode_reals([value], width)[0])
+
+
+def quantize_reals(values, width=SMALL_FIELD):
+    '''
+    Return the float64 values that NASTRAN reads back from encode_reals(values, width).
+
+    parse_real(encode_real(x)) == quantize_reals([x])[0] holds exactly: M and 10**|k| are exact
+    floats, so the single multiplication/division is rounded the same way as float() of the text.
+    '''
+    neg, M, k, form = _decompose(values, width)
+    small = np.abs(k) <= 22  # 10**22 to największa dokładnie reprezentowalna potęga dziesięciu
+    q = np.where(k >= 0, M * 10.0 ** np.where(small, np.maximum(k, 0), 0),
+                 M / 10.0 ** np.where(small, np.maximum(-k, 0), 0))
+    for i in np.flatnonzero(~small):
+        q[i] = abs(parse_real(_format_one(neg[i], M[i], k[i], form[i])))
+    return np.where(neg, -q, q)
+
+
+def parse_real(text):
+    '''
+    Read a NASTRAN real field: "2.1+11", "2.1E+11", "2.1D+11", ".3", "-1.5-3", "7.".
+    '''
+    t = text.strip().upper().replace('D', 'E')
+    if 'E' not in t:
+        # Wykładnik bez litery E - pierwszy znak +/- po pierwszej pozycji
+        for i in range(1, len(t)):
+            if t[i] in '+-':
+                t = f"{t[:i]}E{t[i:]}"
+                break
+    return float(t)
+
+
+def _field_text(value, width):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        text = value.strip()
+    elif isinstance(value, (int, np.integer)):
+        text = str(int(value))
+    else:
+        text = encode_real(value, width)
+    if len(text) > width:
+        raise ValueError(f"Pole '{text}' jest dłuższe niż {width} znaków.")
+    return text
+
+
+def format_card(name, fields, fmt='small'):
+    '''
+    Format a bulk data card.
+
+    name (string): card name, e.g. 'MAT1'
+    fields (list): field values after the name - int, float (encoded with encode_real), str (as is)
+        or None (blank field)
+    fmt (string): 'small' (8-character fields), 'large' (MAT1*, 16-character fields)
+        or 'free' (comma separated)
+
+    Returns the card as a list of lines (without newline characters).
+
+    Example:
+
+    format_card('MAT1', [1, 2.1e11, None, 0.3]) -> ['MAT1    1       2.1+11          .3']
+    '''
+    if fmt == 'small':
+        per_line, width = 8, SMALL_FIELD
+        heads = [f"{name:<8}", ' ' * 8]
+    elif fmt == 'large':
+        per_line, width = 4, LARGE_FIELD
+        heads = [f"{name + '*':<8}", f"{'*':<8}"]
+    elif fmt == 'free':
+        texts = [_field_text(value, SMALL_FIELD) for value in fields]
+        lines = [','.join([name] + texts[:8])]
+        for i in range(8, len(texts), 8):
+            lines.append(','.join([''] + texts[i:i + 8]))
+        return lines
+    else:
+        raise ValueError(f"Nieznany format karty: {fmt}")
+
+    texts = [_field_text(value, width) for value in fields]
+    lines = []
+    for i in range(0, max(len(texts), 1), per_line):
+        head = heads[0] if i == 0 else heads[1]
+        lines.append((head + ''.join(f"{t:<{width}}" for t in texts[i:i + per_line])).rstrip())
+    return lines
+
+
+def include_statement(path, width=72):
+    '''
+    INCLUDE statement for a file, wrapped to 'width' columns.
+
+    A long file name continues on the following lines (the quoted name may be split anywhere);
+    lines are broken after a path separator when possible.
+
+    Returns the statement as a list of lines (without newline characters).
+
+    Example:
+
+    include_statement('/models/plate_mesh.bdf') -> ["INCLUDE '/models/plate_mesh.bdf'"]
+    '''
+    text = f"INCLUDE '{path}'"
+    lines = []
+    while len(text) > width:
+        cut = max(text.rfind('/', 0, width), text.rfind('\\', 0, width)) + 1
+        if cut <= len("INCLUDE '"):
+            cut = width
+        lines.append(text[:cut])
+        text = text[cut:]
+    lines.append(text)
+    return lines
+
+
+class TestBdfFormat(unittest.TestCase):
+    def test_precision(self):
+        self.assertEqual(list(encode_reals([2.0123456e11, 2.1e11, 0.3, -1.5e-3, 0.0], 8)),
+                         ['20123.+7', '2.1+11', '.3', '-.0015', '0.'])
+        self.assertEqual(encode_real(2.0123456789123e11, 16), '201234567891.23')
+
+    def test_round_trip(self):
+        values = np.concatenate([1e9 + np.random.rand(1000) * 299e9, np.random.rand(1000) / 2,
+                                 -np.random.rand(100) * 1e-5])
+        for width in (SMALL_FIELD, LARGE_FIELD):
+            texts = encode_reals(values, width)
+            q = quantize_reals(values, width)
+            self.assertTrue(all(len(t) <= width for t in texts))
+            self.assertTrue(np.array_equal(q, [parse_real(t) for t in texts]))
+            self.assertTrue(np.array_equal(encode_reals(q, width), texts))
+
+    def test_format_card(self):
+        self.assertEqual(format_card('MAT1', [1, 2.1e11, None, 0.3]), ['MAT1    1       2.1+11          .3'])
+        self.assertEqual(format_card('MAT1', [1, 2.1e11, None, 0.3, 7850.0], 'large'),
+                         ['MAT1*   1               2.1+11                          .3',
+                          '*       7850.'])
+        self.assertEqual(format_card('MAT1', [1, 2.1e11, None, 0.3], 'free'), ['MAT1,1,2.1+11,,.3'])
+
+    def test_include_statement(self):
+        self.assertEqual(include_statement('/m/plate_mesh.bdf'), ["INCLUDE '/m/plate_mesh.bdf'"])
+        path = '/' + '/'.join(['katalog_' + str(i) for i in range(20)]) + '/' + 'x' * 100 + '.bdf'
+        lines = include_statement(path)
+        self.assertTrue(all(len(line) <= 72 for line in lines))
+        self.assertEqual(''.join(lines), f"INCLUDE '{path}'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,353 @@
+'''
+Card index of a BDF deck: card name and ID -> file, byte offset and length.
+
+The deck is scanned once. Lines are classified with numpy on the raw bytes (card start,
+continuation, comment), so only the first line of every card is parsed in Python. INCLUDE files
+are indexed recursively (paths relative to the including file) and continuation lines (small,
+large and free field) belong to their card. Lookups are a binary search in a sorted key array.
+
+The index is stored next to the deck in a sidecar file (<deck>.idx.npz) and reused while the
+modification time and size of every indexed file are unchanged.
+
+Example:
+
+index = BdfIndex('model.bdf')
+index.read('GRID', 1001)
+index.edit_material(3, {'E': 2.1e11, 'NU': 0.3})      # only MAT card with MID 3 changes
+'''
+import os
+import unittest
+import threading
+import tempfile
+import numpy as np
+from edit_material_prop import modify_material_properties, edit_file
+
+# Pierwsze znaki linii, które nie zaczynają karty: kontynuacje (spacja, '+', '*', ','), komentarz, pusta linia
+_NOT_CARD = np.frombuffer(b' +*,$\t\r\n', dtype=np.uint8)
+_CONTINUATION = np.frombuffer(b' +*,', dtype=np.uint8)
+_WHITESPACE = np.frombuffer(b' \t\r\n', dtype=np.uint8)
+
+# Karty bez numeru (PARAM, INCLUDE ...) mają ID -1
+NO_ID = -1
+
+
+def _key(card, ids):
+    # Klucz sortowania: numer nazwy karty w starszych bitach, ID (+1, bo NO_ID = -1) w młodszych
+    return (np.asarray(card, dtype=np.int64) << 32) + (np.asarray(ids, dtype=np.int64) + 1)
+
+
+def _card_name_id(line):
+    '''Nazwa karty i jej numer (pierwsze pole) z pierwszej linii karty.'''
+    if ',' in line[:9]:
+        fields = line.split(',')
+        name, first = fields[0], fields[1] if len(fields) > 1 else ''
+    else:
+        name = line[:8]
+        first = line[8:24] if name.rstrip().endswith('*') else line[8:16]
+    name = name.strip().rstrip('*').upper()
+    try:
+        return name, int(first)
+    except ValueError:
+        return name, NO_ID
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class BdfIndex:
+    """
+    Indeks kart pliku BDF (razem z plikami INCLUDE).
+
+    Atrybuty:
+        path (str): Plik główny.
+        files (list[str]): Zindeksowane pliki (0 - plik główny).
+        names (list[str]): Nazwy kart (numer nazwy w tablicy card).
+        card, id, file, offset, length (ndarray): Karty posortowane według (nazwa, ID).
+
+    Metody:
+        locate(name, card_id): Plik, przesunięcie i długość karty w bajtach.
+        read(name, card_id): Tekst karty (z liniami kontynuacji).
+        ids(name): Numery wszystkich kart danego typu.
+        replace(name, card_id, text): Podmienia kartę w pliku i aktualizuje indeks.
+        edit_material(mid, params): Zmienia E/NU karty MAT o danym MID.
+    """
+
+    def __init__(self, path, sidecar=True):
+        """
+        Parametry:
+            path (str): Plik BDF.
+            sidecar (bool): Odczyt i zapis indeksu w pliku <path>.idx.npz.
+        """
+        self.path = path
+        self.sidecar = sidecar
+        if not (sidecar and self._load()):
+            self.build()
+            if sidecar:
+                self.save()
+
+    @property
+    def sidecar_path(self):
+        return self.path + '.idx.npz'
+
+    def __len__(self):
+        return len(self.card)
+
+    def __contains__(self, item):
+        return self._find(*item) is not None
+
+    def build(self):
+        '''Indeksuje plik główny i pliki INCLUDE (jeden przebieg na plik).'''
+        self.files, self.names = [], []
+        columns = {'card': [], 'id': [], 'file': [], 'offset': [], 'length': []}
+        self._scan(os.path.abspath(self.path), columns, bulk_only=True)
+        card, ids, file, offset, length = (np.asarray(c, dtype=np.int64) for c in columns.values())
+        order = np.argsort(_key(card, ids), kind='stable')
+        self.card = card[order].astype(np.int32)
+        self.id = ids[order]
+        self.file = file[order].astype(np.int32)
+        self.offset = offset[order]
+        self.length = length[order]
+        self._keys = _key(self.card, self.id)
+        self._stamps = [_stamp(path) for path in self.files]
+
+    def _scan(self, path, columns, bulk_only):
+        number = len(self.files)
+        self.files.append(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        # Początki linii i ich pierwsze znaki - klasyfikacja wszystkich linii naraz
+        raw = np.frombuffer(data, dtype=np.uint8)
+        starts = np.concatenate(([0], np.flatnonzero(raw == ord('\n')) + 1))
+        starts = starts[starts < len(data)]
+        if len(starts) == 0:
+            return
+        ends = np.append(starts[1:], len(data))
+        first = raw[starts]
+        is_start = ~np.isin(first, _NOT_CARD)
+        # Linia kontynuacji ma jakąkolwiek treść - liczba znaków innych niż białe w każdej linii naraz
+        text_count = np.concatenate(([0], np.cumsum(~np.isin(raw, _WHITESPACE))))
+        blank = text_count[ends] == text_count[starts]
+        is_member = is_start | (np.isin(first, _CONTINUATION) & ~blank)
+        # Ostatnia linia należąca do karty przed linią j (komentarze i puste linie kończą kartę)
+        last_member = np.maximum.accumulate(np.where(is_member, np.arange(len(starts)), -1))
+
+        card_lines = np.flatnonzero(is_start)
+        next_card = np.append(card_lines[1:], len(starts))
+        card_ends = ends[last_member[next_card - 1]]
+
+        in_bulk = not bulk_only
+        skip_to = -1
+        names = {name: i for i, name in enumerate(self.names)}
+        cards, ids, offsets, lengths = columns['card'], columns['id'], columns['offset'], columns['length']
+        first_ends = ends[card_lines].tolist()
+        for line_no, start, end, first_end in zip(card_lines.tolist(), starts[card_lines].tolist(),
+                                                  card_ends.tolist(), first_ends):
+            if line_no < skip_to:
+                continue
+            line = data[start:first_end].decode('latin-1')
+            upper = line.strip().upper()
+            if not in_bulk:
+                in_bulk = upper.startswith('BEGIN') and 'BULK' in upper
+                continue
+            if upper.startswith('ENDDATA'):
+                break
+            if upper.startswith('INCLUDE'):
+                skip_to, include = self._include_name(data, starts, ends, line_no)
+                self._scan(os.path.join(os.path.dirname(path), include), columns, bulk_only=False)
+                continue
+            name, card_id = _card_name_id(line)
+            if name not in names:
+                names[name] = len(self.names)
+                self.names.append(name)
+            cards.append(names[name])
+            ids.append(card_id)
+            offsets.append(start)
+            lengths.append(end - start)
+            columns['file'].append(number)
+
+        if bulk_only and not in_bulk:
+            # Plik bez BEGIN BULK (np. sama siatka) - cały plik to dane bulk
+            self.files.pop()
+            self._scan(path, columns, bulk_only=False)
+
+    @staticmethod
+    def _include_name(data, starts, ends, line_no):
+        '''Nazwa pliku z instrukcji INCLUDE (także zawiniętej na kolejne linie) i numer linii po niej.'''
+        text = ''
+        line = line_no
+        while line < len(starts):
+            text += data[starts[line]:ends[line]].decode('latin-1').rstrip('\r\n')
+            line += 1
+            if text.count("'") >= 2:
+                break
+        return line, text.split("'")[1].strip()
+
+    def _load(self):
+        if not os.path.exists(self.sidecar_path):
+            return False
+        with np.load(self.sidecar_path) as sidecar:
+            files = sidecar['files'].tolist()
+            stamps = [tuple(stamp) for stamp in sidecar['stamps'].tolist()]
+            try:
+                if [_stamp(path) for path in files] != stamps:
+                    return False
+            except FileNotFoundError:
+                return False
+            self.files, self._stamps = files, stamps
+            self.names = sidecar['names'].tolist()
+            self.card, self.id, self.file = sidecar['card'], sidecar['id'], sidecar['file_number']
+            self.offset, self.length = sidecar['offset'], sidecar['length']
+        self._keys = _key(self.card, self.id)
+        return True
+
+    def save(self):
+        '''Zapisuje indeks do pliku <path>.idx.npz.'''
+        # np.savez dopisuje '.npz' do nazw bez tego rozszerzenia - plik tymczasowy je ma;
+        # własny dla procesu i wątku (równoległe materializuj indeksują ten sam szablon)
+        tmp = f'{self.sidecar_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp, files=np.array(self.files, dtype=str), stamps=np.array(self._stamps, dtype=np.int64),
+                 names=np.array(self.names, dtype=str), card=self.card, id=self.id, file_number=self.file,
+                 offset=self.offset, length=self.length)
+        os.replace(tmp, self.sidecar_path)
+
+    def _find(self, name, card_id):
+        try:
+            code = self.names.index(name.upper())
+        except ValueError:
+            return None
+        key = _key(code, card_id)
+        i = int(np.searchsorted(self._keys, key))
+        return i if i < len(self._keys) and self._keys[i] == key else None
+
+    def locate(self, name, card_id=NO_ID):
+        '''
+        Położenie karty (pierwszej o tym ID).
+
+        Zwraca:
+            Tuple[str, int, int]: Plik, przesunięcie i długość karty w bajtach (z liniami kontynuacji).
+        '''
+        i = self._find(name, card_id)
+        if i is None:
+            raise KeyError(f"Brak karty {name} o numerze {card_id} w {self.path}.")
+        return self.files[self.file[i]], int(self.offset[i]), int(self.length[i])
+
+    def read(self, name, card_id=NO_ID):
+        '''Tekst karty razem z liniami kontynuacji.'''
+        path, offset, length = self.locate(name, card_id)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length).decode('latin-1')
+
+    def ids(self, name):
+        '''Numery wszystkich kart danego typu (rosnąco).'''
+        if name.upper() not in self.names:
+            return np.empty(0, dtype=np.int64)
+        return self.id[self.card == self.names.index(name.upper())]
+
+    def replace(self, name, card_id, text):
+        '''
+        Podmienia kartę w pliku (text - cała karta, z liniami kontynuacji i końcem linii).
+
+        Karta o tej samej długości jest nadpisywana w miejscu; inna długość przesuwa resztę pliku,
+        a przesunięcia kart za nią są poprawiane wektorowo.
+        '''
+        i = self._find(name, card_id)
+        if i is None:
+            raise KeyError(f"Brak karty {name} o numerze {card_id} w {self.path}.")
+        file, offset, length = int(self.file[i]), int(self.offset[i]), int(self.length[i])
+        path = self.files[file]
+        new = text.encode('latin-1')
+        if len(new) == length:
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                f.write(new)
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path, 'wb') as f:
+                f.write(data[:offset] + new + data[offset + length:])
+            self.offset[(self.file == file) & (self.offset > offset)] += len(new) - length
+            self.length[i] = len(new)
+        self._stamps[file] = _stamp(path)
+        if self.sidecar:
+            self.save()
+
+    def material(self, mid):
+        '''Nazwa karty materiałowej (MAT1, MAT2 ...) o numerze mid.'''
+        for name in self.names:
+            if name.startswith('MAT') and self._find(name, mid) is not None:
+                return name
+        raise KeyError(f"Brak karty materiałowej o numerze {mid} w {self.path}.")
+
+    def edit_material(self, mid, params):
+        '''
+        Zmienia właściwości karty materiałowej o numerze mid - pierwsza linia przez
+        modify_material_properties, linie kontynuacji bez zmian.
+        '''
+        name = self.material(mid)
+        self.replace(name, mid, material_card(self.read(name, mid), params))
+
+
+def material_card(text, params):
+    '''Karta materiałowa (z liniami kontynuacji) z nowymi właściwościami w pierwszej linii.'''
+    first, _, rest = text.partition('\n')
+    return modify_material_properties(first.rstrip('\r'), params) + '\n' + rest
+
+
+class TestBdfIndex(unittest.TestCase):
+    DECK = ("SOL 103\nCEND\nTITLE = test\nBEGIN BULK\n$ komentarz\nPARAM   POST    -1\n"
+            "GRID    1               0.      0.      0.\n"
+            "MAT1    1       2.000+11        .3      7850.\n"
+            "MAT1*   2               7.000+10                        .33\n*       2700.\n"
+            "INCLUDE 'mesh/\nplate.bdf'\n"
+            "MAT1,3,1.1+11,,.34\n,8900.\nENDDATA\n")
+    MESH = "GRID    2               1.      0.      0.\nCQUAD4  10      7       1       2       3       4\n"
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'model.bdf')
+        os.makedirs(os.path.join(self.dir.name, 'mesh'))
+        with open(self.path, 'w', newline='\n') as f:
+            f.write(self.DECK)
+        with open(os.path.join(self.dir.name, 'mesh', 'plate.bdf'), 'w', newline='\n') as f:
+            f.write(self.MESH)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_index(self):
+        index = BdfIndex(self.path)
+        self.assertEqual(index.ids('MAT1').tolist(), [1, 2, 3])
+        self.assertEqual(index.ids('GRID').tolist(), [1, 2])
+        self.assertEqual(index.read('MAT1', 2), "MAT1*   2               7.000+10                        .33\n*       2700.\n")
+        self.assertEqual(index.read('MAT1', 3), "MAT1,3,1.1+11,,.34\n,8900.\n")
+        self.assertTrue(index.locate('CQUAD4', 10)[0].endswith('plate.bdf'))
+        self.assertNotIn(('SOL', NO_ID), index)
+        # Drugi odczyt z pliku indeksu
+        self.assertEqual(BdfIndex(self.path).read('GRID', 2), self.MESH.splitlines(True)[0])
+
+    def test_edit_material(self):
+        index = BdfIndex(self.path)
+        index.edit_material(2, {'E': 2.1e11, 'NU': 0.29})
+        index.edit_material(1, {'E': '2.100+11', 'NU': 0.3})
+        self.assertIn('2.1+11', index.read('MAT1', 2))
+        self.assertTrue(index.read('MAT1', 2).endswith('*       2700.\n'))
+        self.assertEqual(index.read('MAT1', 3), "MAT1,3,1.1+11,,.34\n,8900.\n")
+        # Indeks z pliku po zmianach musi wskazywać te same karty
+        self.assertEqual(BdfIndex(self.path).read('MAT1', 3), "MAT1,3,1.1+11,,.34\n,8900.\n")
+        self.assertEqual(BdfIndex(self.path, sidecar=False).read('MAT1', 2), index.read('MAT1', 2))
+
+    def test_edit_file_mid(self):
+        os.makedirs(os.path.join(self.dir.name, 'genetic'))
+        variant = edit_file(self.path, {'E': 2.1e11, 'NU': 0.25}, mid=3)
+        with open(variant) as f:
+            text = f.read()
+        self.assertIn("MAT1,3,2.1+11,,0.250000\n,8900.\n", text)
+        self.assertEqual(text.replace("MAT1,3,2.1+11,,0.250000", "MAT1,3,1.1+11,,.34"), self.DECK)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+'''
+Generation-level deck writer: all variant decks of a generation in one call.
+
+The template is read once (and again only when the file changes) and split around its MAT card
+(the first one, or the one with the given material ID; located by bdf_index.BdfIndex, with its
+continuation lines), so a variant deck is the unchanged
+head + the patched MAT card + the unchanged tail - one string
+join per variant instead of reading and splitting the template for every individual. E of the
+whole generation is encoded at once (bdf_format.encode_reals) and the files are written
+concurrently by a thread pool (file writes release the GIL).
+
+Paths and contents are the same as from edit_material_prop.edit_file (include mode adds '_include'
+to the file name, so the two kinds of decks never overwrite each other).
+
+Include mode (include=True): the bulk data without the MAT card is written once to a shared
+mesh file (genetic/<template>_mesh.bdf) and every variant is a small master deck - executive and
+case control, BEGIN BULK, the patched MAT card, an INCLUDE of the mesh file and ENDDATA. A variant
+then costs a few hundred bytes of I/O instead of the whole model, and concurrent solves share one
+copy of the mesh in the page cache.
+'''
+import os
+import unittest
+import tempfile
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from bdf_format import encode_reals, include_statement, SMALL_FIELD
+from bdf_index import BdfIndex, material_card
+from edit_material_prop import variant_path, edit_file
+from nastran_batch import split_deck
+
+
+class DeckWriter:
+    """
+    Zapis wariantów jednego szablonu BDF.
+
+    Metody:
+        write(young, poisson, skip): Zapisuje decki wszystkich genomów naraz i zwraca ścieżki.
+    """
+
+    def __init__(self, template, max_workers=8, include=False, mid=None):
+        """
+        Parametry:
+            template (str): Szablon BDF z kartą MAT.
+            max_workers (int): Liczba wątków zapisujących pliki.
+            include (bool): Tryb INCLUDE - wspólny plik siatki i małe decki wariantów.
+            mid (int): Numer zmienianego materiału (jak w edit_file); None - pierwsza karta MAT.
+        """
+        self.template = template
+        self.max_workers = max_workers
+        self.include = include
+        self.mid = mid
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._head = self._card = self._tail = None
+        self._mesh = None
+
+    @property
+    def mesh_path(self):
+        '''Wspólny plik siatki trybu INCLUDE (w folderze wariantów).'''
+        dir_path = os.path.dirname(self.template)
+        name = os.path.splitext(os.path.basename(self.template))[0]
+        return f'{dir_path}/genetic/{name}_mesh.bdf'
+
+    def _load(self):
+        '''Wczytuje szablon, jeśli zmienił się od ostatniego odczytu (czas modyfikacji i rozmiar).'''
+        stat = os.stat(self.template)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            offset, length = self._material_span()
+            with open(self.template, 'rb') as f:
+                data = f.read()
+            # Końce linii jak przy odczycie w trybie tekstowym (edit_file)
+            head, card, tail = (_text(part) for part in
+                                (data[:offset], data[offset:offset + length], data[offset + length:]))
+            self._card = card
+            if self.include:
+                # Cała karta (z liniami kontynuacji) trafia do decku wariantu, reszta bulk do siatki
+                executive, case_control, bulk = split_deck((head + tail).splitlines(True))
+                self._head = ''.join(executive + case_control) + 'BEGIN BULK\n'
+                self._tail = '\n'.join(include_statement(os.path.abspath(self.mesh_path))) + '\nENDDATA\n'
+                self._mesh = ''.join(bulk)
+                self._write_mesh()
+            else:
+                self._head = head
+                self._tail = tail
+            self._stamp = stamp
+
+    def _material_span(self):
+        '''Przesunięcie i długość (w bajtach) karty MAT szablonu (pierwszej albo o numerze mid),
+        z liniami kontynuacji.'''
+        index = BdfIndex(self.template, sidecar=False)
+        if self.mid is not None:
+            name = index.material(self.mid)
+            card_path, offset, length = index.locate(name, self.mid)
+            if os.path.abspath(card_path) != os.path.abspath(self.template):
+                raise ValueError(f"Karta {name} {self.mid} jest w pliku INCLUDE {card_path} - zmień ją w tym pliku.")
+            return offset, length
+        codes = [code for code, name in enumerate(index.names) if name.startswith('MAT')]
+        rows = np.flatnonzero(np.isin(index.card, codes) & (index.file == 0))
+        if len(rows) == 0:
+            raise ValueError(f"Szablon {self.template} nie zawiera karty MAT.")
+        row = rows[np.argmin(index.offset[rows])]
+        return int(index.offset[row]), int(index.length[row])
+
+    def _write_mesh(self):
+        # Zapis przez plik tymczasowy - trwające analizy nigdy nie czytają niepełnej siatki
+        tmp = f'{self.mesh_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='latin-1') as f:
+            f.write(self._mesh)
+        os.replace(tmp, self.mesh_path)
+
+    def _write_one(self, path, params):
+        text = self._head + material_card(self._card, params) + self._tail
+        with open(path, 'w', encoding='latin-1') as f:
+            f.write(text)
+
+    def write(self, young, poisson, skip=None):
+        '''
+        Zapisuje decki dla genomów (young[i], poisson[i]).
+
+        young, poisson (array-like): Genomy całej generacji.
+        skip (container): Klucze genomu (klucz_genomu - tekst E i NU z 6 miejscami), dla których
+            deck nie jest potrzebny (np. wynik jest już w pamięci rozwiązań); ich ścieżki są
+            zwracane, ale pliki nie powstają.
+
+        Zwraca listę ścieżek (w kolejności genomów). Każdy plik zapisywany jest raz, także gdy
+        kilka genomów daje ten sam deck.
+        '''
+        young = np.atleast_1d(np.asarray(young, dtype=np.float64))
+        poisson = [float(nu) for nu in np.atleast_1d(poisson)]
+        if len(young) == 0:
+            return []
+        self._load()
+        if self.include and not os.path.exists(self.mesh_path):
+            # Folder wariantów został wyczyszczony (np. na starcie algorytm)
+            with self._lock:
+                self._write_mesh()
+
+        paths = []
+        todo = {}
+        for e, nu in zip(encode_reals(young, SMALL_FIELD).tolist(), poisson):
+            params = {'E': e, 'NU': nu}
+            path = variant_path(self.template, params, '_include' if self.include else '')
+            paths.append(path)
+            if path in todo or (skip is not None and (e, f"{nu:.6f}") in skip):
+                continue
+            todo[path] = params
+
+        if len(todo) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(todo))) as executor:
+                list(executor.map(self._write_one, todo, todo.values()))
+        else:
+            for path, params in todo.items():
+                self._write_one(path, params)
+        return paths
+
+
+def _text(data):
+    return data.decode('latin-1').replace('\r\n', '\n').replace('\r', '\n')
+
+
+# Zapisywacze dla szablonów ((szablon, include, mid) -> DeckWriter), wspólne dla wszystkich generacji
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def write_generation(template, young, poisson, skip=None, include=False, mid=None):
+    '''Zapisuje decki całej generacji wspólnym DeckWriter szablonu. Zwraca listę ścieżek.'''
+    with _writers_lock:
+        writer = _writers.get((template, include, mid))
+        if writer is None:
+            writer = _writers[(template, include, mid)] = DeckWriter(template, include=include, mid=mid)
+    return writer.write(young, poisson, skip)
+
+
+class TestDeckWriter(unittest.TestCase):
+    HEAD = "SOL 103\nCEND\nTITLE = test\nBEGIN BULK\nPARAM   POST    -1\nGRID    1               0.      0.      0.\n"
+    TAIL = "GRID    2               1.      0.      0.\nCQUAD4  10      7       1       2       3       4\nENDDATA\n"
+    CARDS = {
+        'small': ("MAT1    1       2.000+11        .3      7850.\n+       .01\n", "+       .01\n"),
+        'large': ("MAT1*   1               2.000+11                        .3              +\n*       7850.\n",
+                  "*       7850.\n"),
+        'free': ("MAT1,1,2.0+11,,.3\n,7850.\n", ",7850.\n"),
+    }
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.dir.name, 'genetic'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def template(self, card, name='model.bdf'):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', newline='\n') as f:
+            f.write(self.HEAD + card + self.TAIL)
+        return path
+
+    def test_include_keeps_continuation(self):
+        for form, (card, continuation) in self.CARDS.items():
+            with self.subTest(form=form):
+                writer = DeckWriter(self.template(card, f'{form}.bdf'), include=True)
+                path, = writer.write([2.1e11], [0.25])
+                with open(path) as f:
+                    master = f.read()
+                with open(writer.mesh_path) as f:
+                    mesh = f.read()
+                self.assertIn('2.1+11', master)
+                self.assertIn(continuation, master)
+                self.assertNotIn(continuation, mesh)
+                self.assertEqual(mesh, (self.HEAD + self.TAIL).split('BEGIN BULK\n')[1].replace('ENDDATA\n', ''))
+                self.assertTrue(BdfIndex(path, sidecar=False).read('MAT1', 1).endswith(continuation))
+                self.assertEqual(BdfIndex(path, sidecar=False).ids('GRID').tolist(), [1, 2])
+
+    def test_matches_edit_file(self):
+        for form, (card, _) in self.CARDS.items():
+            with self.subTest(form=form):
+                template = self.template(card, f'{form}.bdf')
+                paths = DeckWriter(template).write([2.1e11, 1.95e11], [0.3, 0.25])
+                for path, params in zip(paths, [{'E': 2.1e11, 'NU': 0.3}, {'E': 1.95e11, 'NU': 0.25}]):
+                    with open(path, 'rb') as f:
+                        written = f.read()
+                    self.assertEqual(edit_file(template, params), path)
+                    with open(path, 'rb') as f:
+                        self.assertEqual(written, f.read())
+                self.assertNotIn(paths[0], DeckWriter(template, include=True).write([2.1e11], [0.3]))
+
+    def test_mid(self):
+        template = self.template(self.CARDS['small'][0] + "MAT1    2       7.000+10        .33     2700.\n")
+        params = {'E': 2.1e11, 'NU': 0.25}
+        path, = DeckWriter(template, mid=2).write([params['E']], [params['NU']])
+        with open(path, 'rb') as f:
+            written = f.read()
+        self.assertIn(b"MAT1    1       2.000+11        .3      7850.\n", written)
+        self.assertEqual(edit_file(template, params, mid=2), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(written, f.read())
+        with self.assertRaises(KeyError):
+            DeckWriter(template, mid=3).write([params['E']], [params['NU']])
+
+    def test_duplicates_and_skip(self):
+        writer = DeckWriter(self.template(self.CARDS['small'][0]))
+        written = []
+        write_one = writer._write_one
+        writer._write_one = lambda path, params: (written.append(path), write_one(path, params))
+        paths = writer.write([2.1e11, 1.9e11, 2.1e11], [0.3, 0.3, 0.3],
+                             skip={(encode_reals(np.array([1.9e11]), SMALL_FIELD)[0], '0.300000')})
+        self.assertEqual(paths[0], paths[2])
+        self.assertEqual(written, [paths[0]])
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+
+    def test_template_reload(self):
+        template = self.template(self.CARDS['small'][0])
+        writer = DeckWriter(template)
+        path, = writer.write([2.1e11], [0.3])
+        with open(template, 'w', newline='\n') as f:
+            f.write(self.HEAD + "MAT1    1       2.000+11        .3      2700.\n" + self.TAIL + "$ zmiana\n")
+        path, = writer.write([2.1e11], [0.3])
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('2700.', text)
+        self.assertTrue(text.endswith('$ zmiana\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,24 @@
 import unittest
 import os
+from bdf_format import encode_real, SMALL_FIELD, LARGE_FIELD
+
+
+def real_field_text(value, width):
+    '''Tekst pola rzeczywistego: tekst bez zmian, liczba z pełną dokładnością pola.'''
+    if isinstance(value, str):
+        return value
+    return encode_real(value, width)
+
+
+def nu_field_text(value, width):
+    '''Tekst pola NU: w small field 6 miejsc po przecinku (0.300000), w pozostałych encode_real.'''
+    if isinstance(value, str):
+        return value
+    text = f"{value:.6f}"
+    if width > SMALL_FIELD or len(text) > width:
+        text = encode_real(value, width)
+    return text
+
 
 def modify_material_properties(line, params):
     '''
@@ -21,7 +40,34 @@ def modify_material_properties(line, params):
     or a temperature dependent thermal expansion coefficient
     GE - Structural element damping coefficient
 
-    '''    
+    Obsługiwane są trzy formaty karty: small field (pola po 8 znaków), large field (MAT1*,
+    pola po 16 znaków, E i NU w pierwszej linii) oraz free field (pola oddzielone przecinkami).
+    Liczby są kodowane przez bdf_format.encode_real z maksymalną dokładnością dla szerokości
+    pola; wartości podane jako tekst trafiają do karty bez zmian.
+
+    '''
+    if ',' in line:
+        fields = line.rstrip('\r\n').split(',')
+        fields += [''] * (5 - len(fields))
+        if 'E' in params:
+            fields[2] = real_field_text(params['E'], SMALL_FIELD)
+        if 'NU' in params:
+            fields[4] = nu_field_text(params['NU'], SMALL_FIELD)
+        return ','.join(fields)
+
+    if line[0:8].rstrip().endswith('*'):
+        mat = line[0:8]
+        mid = line[8:24]
+        e = line[24:40]
+        g = line[40:56]
+        nu = line[56:72]
+        cont = line[72:80].rstrip('\r\n')
+        if 'E' in params:
+            e = real_field_text(params['E'], LARGE_FIELD)
+        if 'NU' in params:
+            nu = nu_field_text(params['NU'], LARGE_FIELD)
+        return f"{mat:<8}{mid:<16}{e:<16}{g:<16}{nu:<16}{cont}"
+
     mat = line[0:8]
     mid = line[8:16]
     e = line[16:24]
@@ -33,42 +79,76 @@ def modify_material_properties(line, params):
     ge = line[64:72]
 
     if 'E' in params:
-        e = f"{params['E']}"  
+        e = real_field_text(params['E'], SMALL_FIELD)
     if 'NU' in params:
-        nu = f"{params['NU']:.6f}" 
+        nu = nu_field_text(params['NU'], SMALL_FIELD)
 
-    new_line = f"{mat:<8}{mid:<8}{e:<6}{g:<8}{nu:<8}{rho:<8}{a:<8}{tref:<8}{ge:<8}"
+    new_line = f"{mat:<8}{mid:<8}{e:<8}{g:<8}{nu:<8}{rho:<8}{a:<8}{tref:<8}{ge:<8}"
 
     return new_line
 
 
-def edit_file(file_path, params):
+def variant_path(file_path, params, suffix=''):
+    '''
+    Path of the template variant with the given material data (genetic folder next to the template).
+    suffix (string): deck kind appended to the name (e.g. '_include'), so decks of different kinds
+        never overwrite each other
+    '''
+    dir_path = os.path.dirname(file_path)
+    file_name = os.path.basename(file_path)
+    e_name = real_field_text(params['E'], SMALL_FIELD)
+    return f'{dir_path}/genetic/{file_name.rstrip('.bdf')}_{e_name}_{params['NU']}{suffix}.bdf'
+
+
+def edit_file(file_path, params, mid=None):
     '''
     Replace material properties inside .bdf Nastran file:
     file_path (string): file to be used as template
     params (dictionary): new material data 
+    mid (int): material ID to change (card found by bdf_index.BdfIndex, continuation lines
+        and large/free field supported); None - the first MAT card
 
     Example:
     
     params = {'E': '2.100+11', 'NU' : 0.25}
     '''
+    if mid is not None:
+        return _edit_material_card(file_path, params, mid)
+
     with open(file_path, 'r') as f:
         lines = f.readlines()
 
     for i, line in enumerate(lines):
         if line.startswith('MAT'):
-            new_props = modify_material_properties(line,params)
+            new_props = modify_material_properties(line.rstrip('\r\n'), params)
             lines[i] = new_props + '\n'
             break
-    dir_path = os.path.dirname(file_path)
-    file_name = os.path.basename(file_path)
-    new_file = f'{dir_path}/genetic/{file_name.rstrip('.bdf')}_{params['E']}_{params['NU']}.bdf'
+    new_file = variant_path(file_path, params)
     with open(new_file, 'w') as file:
         file.writelines(lines)
 
     return new_file
 
 
+def _edit_material_card(file_path, params, mid):
+    # Import w funkcji - bdf_index korzysta z modify_material_properties z tego modułu
+    from bdf_index import BdfIndex, material_card
+
+    index = BdfIndex(file_path)
+    name = index.material(mid)
+    card_path, offset, length = index.locate(name, mid)
+    if os.path.abspath(card_path) != os.path.abspath(file_path):
+        raise ValueError(f"Karta {name} {mid} jest w pliku INCLUDE {card_path} - zmień ją w tym pliku.")
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    card = material_card(data[offset:offset + length].decode('latin-1'), params).encode('latin-1')
+    new_file = variant_path(file_path, params)
+    with open(new_file, 'wb') as file:
+        file.write(data[:offset] + card + data[offset + length:])
+
+    return new_file
+
+
 def format_scientific(value, total_length=8):
     # Zakładamy, że potrzebujemy przynajmniej 1 cyfrę przed kropką, kropkę oraz 'e' i znak wykładnika
     base_length = 4  # Dla 'e±'
@@ -105,6 +185,20 @@ class TestExtractMaterialProperties(unittest.TestCase):
         result = modify_material_properties(line,params)
         self.assertEqual(result,expected_result,"Wynik nie zgadza się z oczekiwanym")
 
+    def test_modify_material_properties_formats(self):
+        line = "MAT1    1       2.000+11        0.3000007850.0001.200-0522.00000"
+        result = modify_material_properties(line, {'E': 2.0123456e11, 'NU': 0.25})
+        self.assertEqual(result[16:24], "20123.+7")
+        self.assertEqual(result[32:], "0.2500007850.0001.200-0522.00000        ")
+
+        line = "MAT1*   1               2.0+11                          .3              +\n"
+        result = modify_material_properties(line, {'E': 2.0123456789e11, 'NU': 0.25})
+        self.assertEqual(result, "MAT1*   1               201234567890.                   .25             +")
+
+        line = "MAT1,1,2.0+11,,.3,7850.\n"
+        result = modify_material_properties(line, {'E': 2.0123456e11, 'NU': 0.25})
+        self.assertEqual(result, "MAT1,1,20123.+7,,0.250000,7850.")
+
 
 if __name__ == '__main__':
     # #unittest.main()
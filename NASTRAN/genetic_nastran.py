@@ -1,4 +1,5 @@
 import datetime
+import time
 import numpy as np
 import scipy.stats
 import random
@@ -6,9 +7,16 @@ import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation 
 from nastran_run import run_solver_and_extract_frequencies
 from edit_material_prop import edit_file
-from nastran_run import run_solver_and_extract_frequencies
+from deck_writer import write_generation
+from bdf_format import encode_real, encode_reals, SMALL_FIELD
+from nastran_batch import solve_batch
+from solver_supervisor import statystyki
+from history_store import HistoryStore, ArchiveIndex, template_digest
 import os
+import json
 import shutil
+import threading
+import unittest
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Definicja klasy Osobnik
@@ -28,9 +36,12 @@ class Osobnik:
         __str__(self): Reprezentacja tekstowa osobnika.
         oblicz_dopasowanie(self, result_solver, result_measurement): Oblicza dopasowanie osobnika na podstawie wyników solvera i pomiarów.
         oblicz_dopasowanie_TEST(self, idealny_Y, idealny_v): Oblicza dopasowanie osobnika do idealnych wartości modułu Younga i liczby Poissona.
+
+    Osobnik niesie tylko genom - plik BDF (file_path) powstaje dopiero przy przekazaniu do solvera
+    (przetwarzaj_populacje), więc osobniki pośrednie i już policzone nie są zapisywane na dysk.
     """
 
-    def __init__(self, young, poisson, file_path):
+    def __init__(self, young, poisson, file_path=None):
         self.young = young
         self.poisson = poisson
         self.dopasowanie = None
@@ -47,6 +58,11 @@ class Osobnik:
         Args:
             result_measurement (list): idealne wyniki częstotliwości drgań
         """
+        # Brak wyników solvera to najgorsze możliwe dopasowanie, a nie RMSE równe 0
+        if not self.freq:
+            self.dopasowanie = float('inf')
+            return self.dopasowanie
+
         # Konwersja częstotliwości obliczonych na float
         freq_float = [float(i) for i in self.freq]
 
@@ -82,38 +98,34 @@ class Osobnik:
         self.file_path = edit_file(basemodel, params)
     
     def solve_file(self, solver_path):
-        self.freq = run_solver_and_extract_frequencies(solver_path, self.file_path)
+        # solver_path może być też solverem w procesie (np. WarmStartModalSolver) - wtedy plik BDF nie jest potrzebny
+        if callable(solver_path):
+            self.freq = solver_path(self.young, self.poisson)
+        else:
+            self.freq = run_solver_and_extract_frequencies(solver_path, self.file_path)
         
 
 
 
         
 def convert_number_to_nastran(value):
-    value_str = str(int(value))  # Konwersja value na int, a następnie na string
-    if len(value_str) >= 11:
-        out = f"{value_str[0]}.{value_str[1:3]}e+{len(value_str)-1}"
-    else:
-        out = f"{value_str[0]}.{value_str[1:4]}e+{len(value_str)-1}"
-    return out
+    # Maksymalna dokładność, jaką mieści 8-znakowe pole karty (np. 2.0123456e11 -> '20123.+7')
+    return encode_real(value, SMALL_FIELD)
 
-    
-# Funkcja generująca losowe wartości
-def init_random(template):
+
+def init_random_populacja(liczba_osobnikow):
     """
-    Generuje losowe wartości modułu Younga i liczby Poissona dla nowego osobnika.
+    Losowa populacja początkowa, bez plików BDF: E równomiernie w [1 GPa, 300 GPa),
+    NU zaokrąglone do 0.01 w [0, 0.49].
 
     Zwraca:
-        Tuple[float, float]: Para wartości (moduł Younga, liczba Poissona).
+        list[Osobnik]: Nowa populacja.
     """
     young_max = 300e9
-    poisson_max = 0.5
-    initial_v = np.round((np.random.rand())/2,2) 
-    if initial_v == 0.5:
-        initial_v = 0.49
-    initial_Y = 1e9 + np.random.rand() * (young_max-1e9)
-    params = {'E': convert_number_to_nastran(initial_Y), 'NU': initial_v}
-    file_path = edit_file(template, params)
-    return (initial_Y, initial_v, file_path)
+    initial_v = np.round(np.random.rand(liczba_osobnikow) / 2, 2)
+    initial_v[initial_v == 0.5] = 0.49
+    initial_Y = 1e9 + np.random.rand(liczba_osobnikow) * (young_max - 1e9)
+    return [Osobnik(Y, v) for Y, v in zip(initial_Y.tolist(), initial_v.tolist())]
 
 
 def selekcja2(populacja, procent_najlepszych=40):
@@ -136,7 +148,25 @@ def selekcja2(populacja, procent_najlepszych=40):
     # Zwracanie najlepszych osobników
     return posortowana_populacja[:liczba_do_wyboru]
 
-def krzyzowanie(populacja, liczba_potomkow,template):
+def populacja_z_archiwum(archiwum, idealny_FREQ, liczba_osobnikow, min_odleglosc=0.02):
+    """
+    Elita z archiwum policzonych genomów dla nowego celu - dopasowanie liczone z zapisanych
+    częstotliwości, bez solvera (HistoryStore.elite), genomy wzajemnie odległe o min_odleglosc.
+
+    Zwraca:
+        list[Osobnik]: Najwyżej liczba_osobnikow osobników z częstotliwościami i dopasowaniem.
+    """
+    populacja = []
+    for i in archiwum.elite(idealny_FREQ, liczba_osobnikow, min_odleglosc).tolist():
+        rekord = archiwum.record(i)
+        osobnik = Osobnik(rekord['young'], rekord['poisson'])
+        osobnik.freq = rekord['freq']
+        osobnik.oblicz_dopasowanie(idealny_FREQ)
+        populacja.append(osobnik)
+    return populacja
+
+
+def krzyzowanie(populacja, liczba_potomkow):
     """
     Tworzy nową populację poprzez krzyżowanie osobników z danej populacji.
 
@@ -147,21 +177,24 @@ def krzyzowanie(populacja, liczba_potomkow,template):
     Zwraca:
         list[Osobnik]: Nowa populacja potomków.
     """
-    nowa_populacja=[]
-    while len(nowa_populacja) < liczba_potomkow:
+    genomy = []
+    while len(genomy) < liczba_potomkow:
         parent1,parent2 = random.sample(populacja,2) # losowo wybieracm dwóch rodziców
         new_Y = (parent1.young + parent2.young) /2
         new_v = (parent1.poisson + parent2.poisson) /2
-        params = {'E': convert_number_to_nastran(new_Y), 'NU': new_v}
-        file_path = edit_file(template, params)
-        nowa_populacja.append(Osobnik(new_Y,new_v,file_path))
-    return nowa_populacja
-
-def krzyzowanie_z_naciskiem(populacja, liczba_potomkow,template):
-    nowa_populacja = []
-    while len(nowa_populacja) < liczba_potomkow:
+        genomy.append((new_Y, new_v))
+    return [Osobnik(young, poisson) for young, poisson in genomy]
+
+def krzyzowanie_z_naciskiem(populacja, liczba_potomkow):
+    genomy = []
+    # Osobniki bez wyników solvera (dopasowanie = inf) nie mogą być rodzicami - wagi byłyby nan
+    rodzice = [osobnik for osobnik in populacja if np.isfinite(osobnik.dopasowanie)]
+    if len(rodzice) < 2:
+        # Bez dwóch policzonych rodziców nie ma z czego liczyć wag - krzyżowanie z równymi wagami
+        return krzyzowanie(populacja, liczba_potomkow)
+    while len(genomy) < liczba_potomkow:
         # Losowo wybieramy dwóch rodziców
-        parent1, parent2 = random.sample(populacja, 2)
+        parent1, parent2 = random.sample(rodzice, 2)
 
         # Obliczamy wagi na podstawie dopasowania rodziców
         suma_dopasowan = parent1.dopasowanie + parent2.dopasowanie
@@ -173,13 +206,11 @@ def krzyzowanie_z_naciskiem(populacja, liczba_potomkow,template):
         new_v = waga1 * parent1.poisson + waga2 * parent2.poisson
 
         # Tworzymy nowego osobnika z połączonych cech
-        params = {'E': convert_number_to_nastran(new_Y), 'NU': new_v}
-        file_path = edit_file(template, params)
-        nowa_populacja.append(Osobnik(new_Y, new_v, file_path))
-        
-    return nowa_populacja
+        genomy.append((new_Y, new_v))
 
-def mutacja2(populacja, template, coeff=0.6 ):
+    return [Osobnik(young, poisson) for young, poisson in genomy]
+
+def mutacja2(populacja, coeff=0.6 ):
     """
     Aplikuje mutacje do osobników w populacji z określonym współczynnikiem mutacji.
 
@@ -199,20 +230,21 @@ def mutacja2(populacja, template, coeff=0.6 ):
 
             osobnik.young = (min(max(osobnik.young, 1e9), young_max))
             osobnik.poisson = min(max(osobnik.poisson, 0), poisson_max)
-            params = {'E': convert_number_to_nastran(osobnik.young), 'NU': osobnik.poisson}
-            osobnik.file_path = edit_file(template, params)
+            # Nowy genom - stary plik BDF już do niego nie pasuje
+            osobnik.file_path = None
+            osobnik.freq = None
     return populacja
 ###################################################
 # Differential Evolution
 ###################################################
-def mutacja(populacja, template, F):
+def mutacja(populacja, F):
     """
     W ER mutacja polega na wybraniu trzech różnych wektorów a, b, c z populacji dla każdego targetowego wektora
     x, a następnie utworzeniu wektora mutantu v za pomocą formuły: v = a + F * (b - c), gdzie F jest współczynnikiem mutacji,
     zazwyczaj w przedziale [0.5, 2.0].
     """
     N = len(populacja)
-    nowa_populacja = []
+    genomy = []
     for i in range(N):
         idxs = [idx for idx in range(N) if idx != i]
         a, b, c = np.random.choice(idxs, 3, replace=False)
@@ -224,13 +256,11 @@ def mutacja(populacja, template, F):
         mutant_poisson = np.clip(mutant_poisson, 0, 0.5-1/1000)
         
         # Utworzenie nowego osobnika z mutowanymi wartościami
-        params = {'E': convert_number_to_nastran(mutant_young), 'NU': mutant_poisson}
-        file_path = edit_file(template, params)
-        nowa_populacja.append(Osobnik(mutant_young, mutant_poisson, file_path))
-        
-    return nowa_populacja
+        genomy.append((mutant_young, mutant_poisson))
 
-def rekombinacja(target, mutant, CR, template):
+    return [Osobnik(young, poisson) for young, poisson in genomy]
+
+def rekombinacja(target, mutant, CR):
     """
     W każdej iteracji dla każdego osobnika w populacji wykonujemy rekombinację, aby utworzyć nowego osobnika
     testowego, mieszając atrybuty osobnika mutantu z oryginalnym osobnikiem. Stosuje się losowy lub stały
@@ -241,12 +271,14 @@ def rekombinacja(target, mutant, CR, template):
     new_poisson = mutant.poisson if random.random() < CR else target.poisson
     
     # Utworzenie nowego osobnika z połączonych cech
-    params = {'E': convert_number_to_nastran(new_young), 'NU': new_poisson}
-    file_path = edit_file(template, params)
-    new_osobnik = Osobnik(new_young, new_poisson, file_path)
+    new_osobnik = Osobnik(new_young, new_poisson)
     
     return new_osobnik
 
+def rekombinacja_populacji(populacja, mutanci, CR):
+    """Rekombinacja (jak rekombinacja) dla całej populacji."""
+    return [rekombinacja(target, mutant, CR) for target, mutant in zip(populacja, mutanci)]
+
 def selekcja(populacja, nowa_populacja):
     """
     Porównujemy nowego osobnika z oryginalnym osobnikiem w populacji. Jeśli nowy osobnik ma lepsze 
@@ -264,8 +296,216 @@ def przetwarzaj_osobnika(osobnik, idealny_FREQ, solver_path):
     osobnik.solve_file(solver_path)
     osobnik.oblicz_dopasowanie(idealny_FREQ)
     return osobnik
-    
-def algorytm(F, CR, solver_path, template, initial_size):
+
+
+def klucz_genomu(young, poisson):
+    """
+    Kanoniczny klucz genomu - dokładnie te teksty, które trafiają do karty MAT1.
+
+    Dwa osobniki o tym samym kluczu dają identyczny plik BDF, więc wystarczy je policzyć raz.
+    Dokładność klucza (epsilon) wynika z formatu karty, a nie z arbitralnie dobranego progu.
+    """
+    return klucze_genomow([young], [poisson])[0]
+
+
+def klucze_genomow(young, poisson):
+    """Klucze genomu (jak klucz_genomu) dla wielu osobników naraz - E kodowane wektorowo."""
+    if len(young) == 0:
+        return []
+    return list(zip(encode_reals(young, SMALL_FIELD).tolist(), (f"{nu:.6f}" for nu in poisson)))
+
+
+def grupuj_duplikaty(populacja):
+    """
+    Grupuje osobniki według klucza genomu.
+
+    Zwraca:
+        dict[tuple, list[Osobnik]]: klucz -> osobniki dające ten sam plik BDF (w kolejności z populacji).
+    """
+    grupy = {}
+    klucze = klucze_genomow([osobnik.young for osobnik in populacja], [osobnik.poisson for osobnik in populacja])
+    for osobnik, klucz in zip(populacja, klucze):
+        grupy.setdefault(klucz, []).append(osobnik)
+    return grupy
+
+
+class PamiecRozwiazan(dict):
+    """
+    Pamięć wyników solvera (klucz genomu -> częstotliwości) z archiwum poprzednich przebiegów.
+
+    Nowe wyniki trafiają do słownika, a klucze spoza niego są szukane w archiwum (ArchiveIndex) -
+    genomy policzone we wcześniejszych przebiegach nie uruchamiają solvera.
+    """
+
+    def __init__(self, archiwum=None):
+        super().__init__()
+        self.archiwum = archiwum
+
+    def __contains__(self, klucz):
+        return dict.__contains__(self, klucz) or (self.archiwum is not None and klucz in self.archiwum)
+
+    def __getitem__(self, klucz):
+        if dict.__contains__(self, klucz) or self.archiwum is None:
+            return dict.__getitem__(self, klucz)
+        return self.archiwum[klucz]
+
+
+def nowe_genomy(populacja, rozwiazane):
+    """
+    Osobniki, które przetwarzaj_populacje przekaże do solvera - po jednym na klucz genomu
+    spoza pamięci rozwiązań (wołane przed przetwarzaj_populacje). Tylko one trafiają do historii:
+    duplikaty i genomy z pamięci lub archiwum są już zapisane.
+    """
+    return [osobniki[0] for klucz, osobniki in grupuj_duplikaty(populacja).items() if klucz not in rozwiazane]
+
+
+def rozdaj_wynik(osobniki, freq, idealny_FREQ):
+    """Przypisuje częstotliwości wszystkim osobnikom o tym samym kluczu genomu."""
+    for osobnik in osobniki:
+        osobnik.freq = freq
+        osobnik.oblicz_dopasowanie(idealny_FREQ)
+
+
+def przetwarzaj_paczke(klucze, solver_path, template, mid=None):
+    """Liczy paczkę unikalnych genomów jednym zadaniem NASTRAN (jeden SUBCASE na genom)."""
+    params_list = [{'E': e, 'NU': nu} for e, nu in klucze]
+    return solve_batch(solver_path, template, params_list, mid)
+
+
+def materializuj(do_policzenia, template, batch_size=1, include=False, mid=None):
+    '''
+    Zapisuje pliki BDF przedstawicieli genomów przekazywanych do solvera (jednym wywołaniem
+    write_generation). W trybie wsadowym nastran_batch buduje własny deck, więc nic nie jest zapisywane.
+
+    do_policzenia (dict): klucz genomu -> osobniki (jak z grupuj_duplikaty).
+    include (bool): Małe decki z kartą MAT i INCLUDE wspólnego pliku siatki (deck_writer).
+    mid (int): Numer zmienianego materiału; None - pierwsza karta MAT szablonu.
+    '''
+    if batch_size > 1:
+        return
+    brak = [osobniki[0] for osobniki in do_policzenia.values() if osobniki[0].file_path is None]
+    if not brak:
+        return
+    if template is None:
+        raise ValueError("Osobniki bez pliku BDF - przetwarzaj_populacje wymaga szablonu (template).")
+    sciezki = write_generation(template, [o.young for o in brak], [o.poisson for o in brak], include=include,
+                               mid=mid)
+    for osobnik, sciezka in zip(brak, sciezki):
+        osobnik.file_path = sciezka
+
+
+def przetwarzaj_populacje(populacja, idealny_FREQ, solver_path, rozwiazane, liczba_generacji=0, max_workers=3,
+                          template=None, batch_size=1, include=False, mid=None):
+    """
+    Liczy dopasowanie całej populacji, uruchamiając solver tylko raz dla każdego unikalnego pliku BDF.
+
+    Parametry:
+        populacja (list[Osobnik]): Osobniki do policzenia.
+        idealny_FREQ (list): Docelowe częstotliwości.
+        solver_path (str | callable): Ścieżka do solvera albo solver w procesie (warm_start_solver).
+        rozwiazane (dict): Pamięć wyników z poprzednich generacji (klucz genomu -> częstotliwości),
+            uzupełniana w miejscu.
+        liczba_generacji (int): Numer generacji (tylko do wydruku).
+        max_workers (int): Liczba równoległych solverów.
+        template (str): Szablon BDF - z niego powstają pliki osobników bez file_path (materializuj)
+            i deck trybu wsadowego.
+        batch_size (int): Liczba genomów liczonych jednym zadaniem NASTRAN (nastran_batch);
+            1 - każdy osobnik osobno ze swojego pliku BDF.
+        include (bool): Pliki BDF osobników jako małe decki z INCLUDE wspólnej siatki.
+        mid (int): Numer zmienianego materiału (pliki BDF i deck wsadowy); None - pierwsza karta MAT.
+
+    Zwraca:
+        int: Liczba unikalnych genomów przekazanych do solvera.
+    """
+    grupy = grupuj_duplikaty(populacja)
+
+    # Klucze policzone już wcześniej - wynik rozdajemy bez uruchamiania solvera
+    do_policzenia = {}
+    for klucz, osobniki in grupy.items():
+        if klucz in rozwiazane:
+            rozdaj_wynik(osobniki, rozwiazane[klucz], idealny_FREQ)
+        else:
+            do_policzenia[klucz] = osobniki
+
+    # Tryb wsadowy dotyczy tylko NASTRAN - solver w procesie liczy osobniki pojedynczo
+    if callable(solver_path):
+        batch_size = 1
+    else:
+        materializuj(do_policzenia, template, batch_size, include, mid)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if batch_size > 1:
+            klucze = list(do_policzenia)
+            paczki = [klucze[i:i + batch_size] for i in range(0, len(klucze), batch_size)]
+            future_to_klucze = {executor.submit(przetwarzaj_paczke, paczka, solver_path, template, mid): paczka
+                                for paczka in paczki}
+        else:
+            # Jeden przedstawiciel na unikalny plik BDF
+            future_to_klucze = {executor.submit(przetwarzaj_osobnika, osobniki[0], idealny_FREQ, solver_path): [klucz]
+                                for klucz, osobniki in do_policzenia.items()}
+
+        for future in as_completed(future_to_klucze):
+            klucze = future_to_klucze[future]
+            try:
+                data = future.result()
+            except Exception as exc:
+                # Nieudane rozwiązanie nie trafia do pamięci - osobnik dostaje najgorsze dopasowanie
+                for klucz in klucze:
+                    for osobnik in do_policzenia[klucz]:
+                        osobnik.freq = None
+                        osobnik.dopasowanie = float('inf')
+                    print(f'{liczba_generacji:4} - E={klucz[0]} NU={klucz[1]} wygenerował wyjątek: {exc}')
+                continue
+
+            wyniki = data if batch_size > 1 else [data.freq]
+            for klucz, freq in zip(klucze, wyniki):
+                osobniki = do_policzenia[klucz]
+                rozwiazane[klucz] = freq
+                rozdaj_wynik(osobniki, freq, idealny_FREQ)
+                print(f'{liczba_generacji:4} - DOPASOWANIE:\t{osobniki[0]} (x{len(osobniki)})')
+
+    print(f'{liczba_generacji:4} - SOLVER: {len(do_policzenia)} z {len(populacja)} osobników '
+          f'({len(populacja) - len(do_policzenia)} duplikatów lub policzonych wcześniej pominięto)')
+    return len(do_policzenia)
+
+def zapisz_historie(historia, populacja, liczba_generacji, run, seed, czas):
+    '''Dopisuje policzoną populację do historii optymalizacji (jeden zapis na generację).'''
+    if historia is None:
+        return
+    historia.append(liczba_generacji, [o.young for o in populacja], [o.poisson for o in populacja],
+                    [o.dopasowanie for o in populacja], freq=[o.freq for o in populacja],
+                    run=run, seed=seed, eval_time=czas)
+
+
+def wczytaj_czestotliwosci(sciezka):
+    '''
+    Zmierzone częstotliwości własne z pliku JSON zapisanego przez RedPitaya/redpitaya_modal.save_target.
+
+    Zwraca listę częstotliwości w formacie przyjmowanym przez Osobnik.oblicz_dopasowanie.
+    Niepewności ('sigma') są tylko informacją o pomiarze - dopasowanie (RMSE) ich nie używa.
+    '''
+    with open(sciezka) as f:
+        return [float(freq) for freq in json.load(f)['freq']]
+
+
+def algorytm(F, CR, solver_path, template, initial_size, batch_size=1, idealny_FREQ=None, include=False,
+             historia=None, seed=None, archiwum=None, udzial_archiwum=0.5, mid=None):
+    '''
+    idealny_FREQ (list | string): Docelowe częstotliwości albo plik JSON z pomiaru
+        (redpitaya_modal.save_target); domyślnie częstotliwości modelu wzorcowego.
+    include (bool): Decki osobników jako karta MAT + INCLUDE wspólnego pliku siatki
+        zamiast pełnych kopii szablonu.
+    historia (str | HistoryStore): Magazyn historii optymalizacji - zapisywane są genomy
+        policzone przez solver w tym przebiegu (bez duplikatów i wyników z pamięci lub archiwum).
+        Magazyn innego szablonu jest odrzucany (ValueError).
+    seed (int): Ziarno generatorów losowych (powtarzalny przebieg, zapisywane w historii).
+    archiwum (str | HistoryStore): Historia wcześniejszych przebiegów dla tego samego szablonu -
+        część populacji początkowej to zróżnicowana elita archiwum względem nowego idealny_FREQ,
+        a genomy z archiwum nie są liczone ponownie. Może to być ten sam magazyn co historia.
+        Tożsamość szablonu (template_digest) musi zgadzać się z zapisaną w archiwum (ValueError).
+    udzial_archiwum (float): Część populacji początkowej z archiwum (reszta losowo).
+    mid (int): Numer optymalizowanego materiału (karta MAT o tym MID); None - pierwsza karta MAT.
+    '''
     # Ścieżka do folderu, który chcesz wyczyścić
     folder_do_wyczyszczenia = r"C:\Users\Grzesiek\Desktop\Doktorat\00_PROJEKT_BADAWCZY\02_SOFTWARE\NASTRAN_INPUT\genetic"
 
@@ -301,33 +541,61 @@ def algorytm(F, CR, solver_path, template, initial_size):
     large_difference_threshold = 1000  # Próg dla "dużej" różnicy w dopasowaniu
     najlepsze_dopasowanie_w_poprzedniej_generacji = None
 
-    # Tworzenie początkowej populacji    
-    populacja = [Osobnik(*init_random(template)) for _ in range(initial_size)]   
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+    # Wyniki w magazynach są ważne tylko dla tego samego szablonu (ten sam model, inne E i NU)
+    model = template_digest(template)
+    if isinstance(historia, str):
+        historia = HistoryStore(historia, model=model)
+    elif historia is not None:
+        historia.check_model(model)
+    run = historia.next_run() if historia is not None else 0
+    if isinstance(archiwum, str):
+        archiwum = historia if historia is not None and os.path.abspath(archiwum) == os.path.abspath(historia.path) \
+            else HistoryStore(archiwum, model=model)
+    elif archiwum is not None:
+        archiwum.check_model(model)
+
+    # Wyniki solvera dla już policzonych plików BDF (klucz genomu -> częstotliwości),
+    # razem z wynikami z archiwum
+    rozwiazane = PamiecRozwiazan(ArchiveIndex(archiwum) if archiwum is not None else None)
 
     
     # DEFINIOWANIE IDEALNEGO WYNIKU
     idealny_Y = 2.000e+11
     idealny_v = 0.3
-    idealny_FREQ = [1.617939E-02,
-                    1.075608E+04,
-                    1.075608E+04,
-                    2.255294E+04,
-                    2.255294E+04,
-                    2.265445E+04,
-                    1.382356E+05,
-                    1.382356E+05,
-                    1.757281E+05,
-                    1.766887E+05,
-                    1.766887E+05,
-                    1.925443E+05,
-                    1.925443E+05,
-                    1.925518E+05,
-                    1.939036E+05,
-                    2.081178E+05,
-                    2.125266E+05,
-                    2.125266E+05,
-                    2.164848E+05,
-                    2.164848E+05]
+    if isinstance(idealny_FREQ, str):
+        idealny_FREQ = wczytaj_czestotliwosci(idealny_FREQ)
+    elif idealny_FREQ is None:
+        idealny_FREQ = [1.617939E-02,
+                        1.075608E+04,
+                        1.075608E+04,
+                        2.255294E+04,
+                        2.255294E+04,
+                        2.265445E+04,
+                        1.382356E+05,
+                        1.382356E+05,
+                        1.757281E+05,
+                        1.766887E+05,
+                        1.766887E+05,
+                        1.925443E+05,
+                        1.925443E+05,
+                        1.925518E+05,
+                        1.939036E+05,
+                        2.081178E+05,
+                        2.125266E+05,
+                        2.125266E+05,
+                        2.164848E+05,
+                        2.164848E+05]
+
+    # Tworzenie początkowej populacji (ciepły start - elita archiwum względem nowego celu)
+    populacja = []
+    if archiwum is not None:
+        populacja = populacja_z_archiwum(archiwum, idealny_FREQ, int(initial_size * udzial_archiwum))
+        print(f'Z ARCHIWUM: {len(populacja)} osobników, najlepsze dopasowanie '
+              f'{min((o.dopasowanie for o in populacja), default=float("inf"))}')
+    populacja += init_random_populacja(initial_size - len(populacja))
     liczba_generacji = 0  # Licznik generacji
     max_generacji = 100  # Maksymalna liczba generacji jako warunek bezpieczeństwa
     idealne_dopasowanie = 500  # Pożądany poziom dopasowania
@@ -345,20 +613,13 @@ def algorytm(F, CR, solver_path, template, initial_size):
         y = []
                 
         # Obliczanie dopasowania dla każdego osobnika
-
-        # Ustawienie liczby wątków na 2, ale można dostosować do możliwości sprzętowych
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            # Użycie mapowania executora do przetwarzania listy osobników równolegle
-            future_to_osobnik = {executor.submit(przetwarzaj_osobnika, osobnik, idealny_FREQ, solver_path): osobnik for osobnik in populacja}
-            
-            for future in as_completed(future_to_osobnik):
-                osobnik = future_to_osobnik[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print(f'{osobnik} wygenerował wyjątek: {exc}')
-                else:
-                    print(f'{liczba_generacji:4} - DOPASOWANIE:\t{data}')
+        # (duplikaty i osobniki policzone w poprzednich generacjach nie uruchamiają solvera)
+        t0 = time.perf_counter()
+        nowe = nowe_genomy(populacja, rozwiazane)
+        przetwarzaj_populacje(populacja, idealny_FREQ, solver_path, rozwiazane, liczba_generacji,
+                              template=template, batch_size=batch_size, include=include, mid=mid)
+        # Po generacji 0 populacja to tylko zapisane już osobniki (wygrane selekcji) - nowe jest puste
+        zapisz_historie(historia, nowe, liczba_generacji, run, seed, time.perf_counter() - t0)
         
         # for index, osobnik in enumerate(populacja):
         #     osobnik.solve_file(solver_path)
@@ -367,30 +628,23 @@ def algorytm(F, CR, solver_path, template, initial_size):
         #     # Sprawdzenie, czy któryś z osobników osiągnął pożądane dopasowanie
             
 
-        if any((osobnik.dopasowanie <= idealne_dopasowanie and osobnik.dopasowanie != 0.0) for osobnik in populacja):
+        if any(osobnik.dopasowanie <= idealne_dopasowanie for osobnik in populacja):
             print("Osiągnięto pożądane dopasowanie!")
             break 
 
-        populacja_mod = selekcja2(populacja, procent_najlepszych=30)
-        populacja_mod = krzyzowanie_z_naciskiem(populacja, initial_size, template)
+        # Potomkowie i mutanty są tylko wektorami pośrednimi - pliki BDF powstają dopiero
+        # w przetwarzaj_populacje, dla genomów faktycznie przekazanych do solvera
+        populacja_mod = krzyzowanie_z_naciskiem(populacja, initial_size)
         
         # Mutacja i rekombinacja
-        mutowana_populacja = mutacja(populacja_mod, template, F)
-        rekombinowana_populacja = [rekombinacja(populacja_mod[i], mutowana_populacja[i], CR, template) for i in range(len(populacja_mod))]
-
-        # Ustawienie liczby wątków na 2, ale można dostosować do możliwości sprzętowych
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            # Użycie mapowania executora do przetwarzania listy osobników równolegle
-            future_to_osobnik = {executor.submit(przetwarzaj_osobnika, osobnik, idealny_FREQ, solver_path): osobnik for osobnik in rekombinowana_populacja}
-            
-            for future in as_completed(future_to_osobnik):
-                osobnik = future_to_osobnik[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print(f'{osobnik} wygenerował wyjątek: {exc}')
-                else:
-                    print(f'{liczba_generacji:4} - DOPASOWANIE:\t{data}')
+        mutowana_populacja = mutacja(populacja_mod, F)
+        rekombinowana_populacja = rekombinacja_populacji(populacja_mod, mutowana_populacja, CR)
+
+        t0 = time.perf_counter()
+        nowe = nowe_genomy(rekombinowana_populacja, rozwiazane)
+        przetwarzaj_populacje(rekombinowana_populacja, idealny_FREQ, solver_path, rozwiazane, liczba_generacji,
+                              template=template, batch_size=batch_size, include=include, mid=mid)
+        zapisz_historie(historia, nowe, liczba_generacji, run, seed, time.perf_counter() - t0)
         
         # Ponowne obliczenie dopasowania dla rekombinowanych osobników
         # for osobnik in rekombinowana_populacja:
@@ -399,7 +653,7 @@ def algorytm(F, CR, solver_path, template, initial_size):
         #     print(f'{liczba_generacji:4} -  DOPASOWANIE:\t{osobnik}')
         #     index -=1
 
-        if any((osobnik.dopasowanie <= idealne_dopasowanie and osobnik.dopasowanie != 0.0) for osobnik in populacja):
+        if any(osobnik.dopasowanie <= idealne_dopasowanie for osobnik in populacja):
             print("Osiągnięto pożądane dopasowanie!")
             break 
         # Selekcja
@@ -460,7 +714,7 @@ def algorytm(F, CR, solver_path, template, initial_size):
         osobnik.oblicz_dopasowanie(idealny_FREQ)
 
     # Wyszukaj najlepszego osobnika
-    najlepszy_osobnik = min(populacja, key=lambda osobnik: osobnik.dopasowanie if osobnik.dopasowanie is not None else 0)
+    najlepszy_osobnik = min(populacja, key=lambda osobnik: osobnik.dopasowanie if osobnik.dopasowanie is not None else float('inf'))
 
     print(f"Najlepszy: {najlepszy_osobnik}")
 
@@ -473,10 +727,75 @@ def algorytm(F, CR, solver_path, template, initial_size):
     sekundy = diff.seconds % 60
 
     print(f'CZAS ANALIZY:\t{godziny}h {minuty}m {sekundy}s')
+    print(statystyki.raport())
 
     return(diff)
 
 
+class TestPrzetwarzajPopulacje(unittest.TestCase):
+    IDEALNY_FREQ = [10.0, 20.0]
+
+    def setUp(self):
+        self.wywolania = []
+        self.lock = threading.Lock()
+
+    def solver(self, young, poisson):
+        """Solver w procesie: częstotliwości z genomu, E = 1.5e11 kończy się błędem."""
+        with self.lock:
+            self.wywolania.append(klucz_genomu(young, poisson))
+        if young == 1.5e11:
+            raise RuntimeError('USER FATAL')
+        return [str(young / 1e10), str(20 + poisson)]
+
+    def test_klucz(self):
+        self.assertEqual(klucz_genomu(2.0123456e11, 0.3), ('20123.+7', '0.300000'))
+        self.assertEqual(klucze_genomow([2.0123456e11, 1e9], [0.3, 0.25]),
+                         [('20123.+7', '0.300000'), (convert_number_to_nastran(1e9), '0.250000')])
+        # Różnica poniżej dokładności pola karty daje ten sam klucz
+        grupy = grupuj_duplikaty([Osobnik(2.0123456e11, 0.3), Osobnik(2.01234561e11, 0.3000001),
+                                  Osobnik(2.0e11, 0.3)])
+        self.assertEqual([len(osobniki) for osobniki in grupy.values()], [2, 1])
+
+    def test_duplikaty(self):
+        populacja = [Osobnik(1e11, 0.3), Osobnik(2e11, 0.25), Osobnik(1e11, 0.3), Osobnik(1.5e11, 0.2),
+                     Osobnik(1e11, 0.3), Osobnik(1.5e11, 0.2)]
+        rozwiazane = {}
+        policzone = przetwarzaj_populacje(populacja, self.IDEALNY_FREQ, self.solver, rozwiazane)
+        self.assertEqual(policzone, 3)
+        self.assertEqual(sorted(self.wywolania), sorted(set(self.wywolania)))
+        self.assertEqual(len(self.wywolania), 3)
+
+        for i in (2, 4):
+            self.assertEqual(populacja[i].freq, populacja[0].freq)
+            self.assertEqual(populacja[i].dopasowanie, populacja[0].dopasowanie)
+        self.assertTrue(np.isfinite(populacja[0].dopasowanie))
+        # Nieudane rozwiązanie - najgorsze dopasowanie dla całej grupy i brak wpisu w pamięci
+        for i in (3, 5):
+            self.assertIsNone(populacja[i].freq)
+            self.assertEqual(populacja[i].dopasowanie, float('inf'))
+        self.assertEqual(set(rozwiazane), {klucz_genomu(1e11, 0.3), klucz_genomu(2e11, 0.25)})
+
+        # Kolejna generacja: policzone genomy bez solvera, nieudany liczony ponownie
+        nowa = [Osobnik(2e11, 0.25), Osobnik(1.5e11, 0.2)]
+        self.assertEqual(przetwarzaj_populacje(nowa, self.IDEALNY_FREQ, self.solver, rozwiazane), 1)
+        self.assertEqual(nowa[0].dopasowanie, populacja[1].dopasowanie)
+        self.assertEqual(len(self.wywolania), 4)
+
+    def test_nowe_genomy(self):
+        class Archiwum(dict):
+            pass
+        rozwiazane = PamiecRozwiazan(Archiwum({klucz_genomu(3e11, 0.1): ['30.0', '20.1']}))
+        rozwiazane[klucz_genomu(2e11, 0.25)] = ['20.0', '20.25']
+        populacja = [Osobnik(3e11, 0.1), Osobnik(1e11, 0.3), Osobnik(2e11, 0.25), Osobnik(1e11, 0.3),
+                     Osobnik(1.5e11, 0.2)]
+        nowe = nowe_genomy(populacja, rozwiazane)
+        # Do historii tylko genomy liczone przez solver - bez archiwum, pamięci i duplikatów
+        self.assertEqual(nowe, [populacja[1], populacja[4]])
+        przetwarzaj_populacje(populacja, self.IDEALNY_FREQ, self.solver, rozwiazane)
+        self.assertEqual(sorted(self.wywolania), sorted(klucz_genomu(o.young, o.poisson) for o in nowe))
+        self.assertEqual(nowe_genomy(populacja, rozwiazane), [populacja[4]])
+
+
 if __name__ == "__main__":
     F = 0.1 # współczynnik mutacji
     CR = 0.5 # współczynnik rekombinacji
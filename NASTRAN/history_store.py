@@ -0,0 +1,485 @@
+'''
+Optimizer history on disk: every evaluated genome of every run, append-only and columnar.
+
+A store is a directory:
+    schema.json     - columns (name -> dtype and row shape) and the model identity (template_digest
+                      of the template deck), so frequencies of one model are never reused for another
+    <column>.bin    - one raw little-endian file per column, one row per evaluation
+
+A generation is appended with one write per column; reading opens the columns as memory maps,
+so queries over millions of evaluations touch the pages they need and do not grow the process
+memory. Per-generation statistics use np.minimum.reduceat / np.add.reduceat over the runs of
+equal (run, generation) - the records of a generation are contiguous because they are appended
+together.
+
+Example:
+
+store = HistoryStore('historia')
+store.append(generation=0, young=Y, poisson=v, fitness=rmse, freq=freq, seed=1)
+store.best()                               # najlepszy osobnik wszystkich przebiegów
+gen, best, best_so_far = store.convergence()
+counts, edges = store.histogram('young', bins=50)
+
+Warm start of a new run (new measured target, same model):
+
+store = HistoryStore('historia', model=template_digest('model.bdf'))   # ValueError dla innego modelu
+fitness = store.evaluate(new_target)       # RMSE wszystkich rekordów względem nowego celu
+elite = store.elite(new_target, 20)        # najlepsze, wzajemnie odległe genomy
+index = ArchiveIndex(store)                # wyniki solvera po kluczu genomu, bez ponownego liczenia
+'''
+import os
+import json
+import time
+import hashlib
+import unittest
+import tempfile
+import numpy as np
+from bdf_format import quantize_reals, parse_real, SMALL_FIELD
+
+# Kolumny stałej szerokości: nazwa -> typ (freq ma dodatkowo liczbę częstotliwości ze schematu)
+COLUMNS = {
+    'run': '<i4',           # numer przebiegu algorytmu w tym magazynie
+    'generation': '<i4',
+    'young': '<f8',
+    'poisson': '<f8',
+    'fitness': '<f8',       # RMSE (inf - brak wyników solvera)
+    'timestamp': '<f8',     # time.time() zapisu generacji
+    'eval_time': '<f8',     # czas liczenia paczki, z której pochodzi rekord [s]
+    'seed': '<i8',          # ziarno generatora przebiegu (-1 - brak)
+    'freq': '<f8',          # częstotliwości własne (nan - brak)
+}
+
+# Domyślna liczba zapisywanych częstotliwości (jak wzorcowe idealny_FREQ)
+N_FREQ = 20
+
+# Rekordy przetwarzane naraz w zapytaniach po całej historii
+CHUNK = 1 << 20
+
+# Zakresy genomu w algorytmie (moduł Younga, liczba Poissona) - skala odległości w elite
+GENOME_SCALE = (300e9, 0.5)
+
+
+def template_digest(path):
+    '''Tożsamość modelu: skrót SHA-1 zawartości szablonu BDF.'''
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class HistoryStore:
+    """
+    Magazyn historii optymalizacji (tworzy nowy albo otwiera istniejący).
+
+    Metody:
+        append(...): Dopisuje paczkę rekordów (np. generację).
+        column(name): Kolumna jako memmap (tylko odczyt).
+        best(n): Najlepsze rekordy (najmniejsze fitness).
+        convergence(run): Najlepsze fitness w kolejnych generacjach i najlepsze do danej generacji.
+        histogram(name, ...): Rozkład parametru lub dopasowania.
+    """
+
+    def __init__(self, path, n_freq=N_FREQ, model=None):
+        """
+        Parametry:
+            path (str): Folder magazynu.
+            n_freq (int): Liczba częstotliwości w rekordzie (tylko dla nowego magazynu).
+            model (str): Tożsamość modelu (template_digest); None - bez sprawdzania (np. analiza).
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, 'schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                self.schema = json.load(f)
+        else:
+            self.schema = {'columns': {name: {'dtype': dtype, 'shape': [n_freq] if name == 'freq' else []}
+                                       for name, dtype in COLUMNS.items()}}
+            with open(schema_path, 'w') as f:
+                json.dump(self.schema, f, indent=1)
+        self._maps = {}
+        self._repair()
+        if model is not None:
+            self.check_model(model)
+
+    @property
+    def model(self):
+        '''Tożsamość modelu zapisana w magazynie (None - nieznana).'''
+        return self.schema.get('model')
+
+    def check_model(self, model):
+        '''
+        Sprawdza, czy wyniki w magazynie pochodzą z modelu o tożsamości model. Pusty magazyn
+        przyjmuje tożsamość; magazyn innego modelu albo bez zapisanej tożsamości - ValueError.
+        '''
+        if self.model == model:
+            return
+        if self.model is None and len(self) == 0:
+            self.schema['model'] = model
+            with open(os.path.join(self.path, 'schema.json'), 'w') as f:
+                json.dump(self.schema, f, indent=1)
+            return
+        raise ValueError(f"Magazyn {self.path} zawiera wyniki "
+                         f"{'innego modelu' if self.model else 'modelu o nieznanej tożsamości'} "
+                         f"({self.model}) - częstotliwości nie pasują do szablonu {model}.")
+
+    def _repair(self):
+        '''Obcina kolumny do len(self) rekordów - resztki zapisu przerwanego przed kolumną fitness.'''
+        n = len(self)
+        for name in COLUMNS:
+            dtype, shape = self._row(name)
+            size = n * dtype.itemsize * int(np.prod(shape))
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    @property
+    def n_freq(self):
+        return self.schema['columns']['freq']['shape'][0]
+
+    def _file(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    def _row(self, name):
+        column = self.schema['columns'][name]
+        return np.dtype(column['dtype']), tuple(column['shape'])
+
+    def __len__(self):
+        # Liczba pełnych rekordów - kolumna 'fitness' jest zapisywana jako ostatnia
+        dtype, _ = self._row('fitness')
+        path = self._file('fitness')
+        return os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+
+    def next_run(self):
+        '''Numer nowego przebiegu (ostatni zapisany + 1).'''
+        return int(self.column('run')[-1]) + 1 if len(self) else 0
+
+    def append(self, generation, young, poisson, fitness, freq=None, run=0, seed=-1, eval_time=np.nan,
+               timestamp=None):
+        '''
+        Dopisuje paczkę rekordów - jeden zapis na kolumnę.
+
+        young, poisson, fitness (array-like): Wartości dla każdego rekordu.
+        freq (list): Częstotliwości rekordów (listy różnej długości albo None); obcinane lub
+            uzupełniane nan do n_freq.
+        generation, run, seed, eval_time, timestamp: Skalar wspólny dla paczki albo wartość na rekord.
+
+        Zwraca liczbę dopisanych rekordów.
+        '''
+        young = np.atleast_1d(np.asarray(young, dtype=np.float64))
+        n = len(young)
+        if n == 0:
+            return 0
+        rows = np.full((n, self.n_freq), np.nan)
+        for i, f in enumerate(freq if freq is not None else []):
+            if f:
+                f = np.asarray(f, dtype=np.float64)[:self.n_freq]
+                rows[i, :len(f)] = f
+        values = {
+            'run': run, 'generation': generation, 'young': young, 'poisson': poisson,
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'eval_time': eval_time, 'seed': -1 if seed is None else seed, 'freq': rows,
+            'fitness': fitness,
+        }
+        # 'fitness' na końcu - przerwany zapis nie tworzy rekordu widocznego w __len__
+        for name in [column for column in COLUMNS if column != 'fitness'] + ['fitness']:
+            dtype, shape = self._row(name)
+            data = np.broadcast_to(np.asarray(values[name], dtype=dtype), (n,) + shape)
+            with open(self._file(name), 'ab') as f:
+                f.write(np.ascontiguousarray(data, dtype=dtype).tobytes())
+        self._maps.clear()
+        return n
+
+    def column(self, name):
+        '''Kolumna jako memmap (len(self) rekordów, tylko odczyt).'''
+        n = len(self)
+        if name not in self._maps or len(self._maps[name]) != n:
+            dtype, shape = self._row(name)
+            if n == 0:
+                return np.empty((0,) + shape, dtype=dtype)
+            self._maps[name] = np.memmap(self._file(name), dtype=dtype, mode='r', shape=(n,) + shape)
+        return self._maps[name]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def _chunks(self, n):
+        for start in range(0, n, CHUNK):
+            yield start, min(start + CHUNK, n)
+
+    def record(self, i):
+        '''Rekord i jako słownik (freq bez nan).'''
+        record = {name: self.column(name)[i].item() for name in COLUMNS if name != 'freq'}
+        freq = np.asarray(self.column('freq')[i])
+        record['freq'] = freq[~np.isnan(freq)].tolist()
+        return record
+
+    def best(self, n=1, run=None):
+        '''
+        Numery n rekordów o najmniejszym fitness (rosnąco), w razie potrzeby tylko z przebiegu run.
+        Historia jest przeglądana paczkami po CHUNK rekordów.
+        '''
+        fitness = self.column('fitness')
+        runs = self.column('run')
+        best_idx = np.empty(0, dtype=np.int64)
+        best_fit = np.empty(0)
+        for start, stop in self._chunks(len(self)):
+            fit = np.array(fitness[start:stop])
+            if run is not None:
+                fit[runs[start:stop] != run] = np.inf
+            k = min(n, len(fit))
+            part = np.argpartition(fit, k - 1)[:k]
+            best_idx = np.concatenate([best_idx, part + start])
+            best_fit = np.concatenate([best_fit, fit[part]])
+            keep = np.argsort(best_fit, kind='stable')[:n]
+            best_idx, best_fit = best_idx[keep], best_fit[keep]
+        return best_idx[np.isfinite(best_fit)]
+
+    def evaluate(self, target):
+        '''
+        RMSE częstotliwości wszystkich rekordów względem nowego celu - jak Osobnik.oblicz_dopasowanie,
+        bez uruchamiania solvera (paczkami po CHUNK rekordów).
+
+        Zwraca:
+            ndarray: Dopasowanie każdego rekordu (inf - rekord bez częstotliwości).
+        '''
+        target = np.asarray(target, dtype=np.float64)
+        used = target[:self.n_freq]
+        freq = self.column('freq')
+        fitness = np.full(len(self), np.inf)
+        for start, stop in self._chunks(len(self)):
+            f = np.asarray(freq[start:stop, :len(used)])
+            missing = np.isnan(f)
+            # Brakujące częstotliwości pomijane jak w zip() oblicz_dopasowanie; dzielnik - długość celu
+            rmse = np.sqrt(np.where(missing, 0.0, (f - used) ** 2).sum(axis=1) / len(target))
+            fitness[start:stop] = np.where(missing.all(axis=1), np.inf, rmse)
+        return fitness
+
+    def elite(self, target, n, min_distance=0.02, scale=GENOME_SCALE, candidates=50):
+        '''
+        Zróżnicowana elita dla nowego celu: rekordy od najlepszego, z pominięciem genomów bliższych
+        niż min_distance (odległość euklidesowa genomów podzielonych przez scale) od już wybranych.
+
+        candidates (int): Przeglądanych jest najwyżej n * candidates najlepszych rekordów.
+
+        Zwraca:
+            ndarray: Numery rekordów (rosnące dopasowanie), najwyżej n.
+        '''
+        fitness = self.evaluate(target)
+        finite = np.flatnonzero(np.isfinite(fitness))
+        k = min(n * candidates, len(finite))
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        order = finite[np.argpartition(fitness[finite], k - 1)[:k]]
+        order = order[np.argsort(fitness[order], kind='stable')]
+        genome = np.column_stack([self.column('young')[order] / scale[0], self.column('poisson')[order] / scale[1]])
+
+        chosen = []
+        for i in range(len(order)):
+            if chosen and np.min(np.hypot(*(genome[chosen] - genome[i]).T)) < min_distance:
+                continue
+            chosen.append(i)
+            if len(chosen) == n:
+                break
+        return order[chosen]
+
+    def _groups(self, run=None):
+        '''Początki grup rekordów o tym samym (run, generation) i zakres rekordów przebiegu.'''
+        runs = self.column('run')
+        generations = self.column('generation')
+        if run is None:
+            start, stop = 0, len(self)
+        else:
+            # Rekordy przebiegu są ciągłe - przebiegi są dopisywane jeden po drugim
+            where = np.flatnonzero(np.asarray(runs) == run)
+            start, stop = (int(where[0]), int(where[-1]) + 1) if len(where) else (0, 0)
+        change = (np.diff(runs[start:stop]) != 0) | (np.diff(generations[start:stop]) != 0)
+        return np.concatenate(([0], np.flatnonzero(change) + 1)), start, stop
+
+    def convergence(self, run=None):
+        '''
+        Krzywa zbieżności.
+
+        Zwraca:
+            Tuple[ndarray, ndarray, ndarray]: Numer generacji, najlepsze fitness w generacji
+            i najlepsze fitness do tej generacji (w kolejności zapisu; dla kilku przebiegów
+            najlepsze do danej chwili liczone jest w obrębie przebiegu).
+        '''
+        if len(self) == 0:
+            empty = np.empty(0)
+            return empty.astype(np.int32), empty, empty
+        groups, start, stop = self._groups(run)
+        if stop == start:
+            empty = np.empty(0)
+            return empty.astype(np.int32), empty, empty
+        fitness = self.column('fitness')[start:stop]
+        best = np.minimum.reduceat(fitness, groups)
+        generation = np.asarray(self.column('generation')[start:stop][groups])
+        run_of_group = np.asarray(self.column('run')[start:stop][groups])
+        # Najlepsze do danej generacji - akumulacja osobno w każdym przebiegu
+        best_so_far = best.copy()
+        edges = np.concatenate(([0], np.flatnonzero(np.diff(run_of_group) != 0) + 1, [len(best)]))
+        for a, b in zip(edges[:-1], edges[1:]):
+            best_so_far[a:b] = np.minimum.accumulate(best[a:b])
+        return generation, best, best_so_far
+
+    def generation_stats(self, run=None):
+        '''
+        Statystyki generacji: liczba rekordów, średnia i odchylenie standardowe skończonych
+        wartości fitness (np.add.reduceat).
+
+        Zwraca:
+            dict[str, ndarray]: 'generation', 'count', 'mean', 'std'.
+        '''
+        groups, start, stop = self._groups(run)
+        fitness = np.asarray(self.column('fitness')[start:stop])
+        finite = np.isfinite(fitness)
+        values = np.where(finite, fitness, 0.0)
+        count = np.add.reduceat(finite.astype(np.int64), groups) if stop > start else np.empty(0, np.int64)
+        total = np.add.reduceat(values, groups) if stop > start else np.empty(0)
+        total2 = np.add.reduceat(values ** 2, groups) if stop > start else np.empty(0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(total2 / count - mean ** 2, 0))
+        return {'generation': np.asarray(self.column('generation')[start:stop][groups]) if stop > start
+                else np.empty(0, np.int32), 'count': count, 'mean': mean, 'std': std}
+
+    def histogram(self, name, bins=50, range=None, generation=None, run=None):
+        '''
+        Rozkład kolumny (young, poisson, fitness ...) - liczony paczkami, bez wczytywania historii.
+
+        range (tuple): Zakres przedziałów; domyślnie min i max skończonych wartości.
+        generation, run (int): Tylko rekordy tej generacji / przebiegu.
+
+        Zwraca:
+            Tuple[ndarray, ndarray]: Liczności i krawędzie przedziałów (jak np.histogram).
+        '''
+        column = self.column(name)
+        n = len(self)
+
+        def selected(start, stop):
+            values = np.asarray(column[start:stop], dtype=np.float64)
+            mask = np.isfinite(values)
+            if generation is not None:
+                mask &= self.column('generation')[start:stop] == generation
+            if run is not None:
+                mask &= self.column('run')[start:stop] == run
+            return values[mask]
+
+        if range is None:
+            low, high = np.inf, -np.inf
+            for start, stop in self._chunks(n):
+                values = selected(start, stop)
+                if len(values):
+                    low, high = min(low, values.min()), max(high, values.max())
+            range = (low, high) if low <= high else (0.0, 1.0)
+        counts = np.zeros(bins, dtype=np.int64)
+        edges = np.histogram_bin_edges([], bins=bins, range=range)
+        for start, stop in self._chunks(n):
+            counts += np.histogram(selected(start, stop), bins=edges)[0]
+        return counts, edges
+
+
+class ArchiveIndex:
+    """
+    Wyniki solvera z historii dostępne po kluczu genomu (tekst E w karcie, NU z 6 miejscami -
+    jak genetic_nastran.klucz_genomu).
+
+    Klucze są trzymane jako posortowane tablice liczb (8 + 8 + 8 bajtów na rekord), a częstotliwości
+    czytane z memmap dopiero przy odczycie - indeks milionów rekordów nie buduje słownika.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        freq = store.column('freq')
+        young, poisson, rows = [], [], []
+        for start, stop in store._chunks(len(store)):
+            have = np.flatnonzero(~np.isnan(np.asarray(freq[start:stop])).all(axis=1))
+            # Wartości, które NASTRAN odczyta z karty - ten sam genom daje tę samą parę liczb
+            young.append(quantize_reals(np.asarray(store.column('young')[start:stop])[have], SMALL_FIELD))
+            poisson.append(np.char.mod('%.6f', np.asarray(store.column('poisson')[start:stop])[have]).astype(np.float64))
+            rows.append(have + start)
+        young, poisson, rows = (np.concatenate(c) if c else np.empty(0) for c in (young, poisson, rows))
+        order = np.lexsort((poisson, young))
+        self.young, self.poisson, self.rows = young[order], poisson[order], rows[order].astype(np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _find(self, key):
+        e, nu = parse_real(key[0]), float(key[1])
+        lo, hi = np.searchsorted(self.young, e, 'left'), np.searchsorted(self.young, e, 'right')
+        i = lo + int(np.searchsorted(self.poisson[lo:hi], nu))
+        return int(self.rows[i]) if i < hi and self.poisson[i] == nu else None
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        '''Częstotliwości zapisane dla genomu.'''
+        row = self._find(key)
+        if row is None:
+            raise KeyError(key)
+        freq = np.asarray(self.store.column('freq')[row])
+        return freq[~np.isnan(freq)].tolist()
+
+
+class TestHistoryStore(unittest.TestCase):
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = HistoryStore(path, n_freq=3)
+            for run in range(2):
+                for generation in range(4):
+                    fitness = np.array([10.0, 5.0, np.inf]) / (generation + 1) + run
+                    store.append(generation, [1e11, 2e11, 3e11], [0.3, 0.2, 0.1], fitness,
+                                 freq=[[1.0, 2.0], None, [1.0, 2.0, 3.0, 4.0]], run=run, seed=7)
+            store = HistoryStore(path)
+            self.assertEqual(len(store), 24)
+            self.assertEqual(store.next_run(), 2)
+            self.assertEqual(store.record(1)['freq'], [])
+            self.assertEqual(store.record(2)['freq'], [1.0, 2.0, 3.0])
+            self.assertEqual(store.best(2).tolist(), [10, 7])
+            generation, best, best_so_far = store.convergence(run=1)
+            self.assertEqual(generation.tolist(), [0, 1, 2, 3])
+            self.assertTrue(np.allclose(best, [6.0, 3.5, 5 / 3 + 1, 2.25]))
+            self.assertTrue(np.allclose(store.generation_stats()['count'], 2))
+            counts, _ = store.histogram('poisson', bins=3, range=(0.05, 0.35))
+            self.assertEqual(counts.tolist(), [8, 8, 8])
+            self.assertEqual(store.histogram('fitness', bins=2, generation=0, run=0)[0].sum(), 2)
+
+    def test_warm_start(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = HistoryStore(path, n_freq=2)
+            young = np.array([1e11, 1.0001e11, 2e11, 3e11])
+            store.append(0, young, [0.3, 0.3, 0.25, 0.1], np.zeros(4),
+                         freq=[[10.0, 20.0], [10.0, 20.1], [14.0, 28.0], None])
+            fitness = store.evaluate([10.0, 20.0])
+            self.assertTrue(np.allclose(fitness[:3], [0.0, np.sqrt(0.01 / 2), np.sqrt(40.0)]))
+            self.assertEqual(fitness[3], np.inf)
+            # Drugi genom jest tuż obok pierwszego - elita go pomija
+            self.assertEqual(store.elite([10.0, 20.0], 3).tolist(), [0, 2])
+            index = ArchiveIndex(store)
+            self.assertEqual(len(index), 3)
+            self.assertEqual(index[('2.+11', '0.250000')], [14.0, 28.0])
+            self.assertNotIn(('3.+11', '0.100000'), index)
+            self.assertNotIn(('2.+11', '0.250001'), index)
+
+    def test_model(self):
+        with tempfile.TemporaryDirectory() as path:
+            template = os.path.join(path, 'model.bdf')
+            with open(template, 'w') as f:
+                f.write('SOL 103\nCEND\nBEGIN BULK\nENDDATA\n')
+            model = template_digest(template)
+            store = HistoryStore(os.path.join(path, 'a'), model=model)
+            store.append(0, [1e11], [0.3], [1.0], freq=[[10.0]])
+            self.assertEqual(HistoryStore(store.path).model, model)
+            HistoryStore(store.path, model=model)
+            with self.assertRaises(ValueError):
+                HistoryStore(store.path, model='0' * 40)
+            # Niepusty magazyn bez tożsamości modelu nie jest dopasowywany do żadnego modelu
+            legacy = HistoryStore(os.path.join(path, 'b'))
+            legacy.append(0, [1e11], [0.3], [1.0])
+            with self.assertRaises(ValueError):
+                HistoryStore(legacy.path, model=model)
+
+
+if __name__ == '__main__':
+    unittest.main()
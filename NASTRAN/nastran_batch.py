@@ -0,0 +1,456 @@
+'''
+Batch mode: many candidates solved by a single NASTRAN job (SOL 103).
+
+The template mesh is copied once per candidate with all entity IDs (grids, elements, properties,
+materials) shifted by i * stride, so the copies are disconnected models in one deck. Copy i gets
+the candidate's E/NU in its first MAT1 card. Each candidate has its own SUBCASE whose SPC set
+clamps every other copy (SPC1 ... THRU ... ranges), so the eigenvalue table of subcase i+1 holds
+exactly the modes of candidate i. Dependent (m-set) grids of rigid elements (RBE2, RBAR) are left
+out of the clamp ranges - NASTRAN rejects DOFs that are both dependent and constrained (UFM 2101A);
+they follow their clamped independent grids. Process start-up, licence checkout, input reading and matrix
+assembly are paid once per batch instead of once per candidate.
+'''
+import os
+import math
+import hashlib
+import unittest
+import tempfile
+from bdf_format import format_card, SMALL_FIELD
+from edit_material_prop import real_field_text, nu_field_text
+from nastran_run import run_solver, extract_frequencies_by_subcase
+from solver_supervisor import SolverError, BRAK_WYNIKOW, DEFAULT_TIMEOUT
+
+
+# Karty z numerami do przesunięcia: nazwa -> pozycje pól (od 1, po nazwie karty).
+# 'all' - wszystkie pola całkowite (elementy bryłowe ...),
+# 'all_except_3' - wszystkie pola całkowite poza trzecim (RBE2: EID, GN, GMi - bez składowych CM)
+ID_FIELDS = {
+    'GRID': [1],
+    'CQUAD4': [1, 2, 3, 4, 5, 6],
+    'CQUADR': [1, 2, 3, 4, 5, 6],
+    'CQUAD8': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+    'CTRIA3': [1, 2, 3, 4, 5],
+    'CTRIAR': [1, 2, 3, 4, 5],
+    'CTRIA6': [1, 2, 3, 4, 5, 6, 7, 8],
+    'CHEXA': 'all',
+    'CPENTA': 'all',
+    'CTETRA': 'all',
+    'CBAR': [1, 2, 3, 4],
+    'CBEAM': [1, 2, 3, 4],
+    'CROD': [1, 2, 3, 4],
+    'CONROD': [1, 2, 3, 4],
+    'CELAS1': [1, 2, 3, 5],
+    'CONM2': [1, 2],
+    'RBE2': 'all_except_3',
+    'RBAR': [1, 2, 3],
+    'PSHELL': [1, 2, 4, 6, 11],
+    'PSOLID': [1, 2],
+    'PBAR': [1, 2],
+    'PBARL': [1, 2],
+    'PBEAM': [1, 2],
+    'PBEAML': [1, 2],
+    'PROD': [1, 2],
+    'PELAS': [1],
+    'MAT1': [1],
+    'MAT2': [1],
+    'MAT8': [1],
+    'MAT9': [1],
+    'SPC': [2, 5],
+    'SPC1': 'all_from_3',
+}
+
+# Największy numer karty w NASTRAN
+MAX_ID = 99999999
+
+# Limit czasu paczki rośnie jak pierwiastek z liczby kandydatów (start, licencja i odczyt są wspólne)
+# i nie przekracza MAX_BATCH_TIMEOUT
+MAX_BATCH_TIMEOUT = 4 * DEFAULT_TIMEOUT
+
+# Karty wspólne dla wszystkich kopii - zapisywane raz
+SHARED_CARDS = {'EIGRL', 'EIGR', 'PARAM', 'CORD1R', 'CORD2R', 'CORD2C', 'CORD2S', 'CORD1C', 'CORD1S'}
+
+
+def split_deck(lines):
+    '''
+    Split a deck into (executive + CEND, case control, bulk data) lists of lines.
+    BEGIN BULK and ENDDATA are not included in the bulk list.
+    '''
+    executive, case_control, bulk = [], [], []
+    section = executive
+    for line in lines:
+        upper = line.strip().upper()
+        if section is executive:
+            executive.append(line)
+            if upper.startswith('CEND'):
+                section = case_control
+        elif section is case_control:
+            if upper.startswith('BEGIN') and 'BULK' in upper:
+                section = bulk
+            else:
+                case_control.append(line)
+        else:
+            if upper.startswith('ENDDATA'):
+                break
+            bulk.append(line)
+    return executive, case_control, bulk
+
+
+def parse_cards(bulk_lines):
+    '''
+    Group bulk data lines into cards and split them into fields.
+
+    Returns list of (name, fields) - name without the large-field '*', fields as stripped strings
+    (continuation markers removed).
+    '''
+    cards = []
+    for line in bulk_lines:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.lstrip().startswith('$'):
+            continue
+        if ',' in line:
+            tokens = line.split(',')
+            head, fields = tokens[0].strip(), [t.strip() for t in tokens[1:9]]
+        elif line[0:8].rstrip().endswith('*') or line.startswith('*'):
+            head = line[0:8].strip()
+            fields = [line[8 + 16 * i:24 + 16 * i].strip() for i in range(4)]
+        else:
+            head = line[0:8].strip()
+            fields = [line[8 + 8 * i:16 + 8 * i].strip() for i in range(8)]
+
+        if head == '' or head[0] in '+*':
+            if not cards:
+                raise ValueError(f"Linia kontynuacji bez karty: {line}")
+            cards[-1][1].extend(fields)
+        else:
+            cards.append((head.rstrip('*').upper(), fields))
+
+    # Puste pola na końcu karty nie mają znaczenia
+    for _, fields in cards:
+        while fields and fields[-1] == '':
+            fields.pop()
+    return cards
+
+
+def _is_int(text):
+    return text.lstrip('+-').isdigit()
+
+
+def _id_positions(name, fields):
+    spec = ID_FIELDS[name]
+    if spec == 'all':
+        return [i for i, f in enumerate(fields, start=1) if _is_int(f)]
+    if spec == 'all_except_3':
+        return [i for i, f in enumerate(fields, start=1) if i != 3 and _is_int(f)]
+    if spec == 'all_from_3':
+        return [i for i, f in enumerate(fields, start=1) if i >= 3 and _is_int(f)]
+    positions = [i for i in spec if i <= len(fields) and _is_int(fields[i - 1])]
+    if name in ('CBAR', 'CBEAM') and len(fields) >= 5 and _is_int(fields[4]):
+        positions.append(5)  # G0 zamiast wektora orientacji
+    return positions
+
+
+def _offset_card(name, fields, offset):
+    fields = list(fields)
+    for i in _id_positions(name, fields):
+        fields[i - 1] = str(int(fields[i - 1]) + offset)
+    return fields
+
+
+def _dependent_grids(cards):
+    '''Węzły zależne (m-set) elementów sztywnych - nie mogą być utwierdzone przez SPC.'''
+    dependent = set()
+    for name, fields in cards:
+        if name == 'RBE2':
+            # EID, GN, CM, GM1, GM2 ... (opcjonalny ALPHA na końcu jest liczbą rzeczywistą)
+            dependent.update(int(f) for f in fields[3:] if _is_int(f))
+        elif name == 'RBAR':
+            # EID, GA, GB, CNA, CNB, CMA, CMB; puste CMA i CMB - zależne są składowe spoza CNA/CNB
+            fields = fields + [''] * (7 - len(fields))
+            ga, gb, cna, cnb, cma, cmb = fields[1:7]
+            explicit = bool(cma or cmb)
+            if (cma if explicit else cna != '123456') and _is_int(ga):
+                dependent.add(int(ga))
+            if (cmb if explicit else cnb != '123456') and _is_int(gb):
+                dependent.add(int(gb))
+    return dependent
+
+
+def _clamp_ranges(grid_ids, dependent):
+    '''Zakresy [od, do] kolejnych (w porządku numerów) węzłów szablonu bez węzłów zależnych.'''
+    ranges = []
+    previous_clamped = False
+    for grid in sorted(set(grid_ids)):
+        clamped = grid not in dependent
+        if clamped and previous_clamped:
+            ranges[-1][1] = grid
+        elif clamped:
+            ranges.append([grid, grid])
+        previous_clamped = clamped
+    return ranges
+
+
+def batch_timeout(n):
+    '''Limit czasu zadania z n kandydatami w sekundach.'''
+    return min(DEFAULT_TIMEOUT * math.sqrt(max(n, 1)), MAX_BATCH_TIMEOUT)
+
+
+def _case_control_blocks(case_lines):
+    '''Case control split into global lines and the lines of the first SUBCASE (without SUBCASE).'''
+    global_lines, first_subcase = [], None
+    current = global_lines
+    for line in case_lines:
+        upper = line.strip().upper()
+        if upper.startswith('SUBCASE'):
+            if first_subcase is not None:
+                break
+            first_subcase = []
+            current = first_subcase
+            continue
+        current.append(line.rstrip('\r\n'))
+    return global_lines, first_subcase or []
+
+
+def _spc_set(lines):
+    for line in lines:
+        upper = line.replace(' ', '').upper()
+        if upper.startswith('SPC='):
+            return int(upper[4:])
+    return None
+
+
+def write_batch_deck(template, params_list, out_file, mid=None):
+    '''
+    Write one deck solving all candidates from params_list (one SUBCASE per candidate).
+
+    template (string): single-candidate template deck (SOL 103)
+    params_list (list of dict): material data like in edit_file, e.g. {'E': '2.100+11', 'NU': 0.25}
+    out_file (string): path of the deck to write
+    mid (int): ID of the MAT1 card to change (like in edit_file); None - the first MAT1 card
+
+    Returns out_file. Candidate i is solved in SUBCASE i+1.
+    '''
+    with open(template, 'r') as f:
+        executive, case_lines, bulk_lines = split_deck(f.readlines())
+
+    cards = parse_cards(bulk_lines)
+    unknown = sorted({name for name, _ in cards if name not in ID_FIELDS and name not in SHARED_CARDS})
+    if unknown:
+        raise ValueError(f"Tryb wsadowy nie obsługuje kart: {', '.join(unknown)}")
+
+    # Krok numeracji większy od każdego numeru węzła, elementu, właściwości i materiału
+    max_id = max((int(fields[i - 1]) for name, fields in cards if name in ID_FIELDS
+                  for i in _id_positions(name, fields)), default=0)
+    stride = 10 ** len(str(max_id))
+    max_sid = max((int(fields[0]) for name, fields in cards
+                   if name in ('SPC', 'SPC1', 'EIGRL', 'EIGR') and fields and _is_int(fields[0])), default=0)
+    grid_ids = [int(fields[0]) for name, fields in cards if name == 'GRID']
+    if not grid_ids:
+        raise ValueError("Szablon nie zawiera kart GRID.")
+    grid_min, grid_max = min(grid_ids), max(grid_ids)
+    ranges = _clamp_ranges(grid_ids, _dependent_grids(cards))
+
+    n = len(params_list)
+    first_mat = next((i for i, (name, fields) in enumerate(cards) if name == 'MAT1'
+                      and (mid is None or (fields and _is_int(fields[0]) and int(fields[0]) == mid))), None)
+    if first_mat is None:
+        raise ValueError("Szablon nie zawiera karty MAT1." if mid is None
+                         else f"Szablon nie zawiera karty MAT1 o numerze {mid}.")
+
+    global_lines, subcase_lines = _case_control_blocks(case_lines)
+    base_spc = _spc_set(subcase_lines) or _spc_set(global_lines)
+    global_lines = [l for l in global_lines if not l.replace(' ', '').upper().startswith('SPC=')]
+    subcase_lines = [l for l in subcase_lines
+                     if not l.replace(' ', '').upper().startswith(('SPC=', 'LABEL='))]
+
+    out = [line.rstrip('\r\n') for line in executive]
+    out += global_lines
+    # Numery nowych zbiorów SPC - powyżej wszystkich numerów z szablonu
+    set_base = max(stride * (n + 1), 10 ** len(str(max_sid)))
+    # Największy zapisywany numer to zbiór utwierdzeń ostatniego podprzypadku (set_base + 2n);
+    # numery kopii modelu (< n * stride) są zawsze mniejsze
+    if set_base + 2 * n > MAX_ID:
+        raise ValueError(f"Za duża paczka: {n} kopii modelu przekracza numerację NASTRAN ({MAX_ID}).")
+    for i in range(n):
+        out.append(f"SUBCASE {i + 1}")
+        out.append(f"   LABEL = KANDYDAT {i + 1}")
+        out.append(f"   SPC = {set_base + i + 1}")
+        out += subcase_lines
+    out.append("BEGIN BULK")
+
+    for name, fields in cards:
+        if name in SHARED_CARDS:
+            out += format_card(name, fields, 'large')
+
+    for i, params in enumerate(params_list):
+        for index, (name, fields) in enumerate(cards):
+            if name in SHARED_CARDS:
+                continue
+            fields = _offset_card(name, fields, i * stride)
+            if index == first_mat:
+                fields += [''] * (4 - len(fields))
+                if 'E' in params:
+                    fields[1] = real_field_text(params['E'], SMALL_FIELD)
+                if 'NU' in params:
+                    fields[3] = nu_field_text(params['NU'], SMALL_FIELD)
+            out += format_card(name, fields, 'large')
+
+    # Zbiór SPC podprzypadku i: wszystkie pozostałe kopie utwierdzone (bez węzłów zależnych).
+    # Zakresy THRU mogą obejmować nieistniejące węzły - NASTRAN je pomija (ostrzeżenie); między
+    # kopiami nie ma węzłów, więc ostatni zakres kopii łączy się z pierwszym zakresem następnej.
+    for i in range(n):
+        sid = set_base + i + 1
+        clamp_sid = set_base + n + i + 1
+        clamped = []
+        for j in range(n):
+            if j == i:
+                continue
+            for start, end in ranges:
+                start, end = start + j * stride, end + j * stride
+                if (clamped and clamped[-1][1] == grid_max + (j - 1) * stride
+                        and start == grid_min + j * stride and clamped[-1][2] == j - 1):
+                    clamped[-1][1:] = [end, j]
+                else:
+                    clamped.append([start, end, j])
+        for start, end, _ in clamped:
+            out += format_card('SPC1', [clamp_sid, '123456', start, 'THRU', end], 'large')
+        out += format_card('SPCADD', [sid, clamp_sid] + ([base_spc] if base_spc else []), 'large')
+
+    out.append("ENDDATA")
+    with open(out_file, 'w') as f:
+        f.write('\n'.join(out) + '\n')
+    return out_file
+
+
+def solve_batch(solver_path, template, params_list, mid=None):
+    '''
+    Solve all candidates from params_list in one NASTRAN run (mid like in write_batch_deck).
+
+    Returns list of frequency lists (same order as params_list, format like
+    run_solver_and_extract_frequencies).
+    '''
+    dir_path = os.path.dirname(template)
+    file_name = os.path.basename(template)
+    digest = hashlib.sha1(repr((mid, [(str(p['E']), str(p['NU'])) for p in params_list])).encode()).hexdigest()[:12]
+    batch_file = f"{dir_path}/genetic/{os.path.splitext(file_name)[0]}_batch_{digest}.bdf"
+
+    def parse(f06_path):
+        by_subcase = extract_frequencies_by_subcase(f06_path)
+        missing = [i + 1 for i in range(len(params_list)) if not by_subcase.get(i + 1)]
+        if missing:
+            raise SolverError(BRAK_WYNIKOW, f"brak wyników dla podprzypadków {missing} w {f06_path}")
+        return [by_subcase[i + 1] for i in range(len(params_list))]
+
+    write_batch_deck(template, params_list, batch_file, mid)
+    return run_solver(solver_path, batch_file, parse, timeout=batch_timeout(len(params_list)))
+
+
+class TestNastranBatch(unittest.TestCase):
+    TEMPLATE = ("SOL 103\nCEND\nTITLE = test\nSUBCASE 1\n   LABEL = modal\n   METHOD = 1\n   SPC = 2\n"
+                "BEGIN BULK\n"
+                "EIGRL   1                       6\n"
+                "GRID    1               0.      0.      0.\n"
+                "GRID    2               1.      0.      0.\n"
+                "GRID    3               1.      1.      0.\n"
+                "CQUAD4  10      7       1       2       3       3\n"
+                "RBE2    20      1       123456  2       3\n"
+                "PSHELL  7       1       .01     1\n"
+                "MAT1    1       2.000+11        .3      7850.\n"
+                "SPC1    2       123456  1\n"
+                "ENDDATA\n")
+
+    def test_split_deck(self):
+        executive, case_control, bulk = split_deck(self.TEMPLATE.splitlines(True))
+        self.assertEqual(executive, ['SOL 103\n', 'CEND\n'])
+        self.assertEqual(case_control[0], 'TITLE = test\n')
+        self.assertEqual(len(case_control), 5)
+        self.assertTrue(bulk[0].startswith('EIGRL'))
+        self.assertTrue(bulk[-1].startswith('SPC1'))
+
+    def test_offset_card(self):
+        self.assertEqual(_offset_card('GRID', ['5', '', '0.', '1.', '2.'], 100), ['105', '', '0.', '1.', '2.'])
+        self.assertEqual(_offset_card('RBE2', ['20', '1', '123456', '2', '3'], 100),
+                         ['120', '101', '123456', '102', '103'])
+        self.assertEqual(_offset_card('SPC1', ['2', '123456', '1', 'THRU', '3'], 100),
+                         ['2', '123456', '101', 'THRU', '103'])
+        self.assertEqual(_offset_card('CBAR', ['1', '2', '3', '4', '5'], 100), ['101', '102', '103', '104', '105'])
+        self.assertEqual(_offset_card('CBAR', ['1', '2', '3', '4', '0.', '1.', '0.'], 100)[4:], ['0.', '1.', '0.'])
+
+    def test_write_batch_deck(self):
+        with tempfile.TemporaryDirectory() as path:
+            template = os.path.join(path, 'model.bdf')
+            with open(template, 'w') as f:
+                f.write(self.TEMPLATE)
+            out = write_batch_deck(template, [{'E': 2.1e11, 'NU': 0.3}, {'E': 1.9e11, 'NU': 0.25}],
+                                   os.path.join(path, 'batch.bdf'))
+            with open(out) as f:
+                executive, case_control, bulk = split_deck(f.readlines())
+            cards = parse_cards(bulk)
+
+            self.assertEqual(sum(line.startswith('SUBCASE') for line in case_control), 2)
+            self.assertEqual(sorted(int(fields[0]) for name, fields in cards if name == 'GRID'),
+                             [1, 2, 3, 101, 102, 103])
+            mats = [fields for name, fields in cards if name == 'MAT1']
+            self.assertEqual([(m[0], m[1]) for m in mats], [('1', '2.1+11'), ('101', '1.9+11')])
+            rbe2 = [fields for name, fields in cards if name == 'RBE2']
+            self.assertEqual([r[:3] for r in rbe2], [['20', '1', '123456'], ['120', '101', '123456']])
+            self.assertEqual(sum(name == 'EIGRL' for name, _ in cards), 1)
+            # Podprzypadek 1: utwierdzona kopia 2 i SPC z szablonu
+            spcadd = [fields for name, fields in cards if name == 'SPCADD']
+            self.assertEqual(len(spcadd), 2)
+            self.assertEqual(spcadd[0][2], '2')
+            # Węzły zależne RBE2 (2, 3 i 102, 103) nie są utwierdzane
+            clamp = {fields[0]: fields[2:] for name, fields in cards if name == 'SPC1' and fields[1] == '123456'
+                     and fields[0] != '2'}
+            self.assertEqual(sorted(clamp.values()), [['1', 'THRU', '1'], ['101', 'THRU', '101']])
+
+    def test_write_batch_deck_mid(self):
+        with tempfile.TemporaryDirectory() as path:
+            template = os.path.join(path, 'model.bdf')
+            with open(template, 'w') as f:
+                f.write(self.TEMPLATE.replace("SPC1", "MAT1    2       7.000+10        .33     2700.\nSPC1"))
+            out = write_batch_deck(template, [{'E': 2.1e11, 'NU': 0.25}], os.path.join(path, 'batch.bdf'), mid=2)
+            with open(out) as f:
+                cards = parse_cards(split_deck(f.readlines())[2])
+            mats = [fields for name, fields in cards if name == 'MAT1']
+            self.assertEqual([(m[0], m[1], m[3]) for m in mats], [('1', '2.000+11', '.3'), ('2', '2.1+11', '0.250000')])
+            with self.assertRaises(ValueError):
+                write_batch_deck(template, [{'E': 2.1e11, 'NU': 0.25}], os.path.join(path, 'batch.bdf'), mid=3)
+
+    def test_clamp_ranges(self):
+        cards = parse_cards(["RBE2    20      1       123456  2       3\n",
+                             "RBAR    21      5       6       123456\n",
+                             "RBAR    22      7       8                       123     \n"])
+        self.assertEqual(_dependent_grids(cards), {2, 3, 6, 7})
+        self.assertEqual(_clamp_ranges([1, 2, 3, 4, 5, 6, 7, 8, 9], {2, 3, 6, 7}), [[1, 1], [4, 5], [8, 9]])
+        # Bez elementów sztywnych sąsiednie kopie są utwierdzane jednym zakresem
+        with tempfile.TemporaryDirectory() as path:
+            template = os.path.join(path, 'model.bdf')
+            with open(template, 'w') as f:
+                f.write(self.TEMPLATE.replace("RBE2    20      1       123456  2       3\n", ''))
+            out = write_batch_deck(template, [{'E': 2.1e11, 'NU': 0.3}] * 3, os.path.join(path, 'batch.bdf'))
+            with open(out) as f:
+                cards = parse_cards(split_deck(f.readlines())[2])
+            clamp = [fields[2:] for name, fields in cards if name == 'SPC1' and fields[1] == '123456'
+                     and fields[0] != '2']
+            self.assertEqual(clamp, [['101', 'THRU', '203'], ['1', 'THRU', '3'], ['201', 'THRU', '203'],
+                                     ['1', 'THRU', '103']])
+
+    def test_batch_timeout(self):
+        self.assertEqual(batch_timeout(1), DEFAULT_TIMEOUT)
+        self.assertEqual(batch_timeout(4), 2 * DEFAULT_TIMEOUT)
+        self.assertEqual(batch_timeout(50), MAX_BATCH_TIMEOUT)
+
+    def test_max_id(self):
+        with tempfile.TemporaryDirectory() as path:
+            template = os.path.join(path, 'model.bdf')
+            # Numery 7-cyfrowe: krok 10**7, zbiory SPC od 10**7 * (n + 1) - dla 9 kopii ponad MAX_ID
+            with open(template, 'w') as f:
+                f.write(self.TEMPLATE.replace('GRID    3       ', 'GRID    3000000 '))
+            params = [{'E': 2.1e11, 'NU': 0.3}] * 9
+            with self.assertRaises(ValueError):
+                write_batch_deck(template, params, os.path.join(path, 'batch.bdf'))
+            write_batch_deck(template, params[:8], os.path.join(path, 'batch.bdf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
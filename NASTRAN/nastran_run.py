@@ -8,22 +8,14 @@ def run_nastran_solver(input_file, outupt_path, params, solver_path = r'D:\NASTR
 
 
 import re
-import subprocess
+from solver_supervisor import run_supervised, DEFAULT_TIMEOUT
 
-def run_solver_and_extract_frequencies(solver_path, input_file,eigenmodes = 6):
-    # Uruchomienie solvera i oczekiwanie na zakończenie procesu
-    out_path = os.path.dirname(input_file)
-    # out = 'out= C:\\Users\\Grzesiek\\Desktop\\Doktorat\\00_PROJEKT_BADAWCZY\\01_MECHANIKA\\02_NASTRAN\\02_MODAL_TEST\\do_skryptu'
-    out = f'out= {out_path}'
-    old = 'old=No'
-    subprocess.run([solver_path, input_file, out, old ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
+def extract_frequencies(f06_path):
     frequencies = []
-    new_path = input_file.replace('.bdf', '.f06')    
     line_counter=0
     found_table = False
 
-    with open(new_path, 'r') as file:
+    with open(f06_path, 'r') as file:
         for line in file:
             if "MODAL EFFECTIVE MASS FRACTION" in line:
                 found_table = True  # Znaleziono sekcję z częstotliwościami
@@ -41,6 +33,59 @@ def run_solver_and_extract_frequencies(solver_path, input_file,eigenmodes = 6):
     return frequencies
 
 
+_SUBCASE_RE = re.compile(r'\bSUBCASE\s+(\d+)\s*$')
+
+def extract_frequencies_by_subcase(f06_path):
+    '''
+    Frequencies from the MODAL EFFECTIVE MASS FRACTION tables of a multi-subcase .f06 file.
+    The subcase is taken from the "SUBCASE n" page header preceding each table.
+
+    Returns dict: subcase id (int) -> list of frequencies (str, as in extract_frequencies)
+    '''
+    result = {}
+    subcase = None
+    line_counter = 0
+    found_table = False
+
+    with open(f06_path, 'r') as file:
+        for line in file:
+            match = _SUBCASE_RE.search(line.rstrip())
+            if match and not found_table:
+                subcase = int(match.group(1))
+            if "MODAL EFFECTIVE MASS FRACTION" in line:
+                # Tylko pierwsza tabela danego podprzypadku (jak w extract_frequencies)
+                found_table = subcase not in result
+                line_counter = 0
+                if found_table:
+                    result[subcase] = []
+            elif found_table:
+                if line_counter < 5:
+                    line_counter += 1
+                elif line.strip() == "":
+                    found_table = False
+                else:
+                    result[subcase].append(line.split()[1])
+
+    return result
+
+
+def run_solver(solver_path, input_file, parse=extract_frequencies, timeout=DEFAULT_TIMEOUT, retries=2):
+    '''
+    Run the solver under supervision (solver_supervisor.run_supervised) and parse the .f06 file.
+
+    Raises solver_supervisor.SolverError when the run times out, ends with a FATAL message,
+    or leaves no results - an empty frequency list is never returned.
+    '''
+    out_path = os.path.dirname(input_file)
+    # out = 'out= C:\\Users\\Grzesiek\\Desktop\\Doktorat\\00_PROJEKT_BADAWCZY\\01_MECHANIKA\\02_NASTRAN\\02_MODAL_TEST\\do_skryptu'
+    out = f'out= {out_path}'
+    old = 'old=No'
+    return run_supervised([solver_path, input_file, out, old], input_file, parse, timeout=timeout, retries=retries)
+
+
+def run_solver_and_extract_frequencies(solver_path, input_file,eigenmodes = 6, timeout=DEFAULT_TIMEOUT):
+    return run_solver(solver_path, input_file, extract_frequencies, timeout)
+
 
 if __name__ == '__main__':
     # Przykład użycia funkcji
@@ -0,0 +1,319 @@
+'''
+Nadzór nad procesami solvera: limit czasu, zabijanie całej grupy procesów, klasyfikacja błędów
+z plików .f06/.log, ponawianie błędów przejściowych z wykładniczym opóźnieniem i statystyki.
+'''
+import os
+import re
+import sys
+import time
+import random
+import signal
+import tempfile
+import unittest
+import threading
+import subprocess
+
+# Domyślny limit czasu jednego uruchomienia solvera [s]
+DEFAULT_TIMEOUT = 1800
+
+# Klasy błędów
+TIMEOUT = 'TIMEOUT'
+LICENCJA = 'LICENCJA'
+FATAL_UZYTKOWNIKA = 'FATAL_UZYTKOWNIKA'
+FATAL_SYSTEMOWY = 'FATAL_SYSTEMOWY'
+KOD_WYJSCIA = 'KOD_WYJSCIA'
+BRAK_WYNIKOW = 'BRAK_WYNIKOW'
+URUCHOMIENIE = 'URUCHOMIENIE'
+
+# Błędy, które mogą zniknąć przy ponownym uruchomieniu (zajęta licencja, brak miejsca na scratch,
+# zawieszony proces). Błąd w danych wejściowych (USER FATAL) powtórzy się zawsze.
+PRZEJSCIOWE = {TIMEOUT, LICENCJA, FATAL_SYSTEMOWY, KOD_WYJSCIA, BRAK_WYNIKOW}
+
+_USER_FATAL_RE = re.compile(r'USER FATAL MESSAGE\s+(\d+)')
+_SYSTEM_FATAL_RE = re.compile(r'SYSTEM FATAL MESSAGE\s+(\d+)')
+_LICENSE_RE = re.compile(r'licen[sc]e.*(error|fail|unavailable|not available|denied|expired)', re.IGNORECASE)
+
+
+class SolverError(Exception):
+    """
+    Nieudane uruchomienie solvera.
+
+    Atrybuty:
+        kategoria (str): Klasa błędu (TIMEOUT, LICENCJA, FATAL_UZYTKOWNIKA, ...).
+        kod (str): Numer komunikatu FATAL, jeśli został znaleziony.
+        przejsciowy (bool): Czy ponowne uruchomienie ma sens.
+    """
+
+    def __init__(self, kategoria, opis, kod=None):
+        super().__init__(f'{kategoria}: {opis}')
+        self.kategoria = kategoria
+        self.kod = kod
+        self.przejsciowy = kategoria in PRZEJSCIOWE
+
+
+class StatystykiSolvera:
+    """Liczniki uruchomień i błędów solvera (bezpieczne dla wątków)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uruchomienia = 0
+        self.sukcesy = 0
+        self.ponowienia = 0
+        self.porazki = 0
+        self.bledy = {}
+        self.czas = 0.0
+
+    def zapisz_uruchomienie(self, czas):
+        with self._lock:
+            self.uruchomienia += 1
+            self.czas += czas
+
+    def zapisz_sukces(self):
+        with self._lock:
+            self.sukcesy += 1
+
+    def zapisz_blad(self, blad, ponowienie):
+        with self._lock:
+            self.bledy[blad.kategoria] = self.bledy.get(blad.kategoria, 0) + 1
+            if ponowienie:
+                self.ponowienia += 1
+            else:
+                self.porazki += 1
+
+    def raport(self):
+        with self._lock:
+            bledy = ', '.join(f'{k}: {v}' for k, v in sorted(self.bledy.items())) or 'brak'
+            return (f'SOLVER - uruchomienia: {self.uruchomienia}, sukcesy: {self.sukcesy}, '
+                    f'ponowienia: {self.ponowienia}, porażki: {self.porazki}, '
+                    f'czas: {self.czas:.0f} s, błędy: {bledy}')
+
+
+# Statystyki wspólne dla wszystkich wywołań z domyślnymi parametrami
+statystyki = StatystykiSolvera()
+
+
+def _kill_process_group(proc):
+    '''Zabija proces solvera razem z procesami potomnymi (NASTRAN uruchamia własne podprocesy).'''
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    proc.wait()
+
+
+def _run_once(args, timeout):
+    '''Uruchamia solver w nowej grupie procesów. Zwraca kod wyjścia.'''
+    if sys.platform == 'win32':
+        kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        kwargs = {'start_new_session': True}
+    try:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    except OSError as exc:
+        raise SolverError(URUCHOMIENIE, str(exc)) from exc
+    try:
+        proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_group(proc)
+        raise SolverError(TIMEOUT, f'przekroczono {timeout} s')
+    return proc.returncode
+
+
+def classify_output(input_file, returncode=0):
+    '''
+    Szuka w plikach .f06 i .log komunikatów FATAL i błędów licencji.
+
+    Zwraca SolverError albo None, jeśli nie znaleziono błędu.
+    '''
+    base = os.path.splitext(input_file)[0]
+    for ext in ('.f06', '.log'):
+        path = base + ext
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                match = _USER_FATAL_RE.search(line)
+                if match:
+                    return SolverError(FATAL_UZYTKOWNIKA, line.strip(), match.group(1))
+                match = _SYSTEM_FATAL_RE.search(line)
+                if match:
+                    return SolverError(FATAL_SYSTEMOWY, line.strip(), match.group(1))
+                if _LICENSE_RE.search(line):
+                    return SolverError(LICENCJA, line.strip())
+    if not os.path.exists(base + '.f06'):
+        return SolverError(BRAK_WYNIKOW, f'brak pliku {base}.f06')
+    if returncode != 0:
+        return SolverError(KOD_WYJSCIA, f'kod wyjścia {returncode}')
+    return None
+
+
+def run_supervised(args, input_file, parse, timeout=DEFAULT_TIMEOUT, retries=2, backoff=10.0, stats=statystyki):
+    '''
+    Uruchamia solver pod nadzorem.
+
+    args (list): polecenie solvera
+    input_file (string): plik .bdf - obok niego szukane są .f06 i .log
+    parse (callable): parse(f06_path) -> wynik; pusty wynik traktowany jest jako BRAK_WYNIKOW
+    timeout (float): limit czasu jednego uruchomienia [s]
+    retries (int): liczba ponowień błędów przejściowych
+    backoff (float): opóźnienie przed pierwszym ponowieniem [s], podwajane przy kolejnych
+
+    Zwraca wynik parse, a po wyczerpaniu ponowień (lub przy błędzie nieprzejściowym) rzuca SolverError.
+    '''
+    base = os.path.splitext(input_file)[0]
+    f06_path = base + '.f06'
+    for attempt in range(retries + 1):
+        # Stare .f06/.log z poprzedniego uruchomienia nie mogą udawać nowego wyniku
+        for path in (f06_path, base + '.log'):
+            if os.path.exists(path):
+                os.remove(path)
+
+        start = time.monotonic()
+        try:
+            try:
+                returncode = _run_once(args, timeout)
+            finally:
+                stats.zapisz_uruchomienie(time.monotonic() - start)
+            error = classify_output(input_file, returncode)
+            if error is not None:
+                raise error
+            result = parse(f06_path)
+            if not result:
+                raise SolverError(BRAK_WYNIKOW, f'brak częstotliwości w {f06_path}')
+        except SolverError as exc:
+            ponowienie = exc.przejsciowy and attempt < retries
+            stats.zapisz_blad(exc, ponowienie)
+            if not ponowienie:
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(1.0, 1.5))
+        else:
+            stats.zapisz_sukces()
+            return result
+
+
+# Udawany solver testów: zachowanie zależy od numeru uruchomienia (licznik w pliku <bdf>.runs)
+_FAKE_SOLVER = """
+import os, sys, time, subprocess
+base = os.path.splitext(sys.argv[1])[0]
+runs = int(open(base + '.runs').read()) + 1 if os.path.exists(base + '.runs') else 1
+open(base + '.runs', 'w').write(str(runs))
+mode = sys.argv[2] if runs <= int(sys.argv[3]) else 'ok'
+if mode == 'hang':
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    open(base + '.child', 'w').write(str(child.pid))
+    time.sleep(60)
+elif mode == 'licence':
+    open(base + '.log', 'w').write('License checkout error: MSCONE unavailable\\n')
+elif mode == 'user_fatal':
+    open(base + '.f06', 'w').write('*** USER FATAL MESSAGE 2101A (GP4)\\n')
+else:
+    open(base + '.f06', 'w').write('MODE 1 12.5\\n')
+"""
+
+
+def _alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestSolverSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.script = os.path.join(self.dir.name, 'fake_solver.py')
+        with open(self.script, 'w') as f:
+            f.write(_FAKE_SOLVER)
+        self.bdf = os.path.join(self.dir.name, 'model.bdf')
+        self.stats = StatystykiSolvera()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_fake(self, mode, failures, **kwargs):
+        args = [sys.executable, self.script, self.bdf, mode, str(failures)]
+        kwargs.setdefault('backoff', 0.01)
+        return run_supervised(args, self.bdf, self.parse, stats=self.stats, **kwargs)
+
+    @staticmethod
+    def parse(f06_path):
+        with open(f06_path) as f:
+            return f.read().split()[2:]
+
+    def runs(self):
+        with open(os.path.splitext(self.bdf)[0] + '.runs') as f:
+            return int(f.read())
+
+    def write(self, ext, text):
+        with open(os.path.splitext(self.bdf)[0] + ext, 'w') as f:
+            f.write(text)
+
+    def test_classify_output(self):
+        self.assertEqual(classify_output(self.bdf).kategoria, BRAK_WYNIKOW)
+        self.write('.f06', 'MODE 1 12.5\n')
+        self.assertIsNone(classify_output(self.bdf))
+        self.assertEqual(classify_output(self.bdf, returncode=3).kategoria, KOD_WYJSCIA)
+        self.write('.log', 'Licence request failed: no tokens\n')
+        self.assertEqual(classify_output(self.bdf).kategoria, LICENCJA)
+        self.write('.f06', ' *** SYSTEM FATAL MESSAGE 4276 (GALLOC)\n')
+        error = classify_output(self.bdf)
+        self.assertEqual((error.kategoria, error.kod, error.przejsciowy), (FATAL_SYSTEMOWY, '4276', True))
+        self.write('.f06', ' *** USER FATAL MESSAGE 2101A (GP4)\n')
+        error = classify_output(self.bdf)
+        self.assertEqual((error.kategoria, error.kod, error.przejsciowy), (FATAL_UZYTKOWNIKA, '2101', False))
+
+    @unittest.skipIf(sys.platform == 'win32', 'procesy potomne sprawdzane przez /proc')
+    def test_timeout_kills_process_group(self):
+        start = time.monotonic()
+        with self.assertRaises(SolverError) as raised:
+            self.run_fake('hang', 1, timeout=2, retries=0)
+        self.assertEqual(raised.exception.kategoria, TIMEOUT)
+        self.assertLess(time.monotonic() - start, 30)
+        with open(os.path.splitext(self.bdf)[0] + '.child') as f:
+            child = int(f.read())
+        deadline = time.monotonic() + 5
+        while _alive(child) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(_alive(child))
+
+    def test_retry_transient_only(self):
+        self.assertEqual(self.run_fake('licence', 2, retries=2), ['12.5'])
+        self.assertEqual(self.runs(), 3)
+        self.assertEqual((self.stats.uruchomienia, self.stats.sukcesy, self.stats.ponowienia, self.stats.porazki),
+                         (3, 1, 2, 0))
+        self.assertEqual(self.stats.bledy, {LICENCJA: 2})
+
+        os.remove(os.path.splitext(self.bdf)[0] + '.runs')
+        with self.assertRaises(SolverError) as raised:
+            self.run_fake('user_fatal', 5, retries=2)
+        self.assertEqual(raised.exception.kategoria, FATAL_UZYTKOWNIKA)
+        self.assertEqual(self.runs(), 1)
+
+        os.remove(os.path.splitext(self.bdf)[0] + '.runs')
+        with self.assertRaises(SolverError):
+            self.run_fake('licence', 5, retries=1)
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual((self.stats.uruchomienia, self.stats.sukcesy, self.stats.ponowienia, self.stats.porazki),
+                         (6, 1, 3, 2))
+        self.assertEqual(self.stats.bledy, {LICENCJA: 4, FATAL_UZYTKOWNIKA: 1})
+        self.assertIn('porażki: 2', self.stats.raport())
+
+    def test_backoff_doubles(self):
+        delays = []
+        sleep, time.sleep = time.sleep, delays.append
+        try:
+            self.run_fake('licence', 2, retries=2, backoff=1.0)
+        finally:
+            time.sleep = sleep
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(1.0 <= delays[0] <= 1.5 and 2.0 <= delays[1] <= 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+'''
+Solver modalny w procesie z ciepłym startem (warm start) dla sąsiednich kandydatów.
+
+Dla liniowo-sprężystego materiału izotropowego macierz sztywności jest liniowa w parametrach Lamégo:
+K(E, NU) = lambda(E, NU) * K_lambda + mu(E, NU) * K_mu, a macierz mas nie zależy od E i NU.
+Po jednorazowym wyeksportowaniu K_lambda, K_mu i M (np. z NASTRAN przez OUTPUT4/DMIG)
+złożenie K dla nowego osobnika to dwie operacje na macierzach rzadkich.
+
+Problem własny K x = w^2 M x rozwiązywany jest metodą LOBPCG. Startową podprzestrzenią są wektory
+własne najbliższego (w znormalizowanej przestrzeni E/NU) już policzonego osobnika, a jako
+prekondycjoner służy rozkład LU macierzy przesuniętej tego sąsiada - dla bliskich genomów
+LOBPCG zbiega wtedy w kilku iteracjach zamiast kilkudziesięciu.
+
+Obiekt solvera jest wywoływalny, więc można go przekazać jako solver_path do Osobnik.solve_file,
+przetwarzaj_populacje i algorytm (genetic_nastran) - nic nie tworzy go jednak automatycznie:
+algorytm domyślnie uruchamia NASTRAN, a moduł nie zawiera czytnika macierzy wyeksportowanych
+z NASTRAN (OUTPUT4/DMIG). K_lambda, K_mu i M trzeba wczytać samodzielnie jako macierze rzadkie
+scipy i przekazać do WarmStartModalSolver.from_lame_matrices.
+'''
+import threading
+from collections import deque
+import unittest
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+
+def lame_parameters(young, poisson, kind='solid'):
+    '''
+    Parametry Lamégo (lambda, mu).
+
+    kind (string): 'solid' - stan przestrzenny, 'plane_stress' - płaski stan naprężenia (powłoki),
+        dla którego lambda = E*NU/(1-NU^2).
+    '''
+    mu = young / (2 * (1 + poisson))
+    if kind == 'solid':
+        lam = young * poisson / ((1 + poisson) * (1 - 2 * poisson))
+    elif kind == 'plane_stress':
+        lam = young * poisson / (1 - poisson ** 2)
+    else:
+        raise ValueError(f"Nieznany rodzaj modelu: {kind}")
+    return lam, mu
+
+
+def lame_matrices_from_references(K_nu0, K_ref, nu_ref=0.25, kind='solid'):
+    '''
+    Macierze K_lambda i K_mu z dwóch macierzy sztywności wyeksportowanych dla E = 1:
+    K_nu0 dla NU = 0 (lambda = 0) i K_ref dla NU = nu_ref.
+    '''
+    _, mu0 = lame_parameters(1.0, 0.0, kind)
+    lam_ref, mu_ref = lame_parameters(1.0, nu_ref, kind)
+    K_mu = K_nu0 / mu0
+    K_lambda = (K_ref - mu_ref * K_mu) / lam_ref
+    return K_lambda, K_mu
+
+
+class WarmStartModalSolver:
+    """
+    Solver częstotliwości własnych z pamięcią wcześniej policzonych genomów.
+
+    Atrybuty:
+        n_modes (int): Liczba zwracanych częstotliwości (w Hz, rosnąco).
+        iteracje (deque[tuple[bool, int]]): (ciepły start?, liczba iteracji LOBPCG) ostatnich
+            max_history rozwiązań.
+
+    Metody:
+        __call__(young, poisson): Zwraca listę częstotliwości własnych osobnika.
+    """
+
+    def __init__(self, assemble, n_modes=20, shift=None, guard_vectors=4, max_cache=200, max_factors=4,
+                 refactor_distance=0.05, tol=1e-8, maxiter=200, scale=(300e9, 0.5), seed=0, max_history=1000):
+        """
+        Parametry:
+            assemble (callable): assemble(young, poisson) -> (K, M), macierze rzadkie symetryczne.
+            n_modes (int): Liczba szukanych postaci własnych.
+            shift (float): Przesunięcie sigma (K + sigma*M jest dodatnio określona także dla modelu
+                swobodnego); domyślnie 1e-6 * średnia diag(K)/diag(M) pierwszego modelu.
+            guard_vectors (int): Dodatkowe wektory w bloku LOBPCG (przyspieszają zbieżność).
+            max_cache (int): Liczba pamiętanych zestawów wektorów własnych.
+            max_factors (int): Liczba pamiętanych rozkładów LU (prekondycjonerów) - są duże.
+            refactor_distance (float): Znormalizowana odległość od genomu z rozkładem LU, powyżej
+                której liczony jest nowy rozkład.
+            tol (float): Tolerancja residuum LOBPCG.
+            maxiter (int): Maksymalna liczba iteracji LOBPCG.
+            scale (tuple): Skale (E, NU) do normalizacji odległości między genomami.
+            seed (int): Ziarno losowej podprzestrzeni dla zimnego startu.
+            max_history (int): Liczba ostatnich rozwiązań pamiętanych w iteracje.
+        """
+        self.assemble = assemble
+        self.n_modes = n_modes
+        self.shift = shift
+        self.block = n_modes + guard_vectors
+        self.max_cache = max_cache
+        self.max_factors = max_factors
+        self.refactor_distance = refactor_distance
+        self.tol = tol
+        self.maxiter = maxiter
+        self.scale = np.asarray(scale, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.iteracje = deque(maxlen=max_history)
+
+        self._lock = threading.Lock()
+        self._genomy = np.empty((0, 2))
+        self._wektory = []
+        self._faktory = {}  # indeks w pamięci -> (rozkład LU, numer użycia)
+        self._licznik = 0
+
+    @classmethod
+    def from_lame_matrices(cls, K_lambda, K_mu, M, kind='solid', **kwargs):
+        """Solver dla K = lambda*K_lambda + mu*K_mu (macierze np. z lame_matrices_from_references)."""
+        K_lambda, K_mu, M = sp.csc_matrix(K_lambda), sp.csc_matrix(K_mu), sp.csc_matrix(M)
+
+        def assemble(young, poisson):
+            lam, mu = lame_parameters(young, poisson, kind)
+            return lam * K_lambda + mu * K_mu, M
+
+        return cls(assemble, **kwargs)
+
+    def _najblizszy(self, genom):
+        '''
+        Indeks najbliższego policzonego genomu i indeks najbliższego z zapamiętanym rozkładem LU
+        (None, jeśli ten jest dalej niż refactor_distance).
+        '''
+        if len(self._wektory) == 0:
+            return None, None
+        odleglosc = np.linalg.norm((self._genomy - genom) / self.scale, axis=1)
+        najblizszy = int(np.argmin(odleglosc))
+        z_faktorem = None
+        if self._faktory:
+            indeksy = np.fromiter(self._faktory, dtype=int)
+            kandydat = int(indeksy[np.argmin(odleglosc[indeksy])])
+            if odleglosc[kandydat] <= self.refactor_distance:
+                z_faktorem = kandydat
+        return najblizszy, z_faktorem
+
+    def _zapamietaj(self, genom, X, faktor):
+        with self._lock:
+            if len(self._wektory) >= self.max_cache:
+                # Najstarszy wpis wypada - przesuwamy indeksy rozkładów LU
+                self._genomy = self._genomy[1:]
+                self._wektory.pop(0)
+                self._faktory = {i - 1: v for i, v in self._faktory.items() if i > 0}
+            self._genomy = np.vstack([self._genomy, genom])
+            self._wektory.append(X)
+            if faktor is not None:
+                self._licznik += 1
+                self._faktory[len(self._wektory) - 1] = (faktor, self._licznik)
+                if len(self._faktory) > self.max_factors:
+                    najstarszy = min(self._faktory, key=lambda i: self._faktory[i][1])
+                    del self._faktory[najstarszy]
+
+    def __call__(self, young, poisson):
+        K, M = self.assemble(young, poisson)
+        K, M = sp.csc_matrix(K), sp.csc_matrix(M)
+        genom = np.array([young, poisson], dtype=float)
+        with self._lock:
+            if self.shift is None:
+                self.shift = 1e-6 * float(np.mean(K.diagonal()) / np.mean(M.diagonal()))
+        A = (K + self.shift * M).tocsc()
+
+        with self._lock:
+            najblizszy, z_faktorem = self._najblizszy(genom)
+            # Kopia - lobpcg nadpisuje blok startowy w miejscu, a wektory w pamięci czytają też inne wątki
+            X0 = self._wektory[najblizszy].copy() if najblizszy is not None else None
+            faktor = self._faktory[z_faktorem][0] if z_faktorem is not None else None
+            if z_faktorem is not None:
+                self._licznik += 1
+                self._faktory[z_faktorem] = (faktor, self._licznik)
+
+        nowy_faktor = None
+        if faktor is None:
+            nowy_faktor = faktor = spla.splu(A)
+        precond = spla.LinearOperator(A.shape, matvec=faktor.solve, matmat=faktor.solve, dtype=A.dtype)
+
+        cieply = X0 is not None
+        if not cieply:
+            with self._lock:
+                X0 = self.rng.standard_normal((A.shape[0], self.block))
+
+        wartosci, X, historia = spla.lobpcg(A, X0, B=M, M=precond, largest=False, tol=self.tol,
+                                            maxiter=self.maxiter, retResidualNormsHistory=True)
+        self.iteracje.append((cieply, len(historia)))
+
+        kolejnosc = np.argsort(wartosci)
+        wartosci, X = wartosci[kolejnosc], X[:, kolejnosc]
+        self._zapamietaj(genom, X, nowy_faktor)
+
+        omega2 = np.clip(wartosci[:self.n_modes] - self.shift, 0, None)
+        return list(np.sqrt(omega2) / (2 * np.pi))
+
+
+class TestWarmStartModalSolver(unittest.TestCase):
+    @staticmethod
+    def _solver(**kwargs):
+        # Łańcuch sprężyn: K = E * K0, M = I
+        n = 60
+        K0 = sp.diags([-np.ones(n - 1), 2 * np.ones(n), -np.ones(n - 1)], [-1, 0, 1]) * 1e-9
+        return WarmStartModalSolver(lambda young, poisson: (young * K0, sp.identity(n)), n_modes=4,
+                                    guard_vectors=2, **kwargs)
+
+    def test_cache_unchanged(self):
+        solver = self._solver()
+        solver(2.0e11, 0.3)
+        zapamietane = solver._wektory[0].copy()
+        freq = [solver(2.01e11, 0.3) for _ in range(2)]
+        self.assertTrue(np.array_equal(solver._wektory[0], zapamietane))
+        self.assertTrue(np.allclose(freq[0], freq[1], rtol=1e-6))
+        self.assertTrue(all(cieply for cieply, _ in list(solver.iteracje)[1:]))
+
+    def test_history_bounded(self):
+        solver = self._solver(max_history=2)
+        for young in (2.0e11, 2.01e11, 2.02e11):
+            solver(young, 0.3)
+        self.assertEqual(len(solver.iteracje), 2)
+        self.assertTrue(all(cieply for cieply, _ in solver.iteracje))
+
+
+if __name__ == '__main__':
+    unittest.main()
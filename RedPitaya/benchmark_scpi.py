@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Benchmarks of the SCPI clients' I/O paths.
+
+Without --host the benchmarks run against redpitaya_sim simulators started in this process, so
+the results track regressions of the clients (and the effect of --latency/--jitter/--bandwidth)
+without lab access. With --host a real board is measured.
+
+    python benchmark_scpi.py --latency 0.0005 --repeat 200
+    python benchmark_scpi.py --host rp-f0ad96.local
+"""
+
+import time
+import asyncio
+import argparse
+import numpy as np
+
+import redpitaya_scpi as scpi
+from redpitaya_scpi_async import async_scpi, gather_acq_data
+from redpitaya_sim import simulator
+
+
+def _report(name, value, unit):
+    print(f'{name:<40} {value:>12.1f} {unit}')
+
+
+def bench_commands(rp, repeat):
+    """Queries per second - one round trip per query, and all queries pipelined in one batch."""
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        rp.txrx_txt('ACQ:DEC?')
+    _report('query, sequential', repeat / (time.perf_counter() - t0), 'cmd/s')
+
+    t0 = time.perf_counter()
+    with rp.batch():
+        replies = [rp.query('ACQ:DEC?') for _ in range(repeat)]
+    [reply.value for reply in replies]
+    _report('query, batched', repeat / (time.perf_counter() - t0), 'cmd/s')
+
+    # Setters have no reply - one query at the end waits until all of them were executed
+    t0 = time.perf_counter()
+    with rp.batch():
+        for i in range(repeat):
+            rp.tx_txt(f'ACQ:TRIG:LEV {i % 10 / 10}')
+        done = rp.query('*OPC?')
+    done.value
+    _report('setter, batched', repeat / (time.perf_counter() - t0), 'cmd/s')
+
+
+def _acquire(rp, binary):
+    with rp.batch():
+        rp.tx_txt('ACQ:RST')
+        rp.tx_txt(f"ACQ:DATA:FORMAT {'BIN' if binary else 'ASCII'}")
+        rp.tx_txt('ACQ:START')
+        rp.tx_txt('ACQ:TRIG NOW')
+    rp.wait_for_fill(timeout=10)
+
+
+def bench_acquisition(rp, repeat):
+    """Full-buffer reads per second and sample throughput, ASCII and binary."""
+    for binary in (False, True):
+        _acquire(rp, binary)
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            data = rp.acq_data(1, binary=binary, convert=True)
+        elapsed = time.perf_counter() - t0
+        name = 'binary' if binary else 'ASCII'
+        _report(f'acq_data full buffer, {name}', repeat / elapsed, 'acq/s')
+        _report(f'acq_data throughput, {name}', repeat * len(data) / elapsed / 1e6, 'MS/s')
+
+
+def bench_trigger_latency(rp, repeat):
+    """Time from arming and triggering to decoded data (ACQ:START ... acq_data)."""
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with rp.batch():
+            rp.tx_txt('ACQ:DATA:FORMAT BIN')
+            rp.tx_txt('ACQ:START')
+            rp.tx_txt('ACQ:TRIG NOW')
+        rp.wait_for_trigger(timeout=10)
+        rp.wait_for_fill(timeout=10)
+        rp.acq_data(1, binary=True, convert=True)
+        latencies.append(time.perf_counter() - t0)
+    latencies = np.array(latencies) * 1e3
+    _report('trigger-to-data, median', np.median(latencies), 'ms')
+    _report('trigger-to-data, 95th percentile', np.percentile(latencies, 95), 'ms')
+
+
+async def _bench_concurrent(addresses, repeat):
+    boards = [async_scpi(host, port=port) for host, port in addresses]
+    for board in boards:
+        await board.acq_set(sample_format='BIN')
+        await board.tx_txt('ACQ:START')
+        await board.tx_txt('ACQ:TRIG NOW')
+    for board in boards:
+        await board.wait_for_fill(timeout=10)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        await gather_acq_data(boards, 1, binary=True, convert=True)
+    elapsed = time.perf_counter() - t0
+    for board in boards:
+        await board.close()
+    return elapsed
+
+
+def bench_concurrency(addresses, repeat):
+    """Full-buffer reads from several boards at once with async_scpi."""
+    elapsed = asyncio.run(_bench_concurrent(addresses, repeat))
+    _report(f'async acq_data, {len(addresses)} boards', repeat * len(addresses) / elapsed, 'acq/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the Red Pitaya SCPI clients')
+    parser.add_argument('--host', default=None, help='board address (default: simulator)')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated reply delay [s]')
+    parser.add_argument('--jitter', type=float, default=0.0, help='simulated random extra delay [s]')
+    parser.add_argument('--bandwidth', type=float, default=None, help='simulated bandwidth [bytes/s]')
+    parser.add_argument('--boards', type=int, default=4, help='boards read concurrently')
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    sims = []
+    if args.host is None:
+        sims = [simulator(latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth).start_in_thread()
+                for _ in range(args.boards)]
+        addresses = [('127.0.0.1', sim.port) for sim in sims]
+    else:
+        addresses = [(args.host, args.port)] * args.boards
+
+    rp = scpi.scpi(addresses[0][0], timeout=10, port=addresses[0][1])
+    bench_commands(rp, args.repeat)
+    bench_acquisition(rp, max(args.repeat // 10, 1))
+    bench_trigger_latency(rp, max(args.repeat // 10, 1))
+    rp.close()
+    bench_concurrency(addresses, max(args.repeat // 10, 1))
+
+    for sim in sims:
+        sim.stop_in_thread()
@@ -0,0 +1,256 @@
+"""Modal frequencies from acquired data.
+
+Spectra of a batch of buffers (rows of a 2-D array, e.g. stacked scpi.acq_data results or
+recording() acquisitions) are computed in one call: Welch PSD of the response, or H1 FRF when
+the excitation was acquired on the other channel. Peaks are picked on the mean spectrum and
+refined in every buffer by parabolic interpolation of the log spectrum, so the frequencies are
+not limited to the bin spacing. The mean over buffers is the target for the optimizer
+(Osobnik.oblicz_dopasowanie in NASTRAN/genetic_nastran.py), the spread gives its uncertainty.
+The uncertainty is informational only: the fitness is the plain RMSE of the frequencies and
+does not weight the modes by sigma.
+
+Example
+-------
+    buffers = np.stack([rp.acq_data(1, binary=True, convert=True) for _ in range(16)])
+    f, psd = welch_psd(buffers, fs=125e6 / 64)
+    freq, sigma = modal_frequencies(f, psd, n_peaks=6, fmin=100)
+    save_target('target.json', freq, sigma)    # algorytm(..., idealny_FREQ='target.json')
+"""
+
+import json
+import unittest
+import numpy as np
+import scipy.signal
+
+
+def welch_psd(data, fs: float, nperseg: int = None, window: str = 'hann', overlap: float = 0.5,
+              detrend: str = 'constant'):
+    """
+    Welch power spectral density of every buffer.
+
+    Parameters
+    ----------
+        data (array) :
+            Samples, shape (samples,) or (buffers, samples).
+        fs (float) :
+            Sample rate in Hz (base rate / decimation).
+        nperseg (int, optional) :
+            Segment length. Defaults to the whole buffer (a single windowed FFT, finest resolution).
+        window (str, optional) :
+            Window name (scipy.signal.get_window).
+            Defaults to 'hann'.
+        overlap (float, optional) :
+            Overlap of segments as a fraction of nperseg.
+            Defaults to 0.5.
+        detrend (str, optional) :
+            Detrending of segments ('constant', 'linear' or False).
+            Defaults to 'constant'.
+
+    Returns (f, psd) - frequencies in Hz and spectra of shape (buffers, frequencies).
+    """
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    nperseg = data.shape[-1] if nperseg is None else nperseg
+    return scipy.signal.welch(data, fs, window=window, nperseg=nperseg,
+                              noverlap=int(nperseg * overlap), detrend=detrend, axis=-1)
+
+
+def frf_h1(excitation, response, fs: float, nperseg: int = None, window: str = 'hann',
+           overlap: float = 0.5, detrend: str = 'constant'):
+    """
+    H1 frequency response function estimate H1 = Sxy / Sxx and ordinary coherence.
+
+    Parameters
+    ----------
+        excitation, response (array) :
+            Samples of the input and output channel, shape (samples,) or (buffers, samples).
+        fs, nperseg, window, overlap, detrend :
+            As in welch_psd. nperseg must be shorter than the buffer for a meaningful coherence.
+
+    Returns (f, H, coherence), H and coherence of shape (buffers, frequencies).
+    """
+    x = np.atleast_2d(np.asarray(excitation, dtype=np.float64))
+    y = np.atleast_2d(np.asarray(response, dtype=np.float64))
+    nperseg = x.shape[-1] if nperseg is None else nperseg
+    kwargs = dict(window=window, nperseg=nperseg, noverlap=int(nperseg * overlap), detrend=detrend, axis=-1)
+    f, sxx = scipy.signal.welch(x, fs, **kwargs)
+    _, syy = scipy.signal.welch(y, fs, **kwargs)
+    _, sxy = scipy.signal.csd(x, y, fs, **kwargs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H = sxy / sxx
+        coherence = np.abs(sxy) ** 2 / (sxx * syy)
+    return f, H, np.nan_to_num(coherence)
+
+
+def interpolate_peaks(f, spectrum, bins):
+    """
+    Sub-bin peak positions by parabolic interpolation of the log spectrum.
+
+    Parameters
+    ----------
+        f (array) :
+            Equally spaced frequencies.
+        spectrum (array) :
+            Power or magnitude (real, positive), shape (..., frequencies).
+        bins (array of int) :
+            Bin of a local maximum for each peak, shape (..., peaks).
+
+    Returns (frequency, height) of shape (..., peaks).
+    """
+    spectrum = np.asarray(spectrum)
+    bins = np.clip(np.asarray(bins), 1, spectrum.shape[-1] - 2)
+    tiny = np.finfo(np.float64).tiny
+    a, b, c = (np.log(np.maximum(np.take_along_axis(spectrum, bins + d, axis=-1), tiny)) for d in (-1, 0, 1))
+    denom = a - 2 * b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(denom < 0, 0.5 * (a - c) / denom, 0.0)
+    delta = np.clip(delta, -0.5, 0.5)
+    df = f[1] - f[0]
+    return f[bins] + delta * df, np.exp(b - 0.25 * (a - c) * delta)
+
+
+def pick_peaks(f, spectrum, n_peaks: int = None, fmin: float = None, fmax: float = None,
+               prominence: float = 6.0, distance: int = 3):
+    """
+    Peaks of one spectrum (e.g. the mean of a batch).
+
+    Parameters
+    ----------
+        f (array) :
+            Frequencies in Hz.
+        spectrum (array) :
+            Power spectrum or |FRF|^2, shape (frequencies,).
+        n_peaks (int, optional) :
+            Keep only the n most prominent peaks. Defaults to all peaks.
+        fmin, fmax (float, optional) :
+            Frequency band searched for peaks. Defaults to the whole spectrum.
+        prominence (float, optional) :
+            Minimal prominence of a peak in dB.
+            Defaults to 6.
+        distance (int, optional) :
+            Minimal distance between peaks in bins.
+            Defaults to 3.
+
+    Returns the bins of the peaks in increasing frequency.
+    """
+    level = 10 * np.log10(np.maximum(np.asarray(spectrum, dtype=np.float64), np.finfo(np.float64).tiny))
+    band = np.ones(len(f), dtype=bool)
+    if fmin is not None:
+        band &= f >= fmin
+    if fmax is not None:
+        band &= f <= fmax
+    level[~band] = level[band].min() if band.any() else level.min()
+    bins, props = scipy.signal.find_peaks(level, prominence=prominence, distance=distance)
+    if n_peaks is not None and len(bins) > n_peaks:
+        bins = bins[np.argsort(props['prominences'])[::-1][:n_peaks]]
+    return np.sort(bins)
+
+
+def modal_frequencies(f, spectra, n_peaks: int = None, fmin: float = None, fmax: float = None,
+                      prominence: float = 6.0, search: int = 2):
+    """
+    Modal frequencies with uncertainties from a batch of spectra.
+
+    Peaks are picked on the mean spectrum; in every buffer the maximum within `search` bins of
+    each peak is interpolated (interpolate_peaks), all buffers and peaks at once.
+
+    Parameters
+    ----------
+        f (array) :
+            Frequencies in Hz (welch_psd / frf_h1).
+        spectra (array) :
+            PSD or FRF (complex FRF is used as |H|^2), shape (frequencies,) or (buffers, frequencies).
+        n_peaks, fmin, fmax, prominence :
+            As in pick_peaks.
+        search (int, optional) :
+            Half width in bins of the window searched in every buffer.
+            Defaults to 2.
+
+    Returns (freq, sigma) - lists of floats in increasing frequency, in the format of idealny_FREQ.
+    sigma is the standard error of the mean over buffers combined with the interpolation
+    uncertainty of one bin spacing / sqrt(12).
+    """
+    spectra = np.atleast_2d(np.asarray(spectra))
+    if np.iscomplexobj(spectra):
+        spectra = np.abs(spectra) ** 2
+    peaks = pick_peaks(f, spectra.mean(axis=0), n_peaks, fmin, fmax, prominence)
+    if len(peaks) == 0:
+        return [], []
+
+    # Window of bins around every peak: (peaks, 2*search+1), then the local maximum in each buffer
+    window = np.clip(peaks[:, None] + np.arange(-search, search + 1), 0, spectra.shape[-1] - 1)
+    local = np.argmax(spectra[:, window], axis=-1)
+    bins = window[np.arange(len(peaks)), local]
+    freq, _ = interpolate_peaks(f, spectra, bins)
+
+    n = freq.shape[0]
+    spread = freq.std(axis=0, ddof=1) / np.sqrt(n) if n > 1 else np.zeros(freq.shape[1])
+    sigma = np.sqrt(spread ** 2 + (f[1] - f[0]) ** 2 / 12)
+    return freq.mean(axis=0).tolist(), sigma.tolist()
+
+
+def save_target(path, freq, sigma=None):
+    """Write target frequencies (and their uncertainties) to a JSON file read by algorytm.
+
+    algorytm (wczytaj_czestotliwosci) reads only 'freq'; 'sigma' documents the measurement and is
+    not used by the fitness.
+    """
+    with open(path, 'w') as f:
+        json.dump({'freq': list(map(float, freq)),
+                   'sigma': None if sigma is None else list(map(float, sigma))}, f, indent=1)
+
+
+class test_modal (unittest.TestCase):
+
+    FS    = 10000.0
+    MODES = (1234.56, 3456.78)
+
+    def test_interpolate_peaks(self):
+        # A Gaussian peak is a parabola in the log spectrum - the interpolation is exact
+        f = np.arange(0, 1000, 10.0)
+        centres = np.array([[203.7], [611.2]])
+        spectrum = 2.0 * np.exp(-(f - centres) ** 2 / (2 * 15.0 ** 2))
+        freq, height = interpolate_peaks(f, spectrum, np.array([[20], [61]]))
+        np.testing.assert_allclose(freq, centres, atol=1e-9)
+        np.testing.assert_allclose(height, 2.0, rtol=1e-9)
+
+    def test_modal_frequencies(self):
+        rng = np.random.default_rng(0)
+        n = 4096
+        t = np.arange(n) / self.FS
+        data = np.stack([sum(a * np.sin(2 * np.pi * fm * t + rng.uniform(0, 2 * np.pi))
+                             for fm, a in zip(self.MODES, (1.0, 0.5))) + 0.01 * rng.normal(size=n)
+                         for _ in range(8)])
+        f, psd = welch_psd(data, self.FS)
+        freq, sigma = modal_frequencies(f, psd, n_peaks=2)
+        df = f[1] - f[0]
+        # Far better than the bin spacing (2.44 Hz)
+        np.testing.assert_allclose(freq, self.MODES, atol=0.05 * df)
+        self.assertTrue(all(s >= df / np.sqrt(12) for s in sigma))
+
+    def test_frf_h1(self):
+        rng = np.random.default_rng(1)
+
+        def resonator(f0, r):
+            w = 2 * np.pi * f0 / self.FS
+            return np.array([1.0]), np.array([1.0, -2 * r * np.cos(w), r * r])
+
+        systems = [resonator(self.MODES[0], 0.995), resonator(self.MODES[1], 0.99)]
+        x = rng.normal(size=(4, 65536))
+        y = scipy.signal.lfilter(*systems[0], x) + 0.5 * scipy.signal.lfilter(*systems[1], x)
+        f, H, coherence = frf_h1(x, y, self.FS, nperseg=2048)
+        expected = sum(gain * scipy.signal.freqz(b, a, worN=f, fs=self.FS)[1]
+                       for gain, (b, a) in zip((1.0, 0.5), systems))
+        self.assertLess(np.median(np.abs(H.mean(axis=0) - expected) / np.abs(expected)), 0.01)
+        self.assertGreater(coherence.mean(), 0.99)
+        # Peaks of the exact |H| (close to, but not at the resonator frequencies)
+        fine = np.linspace(1000, 4000, 300001)
+        exact = np.abs(sum(gain * scipy.signal.freqz(b, a, worN=fine, fs=self.FS)[1]
+                           for gain, (b, a) in zip((1.0, 0.5), systems)))
+        peaks = [fine[(fine > fm - 50) & (fine < fm + 50)][np.argmax(exact[(fine > fm - 50) & (fine < fm + 50)])]
+                 for fm in self.MODES]
+        freq, _ = modal_frequencies(f, H, n_peaks=2)
+        np.testing.assert_allclose(freq, peaks, atol=0.1 * (f[1] - f[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
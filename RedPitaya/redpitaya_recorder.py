@@ -0,0 +1,279 @@
+"""On-disk recorder for acquired data.
+
+A recording is a directory:
+    chunk_00000.npy, ...  - samples, .npy files opened as memory maps (samples x channels)
+    index.bin             - one fixed-size record per acquisition (INDEX_DTYPE)
+    metadata.jsonl        - acquisition settings, one JSON line per distinct settings
+
+Every acquisition is stored in one chunk, so reading it is a slice of a memory map and
+nothing is loaded before it is used.
+
+Example
+-------
+    with recorder('campaign_01') as rec:
+        rec.append(rp.acq_data(1, binary=True, convert=True), metadata=settings_metadata(rp))
+
+    rec = recording('campaign_01')
+    data = rec[10]                      # memmap view, read on access
+    first_minute = rec.between(rec.timestamps[0], rec.timestamps[0] + 60)
+"""
+
+import gc
+import os
+import json
+import time
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+# Index record of one acquisition
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),   # time.time() of the acquisition
+    ('chunk',     '<u4'),   # chunk file number
+    ('offset',    '<u8'),   # first sample in the chunk
+    ('length',    '<u8'),   # number of samples
+    ('metadata',  '<i4'),   # line in metadata.jsonl, -1 - none
+])
+
+# Names of the values returned by scpi.get_settings (in order)
+SETTINGS_NAMES = ['decimation', 'averaging', 'trig_dly', 'trig_dly_ns', 'trig_lvl', 'buf_size']
+
+
+def settings_metadata(rp, siglab: bool = False, input4: bool = False) -> dict:
+    """Acquisition settings of a board (scpi.get_settings) as a metadata dictionary."""
+    settings = rp.get_settings(siglab, input4, verbose=False)
+    n = 4 if input4 else 2
+    meta = dict(zip(SETTINGS_NAMES, settings))
+    meta['gain'] = settings[6:6 + n]
+    if siglab:
+        meta['coupling'] = settings[8:10]
+        meta['ext_trig_lvl'] = settings[10]
+    meta['host'] = rp.host
+    return meta
+
+
+def _chunk_path(path, number):
+    return os.path.join(path, f'chunk_{number:05d}.npy')
+
+
+def _shrink_npy(path, rows):
+    """Truncate a .npy file to its first 'rows' rows - the header is rewritten in place with the
+    same length (a shorter shape fits into the padding), then the unused tail is cut off."""
+    with open(path, 'r+b') as f:
+        major, minor = np.lib.format.read_magic(f)
+        if (major, minor) == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        size_format = '<H' if major == 1 else '<I'
+        prefix = len(np.lib.format.magic(major, minor)) + struct.calcsize(size_format)
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran,
+                       'shape': (rows,) + tuple(shape[1:])})
+        header = header + ' ' * (offset - prefix - len(header) - 1) + '\n'
+        f.seek(0)
+        f.write(np.lib.format.magic(major, minor) + struct.pack(size_format, len(header)) + header.encode('latin1'))
+        f.truncate(offset + rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+class recorder (object):
+    """Appends acquisitions to a recording (creates it or continues an existing one)."""
+
+    def __init__(self, path, chunk_samples: int = 2**24, dtype = None, channels: int = None):
+        """
+        Parameters
+        ----------
+            path (str) :
+                Recording directory.
+            chunk_samples (int, optional) :
+                Samples per chunk file (a longer acquisition gets a chunk of its own size).
+                Defaults to 2**24.
+            dtype (optional) :
+                Sample type. Defaults to the type of the first acquisition.
+            channels (int, optional) :
+                Number of channels. Defaults to the shape of the first acquisition.
+        """
+        self.path          = path
+        self.chunk_samples = chunk_samples
+        self.dtype         = None if dtype is None else np.dtype(dtype)
+        self.channels      = channels
+
+        os.makedirs(path, exist_ok=True)
+        self._index = open(os.path.join(path, 'index.bin'), 'ab')
+        self._meta  = open(os.path.join(path, 'metadata.jsonl'), 'a+')
+
+        self._meta.seek(0)
+        lines = self._meta.read().splitlines()
+        self._meta_count = len(lines)
+        self._last_meta  = (json.loads(lines[-1]) if lines else None, len(lines) - 1)
+
+        self._chunk        = None
+        self._chunk_number = -1
+        self._fill         = 0
+        index = np.fromfile(os.path.join(path, 'index.bin'), dtype=INDEX_DTYPE)
+        if len(index):
+            # Continue after the last chunk of an existing recording
+            self._chunk_number = int(index['chunk'].max())
+            last = np.load(_chunk_path(path, self._chunk_number), mmap_mode='r')
+            self.dtype = last.dtype
+            self.channels = last.shape[1]
+
+    def _metadata_id(self, metadata):
+        if metadata is None:
+            return -1
+        if metadata == self._last_meta[0]:
+            return self._last_meta[1]
+        self._meta.write(json.dumps(metadata) + '\n')
+        self._meta.flush()
+        self._last_meta = (metadata, self._meta_count)
+        self._meta_count += 1
+        return self._last_meta[1]
+
+    def _close_chunk(self):
+        """Flush the current chunk and shrink its file to the samples actually written."""
+        if self._chunk is None:
+            return
+        self._chunk.flush()
+        unused = self._fill < self._chunk.shape[0]
+        # The map must be released before the file is truncated (required on Windows): the
+        # recorder holds the only reference (writes make no lasting views), so dropping it
+        # unmaps the file; collect in case a cycle still keeps the memmap alive
+        self._chunk = None
+        gc.collect()
+        if unused:
+            _shrink_npy(_chunk_path(self.path, self._chunk_number), self._fill)
+
+    def _new_chunk(self, samples):
+        self._close_chunk()
+        self._chunk_number += 1
+        shape = (max(self.chunk_samples, samples), self.channels)
+        self._chunk = np.lib.format.open_memmap(
+            _chunk_path(self.path, self._chunk_number), mode='w+', dtype=self.dtype, shape=shape)
+        self._fill = 0
+
+    def append(self, data, timestamp: float = None, metadata: dict = None) -> int:
+        """
+        Store one acquisition.
+
+        Parameters
+        ----------
+            data (array) :
+                Samples, shape (samples,) or (samples, channels).
+            timestamp (float, optional) :
+                Acquisition time (time.time()). Defaults to now.
+            metadata (dict, optional) :
+                Settings (e.g. settings_metadata(rp)); stored once while they do not change.
+
+        Returns the number of the acquisition in the recording.
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, None]
+        if self.dtype is None:
+            self.dtype = data.dtype.newbyteorder('=')
+        if self.channels is None:
+            self.channels = data.shape[1]
+        if data.shape[1] != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {data.shape[1]}")
+
+        n = data.shape[0]
+        if self._chunk is None or self._fill + n > self._chunk.shape[0]:
+            self._new_chunk(n)
+        self._chunk[self._fill:self._fill + n] = data
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        record['chunk']     = self._chunk_number
+        record['offset']    = self._fill
+        record['length']    = n
+        record['metadata']  = self._metadata_id(metadata)
+        self._index.write(record.tobytes())
+        self._fill += n
+        return (self._index.tell() // INDEX_DTYPE.itemsize) - 1
+
+    def flush(self):
+        """Write buffered samples and index records to disk."""
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._index.flush()
+
+    def close(self):
+        """Write all data and shrink the last chunk to the samples actually recorded."""
+        self._close_chunk()
+        self._index.close()
+        self._meta.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class recording (object):
+    """Lazy reader of a recording - samples are read from memory maps on access."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = np.memmap(os.path.join(path, 'index.bin'), dtype=INDEX_DTYPE, mode='r') \
+            if os.path.getsize(os.path.join(path, 'index.bin')) else np.zeros(0, dtype=INDEX_DTYPE)
+        self._chunks = {}
+        self._metadata = None
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    def _chunk(self, number):
+        if number not in self._chunks:
+            self._chunks[number] = np.load(_chunk_path(self.path, number), mmap_mode='r')
+        return self._chunks[number]
+
+    def __getitem__(self, i):
+        """Acquisition i as a (samples, channels) memmap view."""
+        record = self.index[i]
+        offset, length = int(record['offset']), int(record['length'])
+        return self._chunk(int(record['chunk']))[offset:offset + length]
+
+    def metadata(self, i) -> dict:
+        """Settings stored with acquisition i (None if there were none)."""
+        if self._metadata is None:
+            with open(os.path.join(self.path, 'metadata.jsonl')) as f:
+                self._metadata = [json.loads(line) for line in f]
+        number = int(self.index[i]['metadata'])
+        return None if number < 0 else self._metadata[number]
+
+    def between(self, t0: float, t1: float) -> list:
+        """Numbers of the acquisitions with t0 <= timestamp < t1 (timestamps must be increasing)."""
+        return list(range(*np.searchsorted(self.timestamps, [t0, t1])))
+
+
+class test_recorder (unittest.TestCase):
+
+    def test_chunks_shrink_on_close(self):
+        with tempfile.TemporaryDirectory() as path:
+            data = np.arange(3000, dtype=np.float32).reshape(1000, 3)
+            with recorder(path, chunk_samples=2500) as rec:
+                for i in range(3):
+                    rec.append(data + i, timestamp=float(i), metadata={'decimation': 1})
+            # 2 acquisitions in the first chunk, 1 in the second - both without the unused tail
+            self.assertEqual(np.load(_chunk_path(path, 0), mmap_mode='r').shape, (2000, 3))
+            self.assertEqual(np.load(_chunk_path(path, 1), mmap_mode='r').shape, (1000, 3))
+
+            with recorder(path) as rec:
+                rec.append(data + 3, timestamp=3.0)
+            rec = recording(path)
+            self.assertEqual(len(rec), 4)
+            for i in range(4):
+                self.assertTrue(np.array_equal(rec[i], data + i))
+            self.assertEqual(rec.metadata(0), {'decimation': 1})
+            self.assertIsNone(rec.metadata(3))
+            self.assertEqual(rec.between(1.0, 3.0), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,479 @@
 """SCPI access to Red Pitaya."""
 
+import time
 import socket
-import struct
+import hashlib
+import asyncio
+import warnings
+import unittest
+import threading
+from typing import Union
+from contextlib import contextmanager
 import numpy as np
 
 __author__ = "Luka Golinar, Iztok Jeras, Miha Gjura"
 __copyright__ = "Copyright 2023, Red Pitaya"
 
+def parse_ascii_data(data, dtype=np.float64):
+    """Parse an ASCII sample reply '{v1,v2,...}' into a NumPy array.
+
+    Parameters
+    ----------
+        data (bytes, bytearray or str) :
+            Reply as received (e.g. from rx_bytes), braces and whitespace are allowed.
+        dtype (optional) :
+            Type of the returned array (e.g. np.float32, np.int16).
+            Defaults to np.float64.
+
+    Raises
+    ------
+        ValueError if a sample cannot be parsed.
+    """
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    data = bytes(data).strip().strip(b'{}')
+    if not data.strip():
+        return np.empty(0, dtype=dtype)
+
+    # Values are parsed in C without temporary Python strings or floats
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        buff = np.fromstring(data, dtype=np.float64, sep=',')
+
+    if buff.size != data.count(b',') + 1:
+        raise ValueError(f"Could not parse sample {buff.size} of the ASCII data")
+    return buff.astype(dtype, copy=False)
+
+
+def arb_data_text(data) -> str:
+    """Encode an arbitrary waveform as 'v1, v2, ...' with 5 decimals (like f"{n:.5f}" for each sample).
+
+    Samples are rounded to integers of 1e-5 V and their digits are written into a byte matrix,
+    so no Python string is created per sample.
+    """
+    q = np.rint(np.asarray(data, dtype=np.float64).ravel() * 1e5).astype(np.int64)
+    a = np.abs(q)
+    if q.size == 0:
+        return ''
+    if a.max() >= 10 * 10**5:
+        # More than one digit before the point - generic formatting
+        return (', '.join(['%.5f'] * q.size)) % tuple((q / 1e5).tolist())
+
+    # Rows: ',', ' ', sign, unit digit, '.', 5 decimals. Byte 0 marks an empty position.
+    txt = np.zeros((q.size, 10), dtype=np.uint8)
+    txt[:, 0] = ord(',')
+    txt[:, 1] = ord(' ')
+    txt[:, 2] = np.where(q < 0, ord('-'), 0)
+    txt[:, 3] = ord('0') + a // 10**5
+    txt[:, 4] = ord('.')
+    for i in range(5):
+        txt[:, 9 - i] = ord('0') + (a // 10**i) % 10
+    txt = txt.reshape(-1)[2:]
+    return txt[txt != 0].tobytes().decode('ascii')
+
+
+def arb_digest(data) -> bytes:
+    """Hash of an arbitrary waveform, used to skip uploading a waveform the board already holds."""
+    return hashlib.blake2b(np.ascontiguousarray(data, dtype=np.float64).tobytes(), digest_size=16).digest()
+
+
+def sour_commands(
+    chan: int,
+    func: str = "sine",
+    volt: float = 1,
+    freq: float = 1000,
+    offset: float = 0,
+    phase: float = 0,
+    dcyc: float = 0.5,
+    data: np.ndarray = None,
+    burst: bool = False,
+    ncyc: int = 1,
+    nor: int = 1,
+    period: int = None,
+    trig: str = "int",
+    sdrlab: bool = False,
+    siglab: bool = False,
+) -> list:
+    """Validate generator settings and return the SCPI commands for them. See scpi.sour_set."""
+
+    ### Constants ###
+    waveform_list = ["SINE","SQUARE","TRIANGLE","SAWU","SAWD","PWM","ARBITRARY","DC","DC_NEG"]
+    trigger_list = ["EXT_PE","EXT_NE","INT","GATED"]
+    buff_size = 16384
+
+    ### Limits ###
+    volt_lim = 1
+    offs_lim = 1
+    phase_lim = 360
+    freq_up_lim = 50e6          # 50 MHz
+    freq_down_lim = 0
+
+    if siglab:
+        volt_lim = 5
+        offs_lim = 5
+    elif sdrlab:
+        freq_down_lim = 300e3   # 300 kHz
+
+
+
+    ### CHECK FOR ERRORS ###
+
+    try:
+        assert chan in (1,2)
+    except AssertionError as channel_err:
+        raise ValueError("Channel needs to be either 1 or 2") from channel_err
+
+    try:
+        assert func.upper() in waveform_list
+    except AssertionError as waveform_err:
+        raise ValueError(f"{func.upper()} is not a defined waveform") from waveform_err
+
+    try:
+        assert freq_down_lim < freq <= freq_up_lim
+    except AssertionError as freq_err:
+        raise ValueError(f"Frequency is out of range {freq_down_lim, freq_up_lim} Hz") from freq_err
+
+    try:
+        assert abs(volt) <= volt_lim
+    except AssertionError as ampl_err:
+        raise ValueError(f"Amplitude is out of range {-volt_lim, volt_lim} V") from ampl_err
+
+    try:
+        assert abs(offset) <= offs_lim
+    except AssertionError as offs_err:
+        raise ValueError(f"Offset is out of range {-offs_lim, offs_lim} V") from offs_err
+
+    try:
+        assert 0 <= dcyc <= 1
+    except AssertionError as dcyc_err:
+        raise ValueError(f"Duty Cycle is out of range {0, 1}") from dcyc_err
+
+    try:
+        assert abs(phase) <= phase_lim
+    except AssertionError as phase_err:
+        raise ValueError(f"Phase is out of range {-phase_lim, phase_lim} deg") from phase_err
+
+    if data is not None:
+
+        try:
+            assert data.shape[0] <= buff_size
+        except AssertionError as data_err:
+            raise ValueError(f"Data array is too long. Max length is {buff_size}") from data_err
+
+        #try:
+        #    assert max(absolute(data)) <= volt_lim
+        #except AssertionError:
+        #    raise ValueError(f"Amplitude of data is out of range {-volt_lim, volt_lim}")
+
+    try:
+        assert ncyc >= 1
+    except AssertionError as ncyc_err:
+        raise ValueError("NCYC minimum is 1") from ncyc_err
+
+    try:
+        assert nor >= 1
+    except AssertionError as nor_err:
+        raise ValueError("NOR minimum is 1") from nor_err
+
+    if period is not None:
+        try:
+            assert period >= 1
+        except AssertionError as period_err:
+            raise ValueError("Minimal burst period 1 µs") from period_err
+
+    try:
+        assert trig.upper() in trigger_list
+    except AssertionError as trig_err:
+        raise ValueError(f"{trig.upper()} is not a defined trigger source") from trig_err
+
+    try:
+        assert not((siglab is True) and (sdrlab is True))
+    except AssertionError as board_err:
+        raise ValueError("Please select only one board option. 'siglab' and 'sdrlab' cannot be true at the same time.") from board_err
+
+
+    ### COMMANDS ###
+    cmds = []
+    cmds.append(f"SOUR{chan}:FUNC {func.upper()}")
+    cmds.append(f"SOUR{chan}:VOLT {volt}")
+
+    if func.upper() not in waveform_list[7:9]:
+        cmds.append(f"SOUR{chan}:FREQ:FIX {freq}")
+
+    cmds.append(f"SOUR{chan}:VOLT:OFFS {offset}")
+    cmds.append(f"SOUR{chan}:PHAS {phase}")
+
+    if func.upper() == "PWM":
+        cmds.append(f"SOUR{chan}:DCYC {dcyc}")
+
+    if (data is not None) and (func.upper() == "ARBITRARY"):
+        cust_wf = arb_data_text(data)
+
+        cmds.append(f"SOUR{chan}:TRAC:DATA:DATA {cust_wf}")
+
+    if burst:
+        cmds.append(f"SOUR{chan}:BURS:STAT BURST")
+        cmds.append(f"SOUR{chan}:BURS:NCYC {ncyc}")
+        cmds.append(f"SOUR{chan}:BURS:NOR {nor}")
+
+        if period is not None:
+            cmds.append(f"SOUR{chan}:BURS:INT:PER {period}")
+    else:
+        cmds.append(f"SOUR{chan}:BURS:STAT CONTINUOUS")
+
+    cmds.append(f"SOUR{chan}:TRIG:SOUR {trig.upper()}")
+
+    return cmds
+
+
+def acq_commands(
+    dec: int = 1,
+    trig_lvl: float = 0,
+    trig_delay: int = 0,
+    trig_delay_ns: bool = False,
+    units: str = None,
+    sample_format: str = None,
+    averaging: bool = True,
+    gain: list = None,               # 2 channels (double the length if 4-input)
+    coupling: list = None,           # 2 channels
+    ext_trig_lvl: float = 0,
+    siglab: bool = False,
+    input4: bool = False
+) -> list:
+    """Validate acquisition settings and return the SCPI commands for them. See scpi.acq_set."""
+
+    ### Constants ###
+    #decimation_list = [1,2,4,8,16,32,64,128,256,512,1024,2048,4096,8192,16384,32768,65536]
+    gain_list = ["LV","HV"]
+    coupling_list = ["DC","AC"]
+    units_list = ["RAW","VOLTS"]
+    format_list = ["BIN", "ASCII"]
+
+    ### Limits ###
+    if input4:   # Set number of channels
+        n = 4
+    else:
+        n = 2
+    trig_lvl_lim = 1.0
+    gain_lvl = "LV"
+
+    if gain is not None:
+        for i in gain:
+            if i.upper() == "HV":
+                trig_lvl_lim = 20.0
+                gain_lvl = "HV"
+
+    ### CHECK FOR ERRORS ###
+    #try:
+    #    assert dec in decimation_list
+    #except AssertionError as dec_err:
+    #        raise ValueError(f"Decimation needs to be a power of 2 {1, 65536}")
+
+    try:
+        assert abs(trig_lvl) <= trig_lvl_lim
+    except AssertionError as trig_err:
+        raise ValueError(f"Trigger level out of range {-trig_lvl_lim, trig_lvl_lim} V",
+                         f"for gain {gain_lvl}") from trig_err
+
+    try:
+        assert trig_delay >= 0
+    except AssertionError as trig_dly_err:
+        raise ValueError("Trigger delay cannot be less that 0") from trig_dly_err
+
+    if units is not None:
+        try:
+            assert units.upper() in units_list
+        except AssertionError as unit_err:
+            raise ValueError(f"{units.upper()} is not a defined unit") from unit_err
+
+    if sample_format is not None:
+        try:
+            assert sample_format.upper() in format_list
+        except AssertionError as format_err:
+            raise ValueError(f"{sample_format.upper()} is not a defined format") from format_err
+
+    if gain is not None:
+        try:
+            assert (gain[0].upper() in gain_list) and (gain[1].upper() in gain_list)
+        except AssertionError as gain_err:
+            raise ValueError(f"{gain[0].upper()} or {gain[1].upper()} is not a defined gain") from gain_err
+
+    if siglab and coupling is not None:
+        try:
+            assert (coupling[0].upper() in coupling_list) and (coupling[1].upper() in coupling_list)
+        except AssertionError as coupling_err:
+            raise ValueError(f"{coupling[0].upper()} or {coupling[1].upper()}",
+                             "is not a defined coupling") from coupling_err
+        try:
+            assert abs(ext_trig_lvl) <= trig_lvl_lim
+        except AssertionError as ext_trig_err:
+            raise ValueError("External trigger level out of range",
+                             f"{-trig_lvl_lim, trig_lvl_lim} V") from ext_trig_err
+
+    try:
+        assert not((siglab is True) and (input4 is True))
+    except AssertionError as board_err:
+        raise ValueError("Please select only one board option.",
+                         "'siglab' and 'input4' cannot be true at the same time.") from board_err
+
+
+    ### COMMANDS ###
+    cmds = []
+    cmds.append(f"ACQ:DEC {dec}")
+
+    if averaging:
+        cmds.append("ACQ:AVG ON")
+    else:
+        cmds.append("ACQ:AVG OFF")
+
+    if trig_delay_ns:
+        cmds.append(f"ACQ:TRIG:DLY:NS {trig_delay}")
+    else:
+        cmds.append(f"ACQ:TRIG:DLY {trig_delay}")
+
+    if units is not None:
+        cmds.append(f"ACQ:DATA:UNITS {units.upper()}")
+    if sample_format is not None:
+        cmds.append(f"ACQ:DATA:FORMAT {sample_format.upper()}")
+
+    if gain is not None:
+        for i in range(n):
+            cmds.append(f"ACQ:SOUR{i+1}:GAIN {gain[i].upper()}")
+
+    cmds.append(f"ACQ:TRIG:LEV {trig_lvl}")
+
+    if siglab and coupling is not None:
+        for i in range(n):
+            cmds.append(f"ACQ:SOUR{i+1}:COUP {coupling[i].upper()}")
+
+        cmds.append(f"ACQ:TRIG:EXT:LEV {ext_trig_lvl}")
+
+    return cmds
+
+
+def acq_data_command(
+    chan: int,
+    start: int = None,
+    end: int = None,
+    num_samples: int = None,
+    old: bool = False,
+    lat: bool = False,
+    input4: bool = False
+) -> str:
+    """Validate the buffer selection and return the data query for it. See scpi.acq_data."""
+
+    low_lim = 0
+    up_lim = 16384
+
+    # Check input data for errors
+    if input4:
+        try:
+            assert chan in (1,2,3,4)
+        except AssertionError as chanel_err:
+            raise ValueError("Channel needs to be either 1, 2, 3 or 4") from chanel_err
+    else:
+        try:
+            assert chan in (1,2)
+        except AssertionError as chanel_err:
+            raise ValueError("Channel needs to be either 1 or 2") from chanel_err
+
+    try:
+        assert not((old is True) and (lat is True))
+    except AssertionError as arg_err:
+        raise ValueError("Please select only one. 'old' and 'lat' cannot be True at the same time.") from arg_err
+
+    if start is not None:
+        try:
+            assert 16384 >= start >= 0
+        except AssertionError as start_err:
+            raise ValueError(f"Start position out of range {low_lim, up_lim}") from start_err
+
+    if end is not None:
+        try:
+            assert 16384 >= end >= 0
+        except AssertionError as end_err:
+            raise ValueError(f"End position out of range {low_lim, up_lim}") from end_err
+
+    if num_samples is not None:
+        try:
+            assert 16384 >= num_samples >= 0
+        except AssertionError as sample_err:
+            raise ValueError(f"Sample number out of range {low_lim, up_lim}") from sample_err
+
+    # Determine the output data
+    if(start is not None) and (end is not None):
+        return f"ACQ:SOUR{chan}:DATA:STA:END? {start},{end}"
+
+    elif(start is not None) and (num_samples is not None):
+        return f"ACQ:SOUR{chan}:DATA:STA:N? {start},{num_samples}"
+
+    elif old and (num_samples is not None):
+        return f"ACQ:SOUR{chan}:DATA:OLD:N? {num_samples}"
+
+    elif lat and (num_samples is not None):
+        return f"ACQ:SOUR{chan}:DATA:LAT:N? {num_samples}"
+
+    else:
+        return f"ACQ:SOUR{chan}:DATA?"
+
+
+def decode_acq_data(data, units: str, binary: bool = False, convert: bool = False):
+    """Convert a received data reply (bytes from rx_arb or rx_bytes). See scpi.acq_data."""
+    if binary:
+        if convert:
+            # Big-endian view on the received buffer - no per-sample decoding, no copy
+            if units == "VOLTS":
+                return np.frombuffer(data, dtype='>f4')
+            elif units == "RAW":
+                return np.frombuffer(data, dtype='>i2')
+        return data
+
+    if convert:
+        return parse_ascii_data(data, np.int16 if units == "RAW" else np.float64)
+    return bytes(data).decode('utf-8')
+
+
+# Headers that the board changes by itself or that are actions - their values are never cached
+VOLATILE_HEADERS = ('ACQ:TRIG', 'ACQ:TRIG:STAT', 'ACQ:TRIG:FILL', 'ACQ:WPOS', 'ACQ:TPOS')
+
+# Setting a header changes the value read back from the dependent headers
+DEPENDENT_HEADERS = {
+    'ACQ:DEC': ('ACQ:TRIG:DLY:NS',),
+    'ACQ:TRIG:DLY': ('ACQ:TRIG:DLY:NS',),
+    'ACQ:TRIG:DLY:NS': ('ACQ:TRIG:DLY',),
+}
+
+# Headers cleared by the reset commands (None - everything)
+RESET_PREFIXES = {'GEN:RST': ('SOUR', 'OUTPUT'), 'ACQ:RST': ('ACQ',), '*RST': None}
+
+
+def _split_command(msg):
+    """Header and value of a command ('SOUR1:FREQ:FIX 1000' -> ('SOUR1:FREQ:FIX', '1000'))."""
+    header, _, value = msg.strip().partition(' ')
+    return header.upper(), value.strip().upper()
+
+
+class scpi_reply (object):
+    """Reply to a query queued in scpi.batch(), available after the batch is flushed."""
+
+    def __init__(self, msg, arb=False):
+        self.msg  = msg
+        self.arb  = arb
+        self.done = False
+        self._value = None
+
+    def _set(self, value):
+        self._value = value
+        self.done   = True
+
+    @property
+    def value(self):
+        """Received reply (str, or bytearray for binary block replies)."""
+        if not self.done:
+            raise RuntimeError(f"SCPI >> reply to '{self.msg}' is not received yet (batch not flushed)")
+        return self._value
+
+
 class scpi (object):
     """SCPI class used to access Red Pitaya over an IP network."""
     delimiter = '\r\n'
@@ -19,8 +486,29 @@ class scpi (object):
         self.port    = port
         self.timeout = timeout
 
+        # Bytes received after the last delimiter wait here for the next read
+        self._rx_buffer = bytearray()
+        self._rx_scan   = 0
+
+        # Shadow copy of the generator and acquisition settings, header -> value:
+        # _sent holds the setters as last sent by this object (only to skip unchanged setters,
+        # 'SOUR<n>:TRAC:DATA:DATA' holds the digest of the uploaded waveform), _state holds the
+        # replies read back from the board - the cache answers queries only in the reply format
+        self._sent  = {}
+        self._state = {}
+
+        # Commands and queued replies of an open batch()
+        self._batch_depth = 0
+        self._tx_buffer   = bytearray()
+        self._pending     = []
+
+        # Serializes status polling when one board is shared by several threads/tasks
+        self._poll_lock   = threading.Lock()
+
         try:
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Short commands are sent at once instead of waiting for the previous ACK (Nagle)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
             if timeout is not None:
                 self._socket.settimeout(timeout)
@@ -41,43 +529,74 @@ class scpi (object):
 
     def rx_txt(self, chunksize = 4096):
         """Receive text string and return it after removing the delimiter."""
-        msg = ''
+        return self.rx_bytes(chunksize).decode('utf-8')
+
+    def rx_bytes(self, chunksize = 4096):
+        """Receive a message as bytes (not decoded) and return it after removing the delimiter.
+
+        Bytes are collected in a persistent receive buffer and the delimiter is searched only in
+        the newly received part. Anything received after the delimiter is kept for the next call.
+        """
+        if self._tx_buffer or self._pending:
+            self.flush()
+        delimiter = self.delimiter.encode('utf-8')
+        buff = self._rx_buffer
         while 1:
-            chunk = self._socket.recv(chunksize).decode('utf-8') # Receive chunk size of 2^n preferably
-            msg += chunk
-            if (len(msg) >= 2 and msg[-2:] == self.delimiter):
-                return msg[:-2]
+            end = buff.find(delimiter, self._rx_scan)
+            if end >= 0:
+                msg = bytes(buff[:end])
+                del buff[:end + len(delimiter)]
+                self._rx_scan = 0
+                return msg
+            # The delimiter may be split between two chunks
+            self._rx_scan = max(len(buff) - len(delimiter) + 1, 0)
+            chunk = self._socket.recv(chunksize) # Receive chunk size of 2^n preferably
+            if not chunk:
+                raise ConnectionError('SCPI >> connection closed by the server')
+            buff += chunk
 
     def rx_txt_check_error(self, chunksize = 4096,stop = True):
         msg = self.rx_txt(chunksize)
         self.check_error(stop)
         return msg
 
+    def _rx_exact(self, view):
+        """Fill the writable buffer 'view' completely with received bytes (no intermediate copies)."""
+        view = memoryview(view).cast('B')
+        # Bytes already buffered by rx_txt come first
+        pos = min(len(self._rx_buffer), len(view))
+        if pos:
+            view[:pos] = self._rx_buffer[:pos]
+            del self._rx_buffer[:pos]
+            self._rx_scan = 0
+        while pos < len(view):
+            n = self._socket.recv_into(view[pos:])
+            if n == 0:
+                raise ConnectionError('SCPI >> connection closed by the server')
+            pos += n
+
     def rx_arb(self):
-        """ Recieve binary data from scpi server"""
-        numOfBytes = 0
-        data=b''
-        while len(data) != 1:
-            data = self._socket.recv(1)
-        if data != b'#':
-            return False
-        data=b''
+        """ Recieve binary data from scpi server
 
-        while len(data) != 1:
-            data = self._socket.recv(1)
-        numOfNumBytes = int(data)
+        The IEEE 488.2 block header '#<n><len>' is read with exact-length reads and the
+        payload is received directly into a preallocated bytearray, which is returned.
+        """
+        if self._tx_buffer or self._pending:
+            self.flush()
+        head = bytearray(2)
+        self._rx_exact(head)
+        if head[0:1] != b'#':
+            return False
+        numOfNumBytes = int(head[1:2])
         if numOfNumBytes <= 0:
             return False
-        data=b''
 
-        while len(data) != numOfNumBytes:
-            data += (self._socket.recv(1))
-        numOfBytes = int(data)
-        data=b''
+        size = bytearray(numOfNumBytes)
+        self._rx_exact(size)
+        numOfBytes = int(size)
 
-        while len(data) < numOfBytes:
-            r_size = min(numOfBytes - len(data),4096)
-            data += (self._socket.recv(r_size))
+        data = bytearray(numOfBytes)
+        self._rx_exact(data)
         return data
 
     def rx_arb_check_error(self,stop = True):
@@ -86,23 +605,169 @@ class scpi (object):
         return data
 
     def tx_txt(self, msg):
-        """Send text string ending and append delimiter."""
+        """Send text string ending and append delimiter.
+
+        Inside batch() the command is only appended to the send buffer.
+        """
+        self._track_state(msg)
+        if self._batch_depth:
+            self._tx_buffer += (msg + self.delimiter).encode('utf-8')
+            return None
         return self._socket.sendall((msg + self.delimiter).encode('utf-8')) # was send(().encode('utf-8'))
 
+    def _track_state(self, msg):
+        """Update the settings cache with a sent command (setters of any origin and resets).
+
+        A setter is remembered as sent; its read-back value is dropped until it is queried again.
+        """
+        header, value = _split_command(msg)
+        if header in RESET_PREFIXES:
+            self.invalidate(RESET_PREFIXES[header])
+            return
+        if not value or header.endswith('?') or not header.startswith(('SOUR', 'OUTPUT', 'ACQ')):
+            return
+        for dependent in DEPENDENT_HEADERS.get(header, ()):
+            self._sent.pop(dependent, None)
+            self._state.pop(dependent, None)
+        self._state.pop(header, None)
+        if header in VOLATILE_HEADERS or header.endswith('TRAC:DATA:DATA'):
+            # Waveforms are cached as digests by sour_set only
+            self._sent.pop(header, None)
+        else:
+            self._sent[header] = value
+
+    def _remember(self, reply):
+        """Store the reply to a settings query (like 'ACQ:DEC?') in the settings cache."""
+        header = reply.msg.strip().upper()
+        if not header.endswith('?') or ' ' in header:
+            return
+        header = header[:-1]
+        is_data = ':DATA' in header and not header.startswith('ACQ:DATA:')
+        if header.startswith(('SOUR', 'OUTPUT', 'ACQ')) and header not in VOLATILE_HEADERS and not is_data:
+            self._state[header] = reply.value.strip()
+
+    def invalidate(self, prefixes = None):
+        """Forget cached settings - all of them, or the headers starting with one of 'prefixes'.
+
+        Use it when the board was changed by something else than this object (another client,
+        the web interface), the cache then follows the board again.
+        """
+        for cache in (self._sent, self._state):
+            if prefixes is None:
+                cache.clear()
+            else:
+                for header in [header for header in cache if header.startswith(tuple(prefixes))]:
+                    del cache[header]
+
     def tx_txt_check_error(self, msg,stop = True):
         self.tx_txt(msg)
         self.check_error(stop)
 
     def txrx_txt(self, msg):
-        """Send/receive text string."""
+        """Send/receive text string.
+
+        Inside batch() the commands queued so far are flushed together with the query.
+        """
         self.tx_txt(msg)
         return self.rx_txt()
 
+    @contextmanager
+    def batch(self):
+        """Coalesce commands and queries into one send.
+
+        Inside the block tx_txt only buffers the command and query() returns a scpi_reply
+        placeholder. When the outermost block exits, all commands are sent with one sendall
+        and the replies are read in order. Blocks can be nested.
+
+        If the block raises, nothing more is sent: the buffered commands and the queued replies
+        are dropped (also when an inner block raised) and the settings cache is cleared, because
+        it already holds the values of the dropped setters.
+
+        Example
+        -------
+            with rp.batch():
+                rp.tx_txt('ACQ:DEC 1')
+                dec = rp.query('ACQ:DEC?')
+                lev = rp.query('ACQ:TRIG:LEV?')
+            print(dec.value, lev.value)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            self._discard()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self.flush()
+
+    def _discard(self):
+        """Drop the buffered commands and the queued replies of an interrupted batch."""
+        self._tx_buffer = bytearray()
+        self._pending   = []
+        self.invalidate()
+
+    def query(self, msg, arb = False):
+        """Send a query and return its scpi_reply (read at the end of an open batch).
+
+        Set arb to True if the reply is a binary block (read with rx_arb).
+        """
+        reply = scpi_reply(msg, arb)
+        self.tx_txt(msg)
+        if self._batch_depth:
+            self._pending.append(reply)
+        else:
+            reply._set(self.rx_arb() if arb else self.rx_txt())
+            self._remember(reply)
+        return reply
+
+    def query_cached(self, msg, refresh = False):
+        """Reply to a settings query from the settings cache; sent to Red Pitaya only if the value
+        was not read back since it was last set, or refresh is True (inside batch() the reply is
+        read at the end of the block). Cached replies are exactly what the board returned.
+        """
+        header = msg.strip().upper().rstrip('?')
+        if not refresh and header in self._state:
+            reply = scpi_reply(msg)
+            reply._set(self._state[header])
+            return reply
+        return self.query(msg)
+
+    def _send_changed(self, cmds):
+        """Send, in one batch, only the setters whose value differs from the one last sent."""
+        try:
+            with self.batch():
+                for cmd in cmds:
+                    header, value = _split_command(cmd)
+                    if value and self._sent.get(header) == value:
+                        continue
+                    self.tx_txt(cmd)
+        except BaseException:
+            # Unknown which of the commands reached the board
+            self.invalidate()
+            raise
+
+    def flush(self):
+        """Send the buffered commands and read the replies of the queued queries."""
+        pending, self._pending = self._pending, []
+        if self._tx_buffer:
+            data, self._tx_buffer = self._tx_buffer, bytearray()
+            self._socket.sendall(data)
+        for reply in pending:
+            reply._set(self.rx_arb() if reply.arb else self.rx_txt())
+            self._remember(reply)
+
     def check_error(self,stop = True):
-        res = int(self.stb_q())
-        if (res & 0x4):
-            while 1:
-                err = self.err_n()
+        # Status byte and error count in one round trip, then all errors in one more
+        with self.batch():
+            stb = self.query('*STB?')
+            count = self.query('SYST:ERR:COUN?')
+        if (int(stb.value) & 0x4):
+            with self.batch():
+                errors = [self.query('SYST:ERR:NEXT?') for _ in range(max(int(count.value), 1))]
+            for reply in errors:
+                err = reply.value
                 if (err.startswith('0,')):
                     break
                 print(err)
@@ -110,6 +775,117 @@ class scpi (object):
                 if (len(n) > 0 and stop and int(n[0]) > 9500):
                     exit(1)
 
+    def _poll_once(self, query, expected):
+        with self._poll_lock:
+            return self.txrx_txt(query) == expected
+
+    def wait_for(
+        self,
+        query: str,
+        expected: str,
+        timeout: float = None,
+        interval: float = 0.001,
+        max_interval: float = 0.05,
+        backoff: float = 1.5,
+        cancel: threading.Event = None
+    ) -> bool:
+        """
+        Poll a status query until it returns the expected reply.
+
+        The polling interval starts at 'interval' and grows by 'backoff' up to 'max_interval',
+        so short waits return quickly and long waits do not load the board's SCPI server.
+
+        Parameters
+        ----------
+            query (str) :
+                Status query, e.g. 'ACQ:TRIG:STAT?'.
+            expected (str) :
+                Reply that ends the wait, e.g. 'TD'.
+            timeout (float, optional) :
+                Overall deadline in seconds. `None` waits without a limit.
+                Defaults to None.
+            interval (float, optional) :
+                First polling interval in seconds.
+                Defaults to 0.001.
+            max_interval (float, optional) :
+                Longest polling interval in seconds.
+                Defaults to 0.05.
+            backoff (float, optional) :
+                Interval multiplier after each unsuccessful poll.
+                Defaults to 1.5.
+            cancel (threading.Event, optional) :
+                Setting the event from another thread ends the wait.
+                Defaults to None.
+
+        Returns True when the reply was received and False if the wait was cancelled.
+
+        Raises
+        ------
+            TimeoutError if the deadline passes.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = interval
+        while 1:
+            if self._poll_once(query, expected):
+                return True
+            if cancel is not None and cancel.is_set():
+                return False
+            sleep = delay
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"SCPI >> '{query}' did not return '{expected}' within {timeout} s")
+                sleep = min(sleep, left)
+            if cancel is not None:
+                if cancel.wait(sleep):
+                    return False
+            else:
+                time.sleep(sleep)
+            delay = min(delay * backoff, max_interval)
+
+    async def wait_for_async(
+        self,
+        query: str,
+        expected: str,
+        timeout: float = None,
+        interval: float = 0.001,
+        max_interval: float = 0.05,
+        backoff: float = 1.5
+    ) -> bool:
+        """
+        Asyncio variant of wait_for. Each poll runs in a worker thread and the event loop
+        sleeps between polls; cancel the task to stop waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = interval
+        while 1:
+            if await asyncio.to_thread(self._poll_once, query, expected):
+                return True
+            sleep = delay
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"SCPI >> '{query}' did not return '{expected}' within {timeout} s")
+                sleep = min(sleep, left)
+            await asyncio.sleep(sleep)
+            delay = min(delay * backoff, max_interval)
+
+    def wait_for_trigger(self, timeout: float = None, **kwargs) -> bool:
+        """Wait until the acquisition is triggered (ACQ:TRIG:STAT? returns TD). See wait_for."""
+        return self.wait_for('ACQ:TRIG:STAT?', 'TD', timeout, **kwargs)
+
+    def wait_for_fill(self, timeout: float = None, **kwargs) -> bool:
+        """Wait until the buffer is filled after the trigger (ACQ:TRIG:FILL? returns 1). See wait_for."""
+        return self.wait_for('ACQ:TRIG:FILL?', '1', timeout, **kwargs)
+
+    async def wait_for_trigger_async(self, timeout: float = None, **kwargs) -> bool:
+        """Asyncio variant of wait_for_trigger."""
+        return await self.wait_for_async('ACQ:TRIG:STAT?', 'TD', timeout, **kwargs)
+
+    async def wait_for_fill_async(self, timeout: float = None, **kwargs) -> bool:
+        """Asyncio variant of wait_for_fill."""
+        return await self.wait_for_async('ACQ:TRIG:FILL?', '1', timeout, **kwargs)
+
 # SCPI command functions
 
     def sour_set(
@@ -161,6 +937,8 @@ class scpi (object):
                 Numpy ``ndarray`` of max 16384 values, floats in range {-1,1}
                 (or {-5,5} for SIGNALlab).
                 Define the custom waveform if "func" is "ARBITRARY".
+                A waveform identical to the last one uploaded to the channel by this
+                object is not sent again (the cache is cleared by GEN:RST and *RST).
                 Defaults to `None`.
             burst (bool, optional) :
                 Enable/disable Burst mode. (`True` - BURST, `False` - CONINUOUS)
@@ -189,6 +967,9 @@ class scpi (object):
         other than STEMlab 125-14, change the bool value of the appropriate
         parameter to true (sdrlab, siglab)
 
+        Parameters that did not change since they were last set by this object are not sent
+        again (call invalidate() after the board was changed by another client).
+
         Raises
         ------
 
@@ -196,138 +977,22 @@ class scpi (object):
         
         """
 
-        ### Constants ###
-        waveform_list = ["SINE","SQUARE","TRIANGLE","SAWU","SAWD","PWM","ARBITRARY","DC","DC_NEG"]
-        trigger_list = ["EXT_PE","EXT_NE","INT","GATED"]
-        buff_size = 16384
-
-        ### Limits ###
-        volt_lim = 1
-        offs_lim = 1
-        phase_lim = 360
-        freq_up_lim = 50e6          # 50 MHz
-        freq_down_lim = 0
-
-        if siglab:
-            volt_lim = 5
-            offs_lim = 5
-        elif sdrlab:
-            freq_down_lim = 300e3   # 300 kHz
-
-
-
-        ### CHECK FOR ERRORS ###
-
-        try:
-            assert chan in (1,2)
-        except AssertionError as channel_err:
-            raise ValueError("Channel needs to be either 1 or 2") from channel_err
-
-        try:
-            assert func.upper() in waveform_list
-        except AssertionError as waveform_err:
-            raise ValueError(f"{func.upper()} is not a defined waveform") from waveform_err
-
-        try:
-            assert freq_down_lim < freq <= freq_up_lim
-        except AssertionError as freq_err:
-            raise ValueError(f"Frequency is out of range {freq_down_lim, freq_up_lim} Hz") from freq_err
-
-        try:
-            assert abs(volt) <= volt_lim
-        except AssertionError as ampl_err:
-            raise ValueError(f"Amplitude is out of range {-volt_lim, volt_lim} V") from ampl_err
-
-        try:
-            assert abs(offset) <= offs_lim
-        except AssertionError as offs_err:
-            raise ValueError(f"Offset is out of range {-offs_lim, offs_lim} V") from offs_err
-
-        try:
-            assert 0 <= dcyc <= 1
-        except AssertionError as dcyc_err:
-            raise ValueError(f"Duty Cycle is out of range {0, 1}") from dcyc_err
-
-        try:
-            assert abs(phase) <= phase_lim
-        except AssertionError as phase_err:
-            raise ValueError(f"Phase is out of range {-phase_lim, phase_lim} deg") from phase_err
-
-        if data is not None:
-
-            try:
-                assert data.shape[0] <= buff_size
-            except AssertionError as data_err:
-                raise ValueError(f"Data array is too long. Max length is {buff_size}") from data_err
-
-            #try:
-            #    assert max(absolute(data)) <= volt_lim
-            #except AssertionError:
-            #    raise ValueError(f"Amplitude of data is out of range {-volt_lim, volt_lim}")
-
-        try:
-            assert ncyc >= 1
-        except AssertionError as ncyc_err:
-            raise ValueError("NCYC minimum is 1") from ncyc_err
-
-        try:
-            assert nor >= 1
-        except AssertionError as nor_err:
-            raise ValueError("NOR minimum is 1") from nor_err
-
-        if period is not None:
-            try:
-                assert period >= 1
-            except AssertionError as period_err:
-                raise ValueError("Minimal burst period 1 µs") from period_err
-
-        try:
-            assert trig.upper() in trigger_list
-        except AssertionError as trig_err:
-            raise ValueError(f"{trig.upper()} is not a defined trigger source") from trig_err
-
-        try:
-            assert not((siglab is True) and (sdrlab is True))
-        except AssertionError as board_err:
-            raise ValueError("Please select only one board option. 'siglab' and 'sdrlab' cannot be true at the same time.") from board_err
-
-
-
-        ### Variables ###
-        wf_data = []
-
-
-        ### SEND COMMANDS TO RP ###
-        self.tx_txt(f"SOUR{chan}:FUNC {func.upper()}")
-        self.tx_txt(f"SOUR{chan}:VOLT {volt}")
-
-        if func.upper() not in waveform_list[7:9]:
-            self.tx_txt(f"SOUR{chan}:FREQ:FIX {freq}")
-
-        self.tx_txt(f"SOUR{chan}:VOLT:OFFS {offset}")
-        self.tx_txt(f"SOUR{chan}:PHAS {phase}")
-
-        if func.upper() == "PWM":
-            self.tx_txt(f"SOUR{chan}:DCYC {dcyc}")
-
+        # A waveform identical to the one the board holds is not sent again
+        digest = None
+        arb_header = f"SOUR{chan}:TRAC:DATA:DATA"
         if (data is not None) and (func.upper() == "ARBITRARY"):
-            for n in data:
-                wf_data.append(f"{n:.5f}")
-            cust_wf = ", ".join(map(str, wf_data))
-
-            self.tx_txt(f"SOUR{chan}:TRAC:DATA:DATA {cust_wf}")
+            digest = arb_digest(data)
+            if self._sent.get(arb_header) == digest:
+                data = None
 
-        if burst:
-            self.tx_txt(f"SOUR{chan}:BURS:STAT BURST")
-            self.tx_txt(f"SOUR{chan}:BURS:NCYC {ncyc}")
-            self.tx_txt(f"SOUR{chan}:BURS:NOR {nor}")
+        cmds = sour_commands(
+            chan, func, volt, freq, offset, phase, dcyc, data, burst, ncyc, nor, period, trig, sdrlab, siglab)
 
-            if period is not None:
-                self.tx_txt(f"SOUR{chan}:BURS:INT:PER {period}")
-        else:
-            self.tx_txt(f"SOUR{chan}:BURS:STAT CONTINUOUS")
+        # Only the parameters that changed since the last call are sent
+        self._send_changed(cmds)
 
-        self.tx_txt(f"SOUR{chan}:TRIG:SOUR {trig.upper()}")
+        if digest is not None:
+            self._sent[arb_header] = digest
 
         #print(f"SOUR{chan} set successfully")
 
@@ -405,6 +1070,9 @@ class scpi (object):
         or STEMlab 125-14 4-Input change the bool value of the appropriate parameter to
         true (siglab, input4). This will change the available range of input parameters.
 
+        Parameters that did not change since they were last set by this object are not sent
+        again (call invalidate() after the board was changed by another client).
+
         Raises
         ------
 
@@ -412,117 +1080,21 @@ class scpi (object):
 
         """
 
-        ### Constants ###
-        #decimation_list = [1,2,4,8,16,32,64,128,256,512,1024,2048,4096,8192,16384,32768,65536]
-        gain_list = ["LV","HV"]
-        coupling_list = ["DC","AC"]
-        units_list = ["RAW","VOLTS"]
-        format_list = ["BIN", "ASCII"]
+        cmds = acq_commands(
+            dec, trig_lvl, trig_delay, trig_delay_ns, units, sample_format, averaging, gain, coupling,
+            ext_trig_lvl, siglab, input4)
 
-        ### Limits ###
-        if input4:   # Set number of channels
-            n = 4
-        else:
-            n = 2
-        trig_lvl_lim = 1.0
-        gain_lvl = "LV"
-
-        if gain is not None:
-            for i in gain:
-                if i.upper() == "HV":
-                    trig_lvl_lim = 20.0
-                    gain_lvl = "HV"
-
-        ### CHECK FOR ERRORS ###
-        #try:
-        #    assert dec in decimation_list
-        #except AssertionError as dec_err:
-        #        raise ValueError(f"Decimation needs to be a power of 2 {1, 65536}")
-
-        try:
-            assert abs(trig_lvl) <= trig_lvl_lim
-        except AssertionError as trig_err:
-            raise ValueError(f"Trigger level out of range {-trig_lvl_lim, trig_lvl_lim} V",
-                             f"for gain {gain_lvl}") from trig_err
-
-        try:
-            assert trig_delay >= 0
-        except AssertionError as trig_dly_err:
-            raise ValueError("Trigger delay cannot be less that 0") from trig_dly_err
-
-        if units is not None:
-            try:
-                assert units.upper() in units_list
-            except AssertionError as unit_err:
-                raise ValueError(f"{units.upper()} is not a defined unit") from unit_err
-
-        if sample_format is not None:
-            try:
-                assert sample_format.upper() in format_list
-            except AssertionError as format_err:
-                raise ValueError(f"{sample_format.upper()} is not a defined format") from format_err
-
-        if gain is not None:
-            try:
-                assert (gain[0].upper() in gain_list) and (gain[1].upper() in gain_list)
-            except AssertionError as gain_err:
-                raise ValueError(f"{gain[0].upper()} or {gain[1].upper()} is not a defined gain") from gain_err
-
-        if siglab and coupling is not None:
-            try:
-                assert (coupling[0].upper() in coupling_list) and (coupling[1].upper() in coupling_list)
-            except AssertionError as coupling_err:
-                raise ValueError(f"{coupling[0].upper()} or {coupling[1].upper()}",
-                                 "is not a defined coupling") from coupling_err
-            try:
-                assert abs(ext_trig_lvl) <= trig_lvl_lim
-            except AssertionError as ext_trig_err:
-                raise ValueError("External trigger level out of range",
-                                 f"{-trig_lvl_lim, trig_lvl_lim} V") from ext_trig_err
-
-        try:
-            assert not((siglab is True) and (input4 is True))
-        except AssertionError as board_err:
-            raise ValueError("Please select only one board option.",
-                             "'siglab' and 'input4' cannot be true at the same time.") from board_err
-
-
-        ### SEND COMMANDS TO RP ###
-        self.tx_txt(f"ACQ:DEC {dec}")
-
-        if averaging:
-            self.tx_txt("ACQ:AVG ON")
-        else:
-            self.tx_txt("ACQ:AVG OFF")
-
-        if trig_delay_ns:
-            self.tx_txt(f"ACQ:TRIG:DLY:NS {trig_delay}")
-        else:
-            self.tx_txt(f"ACQ:TRIG:DLY {trig_delay}")
-
-        if units is not None:
-            self.tx_txt(f"ACQ:DATA:UNITS {units.upper()}")
-        if sample_format is not None:
-            self.tx_txt(f"ACQ:DATA:FORMAT {sample_format.upper()}")
-
-        if gain is not None:
-            for i in range(n):
-                self.tx_txt(f"ACQ:SOUR{i+1}:GAIN {gain[i].upper()}")
-
-        self.tx_txt(f"ACQ:TRIG:LEV {trig_lvl}")
-
-        if siglab and coupling is not None:
-            for i in range(n):
-                self.tx_txt(f"ACQ:SOUR{i+1}:COUP {coupling[i].upper()}")
-
-            self.tx_txt(f"ACQ:TRIG:EXT:LEV {ext_trig_lvl}")
+        # Only the parameters that changed since the last call are sent
+        self._send_changed(cmds)
 
         #print("ACQ set successfully")
 
     def get_settings(
         self,
         siglab: bool = False,
-        input4: bool = False
+        input4: bool = False,
+        verbose: bool = True,
+        refresh: bool = False
     ) -> str:
         """
 
@@ -551,6 +1123,14 @@ class scpi (object):
             input4 (bool, optional):
                 Set to True if operating with STEMlab 125-14 4-Input.
                 Defaults to False.
+            verbose (bool, optional):
+                Set to False to only return the settings without printing them.
+                Defaults to True.
+            refresh (bool, optional):
+                Set to True to read all settings from Red Pitaya. Otherwise settings read back
+                before by this object (and not set since) are taken from the settings cache,
+                so the result is the same as with refresh.
+                Defaults to False.
 
         """
 
@@ -567,38 +1147,43 @@ class scpi (object):
         else:
             n = 2
 
-        settings.append(self.txrx_txt("ACQ:DEC?"))
-        settings.append(self.txrx_txt("ACQ:AVG?"))
-        settings.append(self.txrx_txt("ACQ:TRIG:DLY?"))
-        settings.append(self.txrx_txt("ACQ:TRIG:DLY:NS?"))
-        settings.append(self.txrx_txt("ACQ:TRIG:LEV?"))
-        settings.append(self.txrx_txt("ACQ:BUF:SIZE?"))
+        # Settings not in the cache are queried at once and the replies read in order (one round trip)
+        with self.batch():
+            settings.append(self.query_cached("ACQ:DEC?", refresh))
+            settings.append(self.query_cached("ACQ:AVG?", refresh))
+            settings.append(self.query_cached("ACQ:TRIG:DLY?", refresh))
+            settings.append(self.query_cached("ACQ:TRIG:DLY:NS?", refresh))
+            settings.append(self.query_cached("ACQ:TRIG:LEV?", refresh))
+            settings.append(self.query_cached("ACQ:BUF:SIZE?", refresh))
 
-        for i in range(n):
-            settings.append(self.txrx_txt(f"ACQ:SOUR{i+1}:GAIN?"))
+            for i in range(n):
+                settings.append(self.query_cached(f"ACQ:SOUR{i+1}:GAIN?", refresh))
 
-        if siglab:
-            for i in range(2):
-                settings.append(self.txrx_txt(f"ACQ:SOUR{i+1}:COUP?"))
+            if siglab:
+                for i in range(2):
+                    settings.append(self.query_cached(f"ACQ:SOUR{i+1}:COUP?", refresh))
 
-            settings.append(self.txrx_txt("ACQ:TRIG:EXT:LEV?"))
+                settings.append(self.query_cached("ACQ:TRIG:EXT:LEV?", refresh))
 
+        settings = [reply.value for reply in settings]
 
-        print(f"Decimation: {settings[0]}")
-        print(f"Averaging: {settings[1]}")
-        print(f"Trigger delay (samples): {settings[2]}")
-        print(f"Trigger delay (ns): {settings[3]}")
-        print(f"Trigger level (V): {settings[4]}")
-        print(f"Buffer size: {settings[5]}")
 
-        if input4:
-            print(f"Gain CH1/CH2/CH3/CH4: {settings[6]}, {settings[7]}, {settings[8]}, {settings[9]}")
-        else:
-            print(f"Gain CH1/CH2: {settings[6]}, {settings[7]}")
+        if verbose:
+            print(f"Decimation: {settings[0]}")
+            print(f"Averaging: {settings[1]}")
+            print(f"Trigger delay (samples): {settings[2]}")
+            print(f"Trigger delay (ns): {settings[3]}")
+            print(f"Trigger level (V): {settings[4]}")
+            print(f"Buffer size: {settings[5]}")
 
-        if siglab:
-            print(f"Coupling CH1/CH2: {settings[8]}, {settings[9]}")
-            print(f"External trigger level (V): {settings[10]}")
+            if input4:
+                print(f"Gain CH1/CH2/CH3/CH4: {settings[6]}, {settings[7]}, {settings[8]}, {settings[9]}")
+            else:
+                print(f"Gain CH1/CH2: {settings[6]}, {settings[7]}")
+
+            if siglab:
+                print(f"Coupling CH1/CH2: {settings[8]}, {settings[9]}")
+                print(f"External trigger level (V): {settings[10]}")
 
         return settings
 
@@ -613,7 +1198,7 @@ class scpi (object):
         binary: bool = False,
         convert: bool = False,
         input4: bool = False
-    ) -> list:
+    ) -> Union[np.ndarray, str, bytearray]:
         """
         Returns the acquired data on a channel from the Red Pitaya, with the following options (for a specific channel):
             - only channel       => returns the whole buffer
@@ -643,13 +1228,19 @@ class scpi (object):
                 Set to True if working with Binary data.
                 Defaults to False.
             convert (bool, optional):
-                Set to True to convert data to a list of floats (VOLTS) or integers (RAW).
-                Otherwise returns a list of str (VOLTS) or int (RAW).
+                Set to True to convert data to a NumPy array of samples.
                 Defaults to False.
             input4 (bool, optional) :
                 Set to True if operating with STEMlab 125-14 4-Input.
                 Defaults to False.
 
+        Returns
+        -------
+
+            With convert=True a NumPy array: with binary=True a big-endian array ('>f4' for VOLTS,
+            '>i2' for RAW) sharing memory with the received buffer, with ASCII data a float64 (VOLTS)
+            or int16 (RAW) array. Otherwise the reply as received: the bytearray of the binary
+            block, or the ASCII text '{v1,v2,...}' as str.
 
         Raises
         ------
@@ -658,86 +1249,68 @@ class scpi (object):
         
         """
 
-        low_lim = 0
-        up_lim = 16384
-
-        # Check input data for errors
-        if input4:
-            try:
-                assert chan in (1,2,3,4)
-            except AssertionError as chanel_err:
-                raise ValueError("Channel needs to be either 1, 2, 3 or 4") from chanel_err
-        else:
-            try:
-                assert chan in (1,2)
-            except AssertionError as chanel_err:
-                raise ValueError("Channel needs to be either 1 or 2") from chanel_err
-
-        try:
-            assert not((old is True) and (lat is True))
-        except AssertionError as arg_err:
-            raise ValueError("Please select only one. 'old' and 'lat' cannot be True at the same time.") from arg_err
-
-        if start is not None:
-            try:
-                assert 16384 >= start >= 0
-            except AssertionError as start_err:
-                raise ValueError(f"Start position out of range {low_lim, up_lim}") from start_err
-
-        if end is not None:
-            try:
-                assert 16384 >= end >= 0
-            except AssertionError as end_err:
-                raise ValueError(f"End position out of range {low_lim, up_lim}") from end_err
-
-        if num_samples is not None:
-            try:
-                assert 16384 >= num_samples >= 0
-            except AssertionError as sample_err:
-                raise ValueError(f"Sample number out of range {low_lim, up_lim}") from sample_err
+        cmd = acq_data_command(chan, start, end, num_samples, old, lat, input4)
 
-        # Get data type from Red Pitaya
-        units = self.txrx_txt('ACQ:DATA:UNITS?')
-        # format = self.txrx_txt("ACQ:DATA:FORMAT?")
+        # Units query (only if not cached) and data request go out together; the data reply stays in the socket
+        with self.batch():
+            units = self.query_cached('ACQ:DATA:UNITS?')
+            self.tx_txt(cmd)
 
+        # Convert data
+        data = self.rx_arb() if binary else self.rx_bytes()
+        buff = decode_acq_data(data, units.value, binary, convert)
 
-        # Determine the output data
-        if(start is not None) and (end is not None):
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:STA:END? {start},{end}")
+        return buff
 
-        elif(start is not None) and (num_samples is not None):
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:STA:N? {start},{num_samples}")
+    def acq_data_multi(
+        self,
+        chans: list = (1, 2),
+        start: int = None,
+        end: int = None,
+        num_samples: int = None,
+        old: bool = False,
+        lat: bool = False,
+        binary: bool = None,
+        input4: bool = False
+    ) -> np.ndarray:
+        """
+        Returns the acquired data of several channels as one (channels x samples) NumPy array.
 
-        elif old and (num_samples is not None):
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:OLD:N? {num_samples}")
+        All channel reads (and the units query, if the units are not known yet) are sent in one
+        batch, so the whole capture takes one round trip instead of one per channel.
 
-        elif lat and (num_samples is not None):
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:LAT:N? {num_samples}")
+        Parameters
+        ----------
+            chans (list, optional) :
+                Input channels, in the order of the rows.
+                Defaults to (1, 2).
+            start, end, num_samples, old, lat, input4 :
+                Buffer selection as in acq_data (the same for all channels).
+            binary (bool, optional) :
+                Set to True if working with Binary data.
+                Defaults to the format last set with ACQ:DATA:FORMAT (ASCII if not known).
 
-        else:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA?")
+        Returns a C-contiguous array with native byte order: float32 (binary VOLTS),
+        float64 (ASCII VOLTS) or int16 (RAW).
+        """
 
-        # Convert data
-        if binary:
-            buff_byte = self.rx_arb()
-
-            if convert:
-                if units == "VOLTS":
-                    buff = [struct.unpack('!f',bytearray(buff_byte[i:i+4]))[0] for i in range(0, len(buff_byte), 4)]
-                elif units == "RAW":
-                    buff = [struct.unpack('!h',bytearray(buff_byte[i:i+2]))[0] for i in range(0, len(buff_byte), 2)]
-            else:
-                buff = buff_byte
-        else:
-            buff_string = self.rx_txt()
+        cmds = [acq_data_command(chan, start, end, num_samples, old, lat, input4) for chan in chans]
+        if binary is None:
+            binary = self._sent.get('ACQ:DATA:FORMAT', self._state.get('ACQ:DATA:FORMAT')) == 'BIN'
 
-            if convert:
-                buff_string = buff_string.strip('{}\n\r').replace("  ", "").split(',')
-                buff = list(map(float, buff_string))
-            else:
-                buff = buff_string
+        with self.batch():
+            units = self.query_cached('ACQ:DATA:UNITS?')
+            replies = [self.query(cmd, arb=binary) for cmd in cmds]
 
-        return buff
+        # Rows are decoded into one array (big-endian binary samples are swapped on the copy)
+        rows = [decode_acq_data(reply.value, units.value, binary, True) for reply in replies]
+        out = np.empty((len(rows), len(rows[0])), dtype=rows[0].dtype.newbyteorder('='))
+        for i, row in enumerate(rows):
+            try:
+                out[i] = row
+            except ValueError as len_err:
+                raise ValueError(f"Channel {chans[i]} returned {len(row)} samples, expected {out.shape[1]}") from len_err
+        return out
 
 
     def uart_set(
@@ -1043,3 +1616,103 @@ class scpi (object):
     def err_n(self):
         """Error next."""
         return self.txrx_txt('SYST:ERR:NEXT?')
+
+
+class test_scpi (unittest.TestCase):
+    """Round trips against redpitaya_sim (noise-free board, so repeated reads are identical)."""
+
+    def setUp(self):
+        from redpitaya_sim import simulator, board_state
+        self.sim = simulator(board=board_state(noise=0.0)).start_in_thread()
+        self.rp = scpi('127.0.0.1', timeout=5, port=self.sim.port)
+        self.syncs = 0
+
+    def tearDown(self):
+        self.rp.close()
+        self.sim.stop_in_thread()
+
+    def sent(self):
+        """Commands received by the simulator so far (synced with a query, the queries not counted)."""
+        self.rp.txrx_txt('*IDN?')
+        self.syncs += 1
+        return self.sim.commands - self.syncs
+
+    def test_batch_and_cache(self):
+        rp = self.rp
+        with rp.batch():
+            rp.tx_txt('ACQ:DEC 64')
+            dec = rp.query('ACQ:DEC?')
+            lev = rp.query('ACQ:TRIG:LEV?')
+            self.assertFalse(dec.done)
+        self.assertEqual((dec.value, lev.value), ('64', '0'))
+
+        # Known settings are answered from the cache, unchanged setters are not sent
+        before = self.sent()
+        self.assertEqual(rp.query_cached('ACQ:DEC?').value, '64')
+        rp.acq_set(dec=64, units='volts')
+        after = self.sent()
+        self.assertGreater(after, before)
+        rp.acq_set(dec=64, units='volts')
+        self.assertEqual(self.sent(), after)
+        self.assertEqual(rp.txrx_txt('ACQ:DATA:UNITS?'), 'VOLTS')
+
+    def test_batch_discarded_on_error(self):
+        rp = self.rp
+        with self.assertRaises(KeyError):
+            with rp.batch():
+                rp.tx_txt('ACQ:DEC 64')
+                rp.query('ACQ:DEC?')
+                raise KeyError
+        self.assertEqual(rp.txrx_txt('ACQ:DEC?'), '1')
+        self.assertEqual((rp._sent, rp._state), ({}, {}))
+
+    def test_settings_cache_in_reply_format(self):
+        rp = self.rp
+        rp.acq_set(dec=8, trig_lvl=0, units='volts')
+        self.sent()
+        # The board formats its replies by itself (here: the trigger level with decimals)
+        self.sim.board.settings['ACQ:TRIG:LEV'] = '0.000000'
+        cached = rp.get_settings(verbose=False)
+        self.assertEqual(cached, rp.get_settings(verbose=False, refresh=True))
+        self.assertEqual(cached[4], '0.000000')
+        # Read back once, then answered from the cache until the next setter
+        before = self.sent()
+        self.assertEqual(rp.get_settings(verbose=False), cached)
+        self.assertEqual(self.sent(), before)
+        rp.acq_set(dec=16, trig_lvl=0, units='volts')
+        self.assertEqual(rp.get_settings(verbose=False)[0], '16')
+        self.assertGreater(self.sent(), before + 1)
+
+    def test_arb_upload_once(self):
+        rp = self.rp
+        wave = np.sin(np.linspace(0, 2 * np.pi, 1000, endpoint=False))
+        rp.sour_set(1, func='arbitrary', data=wave)
+        before = self.sent()
+        rp.sour_set(1, func='arbitrary', data=wave)
+        self.assertEqual(self.sent(), before)
+        rp.sour_set(1, func='arbitrary', data=-wave)
+        self.assertGreater(self.sent(), before)
+
+    def test_binary_data(self):
+        rp = self.rp
+        rp.sour_set(1, volt=0.5, freq=10e3)
+        rp.sour_set(2, volt=0.2, freq=20e3)
+        rp.tx_txt('OUTPUT1:STATE ON')
+        rp.tx_txt('OUTPUT2:STATE ON')
+        rp.acq_set(dec=8, units='volts', sample_format='ascii')
+        rp.tx_txt('ACQ:START')
+        rp.tx_txt('ACQ:TRIG NOW')
+        rp.wait_for_fill(timeout=5)
+
+        ascii = rp.acq_data_multi(chans=(1, 2))
+        rp.acq_set(dec=8, units='volts', sample_format='bin')
+        binary = rp.acq_data_multi(chans=(1, 2))
+        self.assertEqual(binary.dtype, np.float32)
+        self.assertEqual(binary.shape, (2, 16384))
+        np.testing.assert_allclose(binary, ascii, atol=1e-4)
+        self.assertAlmostEqual(float(np.abs(binary[0]).max()), 0.5, places=2)
+        np.testing.assert_array_equal(rp.acq_data(2, binary=True, convert=True), binary[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,396 @@
+"""Asyncio SCPI access to Red Pitaya boards.
+
+Commands are built and validated by the same functions as in redpitaya_scpi (sour_commands,
+acq_commands, acq_data_command), so both clients send identical SCPI sequences.
+"""
+
+import time
+import asyncio
+import unittest
+import weakref
+import numpy as np
+
+from redpitaya_scpi import sour_commands, acq_commands, acq_data_command, decode_acq_data, arb_digest
+
+
+class _connection (object):
+    """One TCP connection to the SCPI server."""
+
+    def __init__(self, reader, writer, delimiter):
+        self.reader    = reader
+        self.writer    = writer
+        self.delimiter = delimiter
+
+    async def rx_bytes(self):
+        return await self.reader.readuntil(self.delimiter)
+
+    async def rx_arb(self):
+        head = await self.reader.readexactly(2)
+        if head[0:1] != b'#':
+            return False
+        numOfNumBytes = int(head[1:2])
+        if numOfNumBytes <= 0:
+            return False
+        numOfBytes = int(await self.reader.readexactly(numOfNumBytes))
+        return bytearray(await self.reader.readexactly(numOfBytes))
+
+    async def exchange(self, commands, replies):
+        """Send all commands in one write and read the replies ('txt', 'bytes' or 'arb') in order."""
+        self.writer.write(b''.join((cmd + '\r\n').encode('utf-8') for cmd in commands))
+        await self.writer.drain()
+        out = []
+        for kind in replies:
+            if kind == 'arb':
+                out.append(await self.rx_arb())
+            else:
+                data = (await self.rx_bytes())[:-len(self.delimiter)]
+                out.append(data.decode('utf-8') if kind == 'txt' else data)
+        return out
+
+    def close(self):
+        self.writer.close()
+
+
+class _host_pool (object):
+    """Connections to one host, shared by all async_scpi objects in one event loop."""
+
+    def __init__(self, host, port, size, limit):
+        self.host  = host
+        self.port  = port
+        self.limit = limit
+        self.idle  = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def acquire(self, timeout):
+        await self.slots.acquire()
+        try:
+            if self.idle:
+                return self.idle.pop()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, limit=self.limit), timeout)
+            return _connection(reader, writer, b'\r\n')
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if broken:
+            conn.close()
+        else:
+            self.idle.append(conn)
+        self.slots.release()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+# event loop -> {(host, port): _host_pool}
+_pools = weakref.WeakKeyDictionary()
+
+# Queries that change the state of the board (they pop a queue)
+_CONSUMING_QUERIES = ('SYST:ERR:NEXT?',)
+
+
+def _idempotent(commands):
+    """True if sending the commands twice has the same effect as sending them once."""
+    for cmd in commands:
+        cmd = cmd.strip().upper()
+        if not cmd.endswith('?') or cmd in _CONSUMING_QUERIES:
+            return False
+    return True
+
+
+class async_scpi (object):
+    """Asyncio SCPI client with the command surface of redpitaya_scpi.scpi.
+
+    The connection is opened on the first request and reopened after a network error or a
+    timeout. Every request (a group of commands and their replies) has its own timeout.
+    """
+
+    def __init__(self, host, timeout=10.0, port=5000, pool_size=1, retries=1, limit=2**22):
+        """
+        Parameters
+        ----------
+            host (str) :
+                Board address, like '192.168.1.100'.
+            timeout (float, optional) :
+                Timeout of one request (and of connecting) in seconds.
+                Defaults to 10.
+            port (int, optional) :
+                SCPI server port.
+                Defaults to 5000.
+            pool_size (int, optional) :
+                Number of connections to this host shared by all clients in the event loop.
+                Defaults to 1 (requests to one board are serialized).
+            retries (int, optional) :
+                Number of repetitions of a request after a connection error or timeout.
+                Only requests made of side-effect free queries are repeated unless the
+                call asks for it (see request).
+                Defaults to 1.
+            limit (int, optional) :
+                Longest text reply in bytes (ASCII buffers are long).
+                Defaults to 4 MiB.
+        """
+        self.host      = host
+        self.port      = port
+        self.timeout   = timeout
+        self.pool_size = pool_size
+        self.retries   = retries
+        self.limit     = limit
+
+        # Digest of the arbitrary waveform last uploaded to each channel by this client
+        self._arb_cache = {}
+
+    def _pool(self):
+        pools = _pools.setdefault(asyncio.get_running_loop(), {})
+        key = (self.host, self.port)
+        if key not in pools:
+            pools[key] = _host_pool(self.host, self.port, self.pool_size, self.limit)
+        return pools[key]
+
+    async def request(self, commands, replies=(), retry=None):
+        """Send commands (one write) and return the list of replies ('txt', 'bytes' or 'arb').
+
+        Parameters
+        ----------
+            retry (bool, optional) :
+                Repeat the request after a connection error or timeout. The board may already
+                have executed a request that timed out, so by default only requests made of
+                queries without side effects are repeated; setters, arbitrary waveform uploads
+                and SYST:ERR:NEXT? are sent once. True or False overrides this.
+                Defaults to None.
+        """
+        for cmd in commands:
+            cmd = cmd.strip().upper()
+            if cmd in ('GEN:RST', '*RST') or 'TRAC:DATA:DATA' in cmd:
+                self._arb_cache.clear()
+
+        if retry is None:
+            retry = _idempotent(commands)
+        retries = self.retries if retry else 0
+
+        pool = self._pool()
+        for attempt in range(retries + 1):
+            deadline = time.monotonic() + self.timeout
+            conn = await pool.acquire(self.timeout)
+            try:
+                out = await asyncio.wait_for(conn.exchange(commands, replies),
+                                             max(deadline - time.monotonic(), 0))
+            except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError):
+                # Unknown state of the stream - the connection is dropped and opened again
+                pool.release(conn, broken=True)
+                if attempt == retries:
+                    raise
+            except BaseException:
+                pool.release(conn, broken=True)
+                raise
+            else:
+                pool.release(conn)
+                return out
+
+    async def close(self):
+        """Close idle connections to this host."""
+        self._pool().close()
+
+    async def tx_txt(self, msg):
+        """Send text string."""
+        await self.request([msg])
+
+    async def txrx_txt(self, msg):
+        """Send/receive text string."""
+        return (await self.request([msg], ['txt']))[0]
+
+    async def check_error(self, stop = True):
+        """Print the error queue; an error code above 9500 raises RuntimeError if stop is True."""
+        stb, count = await self.request(['*STB?', 'SYST:ERR:COUN?'], ['txt', 'txt'])
+        if (int(stb) & 0x4):
+            n = max(int(count), 1)
+            for err in await self.request(['SYST:ERR:NEXT?'] * n, ['txt'] * n):
+                if (err.startswith('0,')):
+                    break
+                print(err)
+                if stop and int(err.split(",")[0]) > 9500:
+                    raise RuntimeError(f"SCPI >> {self.host}: {err}")
+
+    async def wait_for(self, query, expected, timeout=None, interval=0.001, max_interval=0.05, backoff=1.5):
+        """Poll a status query until it returns the expected reply. See redpitaya_scpi.scpi.wait_for."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = interval
+        while 1:
+            if await self.txrx_txt(query) == expected:
+                return True
+            sleep = delay
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"SCPI >> '{query}' did not return '{expected}' within {timeout} s")
+                sleep = min(sleep, left)
+            await asyncio.sleep(sleep)
+            delay = min(delay * backoff, max_interval)
+
+    async def wait_for_trigger(self, timeout=None, **kwargs):
+        """Wait until the acquisition is triggered (ACQ:TRIG:STAT? returns TD)."""
+        return await self.wait_for('ACQ:TRIG:STAT?', 'TD', timeout, **kwargs)
+
+    async def wait_for_fill(self, timeout=None, **kwargs):
+        """Wait until the buffer is filled after the trigger (ACQ:TRIG:FILL? returns 1)."""
+        return await self.wait_for('ACQ:TRIG:FILL?', '1', timeout, **kwargs)
+
+# SCPI command functions
+
+    async def sour_set(self, chan, **kwargs):
+        """Set the signal generator on one channel. Parameters as in redpitaya_scpi.scpi.sour_set."""
+        digest = None
+        if (kwargs.get('data') is not None) and (kwargs.get('func', 'sine').upper() == "ARBITRARY"):
+            digest = arb_digest(kwargs['data'])
+            if self._arb_cache.get(chan) == digest:
+                kwargs['data'] = None
+        await self.request(sour_commands(chan, **kwargs))
+        if digest is not None:
+            self._arb_cache[chan] = digest
+
+    async def acq_set(self, **kwargs):
+        """Set the acquisition. Parameters as in redpitaya_scpi.scpi.acq_set."""
+        await self.request(acq_commands(**kwargs))
+
+    async def acq_data(self, chan, start=None, end=None, num_samples=None, old=False, lat=False,
+                       binary=False, convert=False, input4=False):
+        """Read acquired data from one channel. Parameters and result as in redpitaya_scpi.scpi.acq_data."""
+        cmd = acq_data_command(chan, start, end, num_samples, old, lat, input4)
+        units, data = await self.request(['ACQ:DATA:UNITS?', cmd], ['txt', 'arb' if binary else 'bytes'])
+        return decode_acq_data(data, units, binary, convert)
+
+    async def acq_data_multi(self, chans=(1, 2), start=None, end=None, num_samples=None, old=False, lat=False,
+                             binary=False, input4=False):
+        """Read several channels in one request. Result as in redpitaya_scpi.scpi.acq_data_multi."""
+        cmds = [acq_data_command(chan, start, end, num_samples, old, lat, input4) for chan in chans]
+        units, *data = await self.request(['ACQ:DATA:UNITS?'] + cmds,
+                                          ['txt'] + ['arb' if binary else 'bytes'] * len(cmds))
+        rows = [decode_acq_data(reply, units, binary, True) for reply in data]
+        return np.stack(rows).astype(rows[0].dtype.newbyteorder('='), copy=False)
+
+# IEEE Mandated Commands
+
+    async def cls(self):
+        """Clear Status Command"""
+        return await self.tx_txt('*CLS')
+
+    async def ese(self, value: int):
+        """Standard Event Status Enable Command"""
+        return await self.tx_txt(f'*ESE {value}')
+
+    async def ese_q(self):
+        """Standard Event Status Enable Query"""
+        return await self.txrx_txt('*ESE?')
+
+    async def esr_q(self):
+        """Standard Event Status Register Query"""
+        return await self.txrx_txt('*ESR?')
+
+    async def idn_q(self):
+        """Identification Query"""
+        return await self.txrx_txt('*IDN?')
+
+    async def opc(self):
+        """Operation Complete Command"""
+        return await self.tx_txt('*OPC')
+
+    async def opc_q(self):
+        """Operation Complete Query"""
+        return await self.txrx_txt('*OPC?')
+
+    async def rst(self):
+        """Reset Command"""
+        return await self.tx_txt('*RST')
+
+    async def sre(self):
+        """Service Request Enable Command"""
+        return await self.tx_txt('*SRE')
+
+    async def sre_q(self):
+        """Service Request Enable Query"""
+        return await self.txrx_txt('*SRE?')
+
+    async def stb_q(self):
+        """Read Status Byte Query"""
+        return await self.txrx_txt('*STB?')
+
+# :SYSTem
+
+    async def err_c(self):
+        """Error count."""
+        return await self.txrx_txt('SYST:ERR:COUN?')
+
+    async def err_n(self):
+        """Error next."""
+        return await self.txrx_txt('SYST:ERR:NEXT?')
+
+
+async def gather_acq_data(boards, chan, **kwargs):
+    """Read the same channel from all boards concurrently. Returns the list of acq_data results."""
+    return await asyncio.gather(*(board.acq_data(chan, **kwargs) for board in boards))
+
+
+class test_async_scpi (unittest.TestCase):
+
+    def setUp(self):
+        from redpitaya_sim import simulator, board_state
+        self.sims = [simulator(board=board_state(noise=0.0)).start_in_thread() for _ in range(2)]
+
+    def tearDown(self):
+        for sim in self.sims:
+            sim.stop_in_thread()
+
+    def test_pool_and_gather(self):
+        port = self.sims[0].port
+
+        async def run():
+            # Two clients of one board share its pool of two connections
+            a = async_scpi('127.0.0.1', timeout=5, port=port, pool_size=2)
+            b = async_scpi('127.0.0.1', timeout=5, port=port, pool_size=2)
+            await a.acq_set(dec=16)
+            replies = await asyncio.gather(*(client.txrx_txt('ACQ:DEC?') for client in (a, b) * 4))
+            self.assertEqual(replies, ['16'] * 8)
+            self.assertIs(a._pool(), b._pool())
+            self.assertLessEqual(len(a._pool().idle), 2)
+
+            boards = [async_scpi('127.0.0.1', timeout=5, port=sim.port) for sim in self.sims]
+            for volt, board in zip((0.25, 0.5), boards):
+                await board.sour_set(1, volt=volt, freq=10e3)
+                await board.request(['OUTPUT1:STATE ON', 'ACQ:DATA:FORMAT BIN', 'ACQ:START', 'ACQ:TRIG NOW'])
+                await board.wait_for_fill(timeout=5)
+            data = await gather_acq_data(boards, 1, binary=True, convert=True)
+            for volt, row in zip((0.25, 0.5), data):
+                self.assertEqual(len(row), 16384)
+                self.assertAlmostEqual(float(np.abs(row).max()), volt, places=2)
+            for client in [a] + boards:
+                await client.close()
+
+        asyncio.run(run())
+
+    def test_retry_only_queries(self):
+        sim = self.sims[0]
+        sim.latency = 0.3
+
+        async def run():
+            rp = async_scpi('127.0.0.1', timeout=0.1, port=sim.port, retries=1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await rp.txrx_txt('ACQ:DEC?')
+            self.assertEqual(sim.commands, 2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await rp.request(['ACQ:DEC 4', 'ACQ:DEC?'], ['txt'])
+            self.assertEqual(sim.commands, 4)
+            with self.assertRaises(asyncio.TimeoutError):
+                await rp.request(['ACQ:DEC 4', 'ACQ:DEC?'], ['txt'], retry=True)
+            self.assertEqual(sim.commands, 8)
+            await rp.close()
+            # The late replies leave the simulator before it is stopped
+            await asyncio.sleep(sim.latency)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""Red Pitaya SCPI server simulator.
+
+Emulates the SCPI subset used by redpitaya_scpi.scpi and redpitaya_scpi_async.async_scpi, so the
+clients can be benchmarked and tested without a board:
+    - generator and acquisition settings (any SOUR/OUTPUT/GEN/ACQ/DIG/ANALOG setter, read back
+      with the same header and '?'),
+    - ACQ:START/STOP/RST, trigger sources, ACQ:TRIG:STAT? (WAIT -> TD), ACQ:TRIG:FILL?,
+      ACQ:WPOS?, ACQ:TPOS?,
+    - data queries (DATA?, STA:END?, STA:N?, OLD:N?, LAT:N?) in ASCII '{...}' or binary '#NNNN'
+      blocks, VOLTS or RAW; input n sees the signal of output n (loopback cables), or input 2
+      sees output 1 through a simulated device under test ('dut'),
+    - *IDN?, *RST, *CLS, *OPC?, *STB?, SYST:ERR:COUN?, SYST:ERR:NEXT? (unknown headers are queued as
+      errors and get no reply, like on the board).
+
+The network is modelled per connection: every reply is delayed by 'latency' plus a uniform
+random 'jitter' (commands are still processed in order, so pipelined requests overlap their
+round trips) and replies are sent at most at 'bandwidth' bytes/s.
+
+Example
+-------
+    sim = simulator(latency=0.0005).start_in_thread()
+    rp = scpi.scpi('127.0.0.1', port=sim.port)
+    ...
+    sim.stop_in_thread()
+
+or from the command line:  python redpitaya_sim.py --port 5000 --latency 0.0005
+"""
+
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import numpy as np
+
+# Size of the acquisition buffer in samples and the ADC sample rate without decimation
+BUFFER_SIZE = 16384
+BASE_RATE   = 125e6
+
+# Headers of setters stored in the state (their values are read back with '<header>?')
+SETTER_ROOTS = ('SOUR', 'OUTPUT', 'GEN', 'ACQ', 'DIG', 'ANALOG', 'UART', 'SPI', 'I2C', 'DAISY')
+
+# Replies to queries of settings that were not set yet
+DEFAULTS = {
+    'ACQ:DEC': '1',
+    'ACQ:AVG': 'ON',
+    'ACQ:TRIG:DLY': '0',
+    'ACQ:TRIG:DLY:NS': '0',
+    'ACQ:TRIG:LEV': '0',
+    'ACQ:TRIG:EXT:LEV': '0',
+    'ACQ:BUF:SIZE': str(BUFFER_SIZE),
+    'ACQ:DATA:UNITS': 'VOLTS',
+    'ACQ:DATA:FORMAT': 'ASCII',
+    'ACQ:SOUR1:GAIN': 'LV',
+    'ACQ:SOUR2:GAIN': 'LV',
+    'ACQ:SOUR1:COUP': 'DC',
+    'ACQ:SOUR2:COUP': 'DC',
+}
+
+_ERR_HEADER = '-113,"Undefined header"'
+_ERR_DATA   = '-222,"Data out of range"'
+
+
+class board_state (object):
+    """Generator, acquisition and error queue of one simulated board (shared by its connections)."""
+
+    def __init__(self, trigger_after: float = 0.001, noise: float = 1e-3, dut = None, seed: int = None):
+        """
+        Parameters
+        ----------
+            trigger_after (float, optional) :
+                Time in seconds after which an armed acquisition with an external or channel
+                trigger source is triggered.
+                Defaults to 0.001.
+            noise (float, optional) :
+                RMS noise added to the inputs in Volts.
+                Defaults to 1e-3.
+            dut (callable, optional) :
+                Device under test, dut(freq) -> complex gain. Input 2 then sees output 1 with
+                this gain and phase at the generator frequency instead of output 2.
+                Defaults to None.
+            seed (int, optional) :
+                Seed of the noise generator.
+                Defaults to None.
+        """
+        self.trigger_after = trigger_after
+        self.noise         = noise
+        self.dut           = dut
+        self.rng           = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.settings = {}
+        self.errors   = []
+        self.acq_reset()
+
+    def acq_reset(self):
+        for key in [key for key in self.settings if key.startswith('ACQ:')]:
+            del self.settings[key]
+        self.t_start   = None       # ACQ:START time (None - stopped)
+        self.t_trigger = None       # trigger time (None - not triggered)
+        self.t_arm_src = None       # time the trigger source was set on an armed acquisition
+        self._cache    = None
+
+    def get(self, header):
+        return self.settings.get(header, DEFAULTS.get(header))
+
+    # Acquisition clock
+
+    @property
+    def rate(self):
+        return BASE_RATE / int(self.get('ACQ:DEC'))
+
+    def _update_trigger(self, now):
+        if self.t_start is None or self.t_trigger is not None:
+            return
+        source = self.settings.get('ACQ:TRIG', 'DISABLED')
+        if source not in ('DISABLED', 'NOW', 'AWG_PE', 'AWG_NE') and self.t_arm_src is not None \
+                and now - self.t_arm_src >= self.trigger_after:
+            self.t_trigger = self.t_arm_src + self.trigger_after
+
+    def _written(self, now):
+        """Samples written since ACQ:START; writing ends when the buffer is filled after the trigger."""
+        if self.t_start is None:
+            return 0
+        self._update_trigger(now)
+        total = int((now - self.t_start) * self.rate)
+        if self.t_trigger is not None:
+            total = min(total, self._trigger_sample() + BUFFER_SIZE // 2 + int(self.get('ACQ:TRIG:DLY')))
+        return total
+
+    def _trigger_sample(self):
+        return int((self.t_trigger - self.t_start) * self.rate)
+
+    def _filled(self, now):
+        self._update_trigger(now)
+        return self.t_trigger is not None and \
+            self._written(now) >= self._trigger_sample() + BUFFER_SIZE // 2 + int(self.get('ACQ:TRIG:DLY'))
+
+    # Signals
+
+    def _output(self, chan, t, gain=None):
+        """Generator output 'chan' at times 't', optionally through the complex gain(freq)."""
+        if self.settings.get(f'OUTPUT{chan}:STATE', 'OFF') != 'ON':
+            return 0.0
+        func = self.settings.get(f'SOUR{chan}:FUNC', 'SINE')
+        freq = float(self.settings.get(f'SOUR{chan}:FREQ:FIX', 1000))
+        ampl = float(self.settings.get(f'SOUR{chan}:VOLT', 1))
+        offs = float(self.settings.get(f'SOUR{chan}:VOLT:OFFS', 0))
+        phase = 2 * np.pi * freq * t + np.deg2rad(float(self.settings.get(f'SOUR{chan}:PHAS', 0)))
+        if gain is not None:
+            g = complex(gain(freq))
+            ampl, offs, phase = ampl * abs(g), offs * abs(g), phase + np.angle(g)
+        if func == 'SQUARE':
+            wave = np.sign(np.sin(phase))
+        elif func == 'TRIANGLE':
+            wave = 2 / np.pi * np.arcsin(np.sin(phase))
+        elif func == 'DC':
+            wave = np.ones(len(t))
+        else:
+            wave = np.sin(phase)
+        return ampl * wave + offs
+
+    def _signal(self, chan, index):
+        """Input 'chan' at absolute sample indices (output looped back or through the dut, plus noise)."""
+        t = index / self.rate
+        out = self.rng.normal(0.0, self.noise, len(index)) if self.noise else np.zeros(len(index))
+        if chan == 2 and self.dut is not None:
+            return out + self._output(1, t, self.dut)
+        return out + self._output(chan, t)
+
+    def _samples(self, chan, start, count, now):
+        """'count' samples from buffer position 'start' (the newest sample written at each position)."""
+        total = self._written(now)
+        pos = (start + np.arange(count)) % BUFFER_SIZE
+        index = pos + BUFFER_SIZE * ((total - 1 - pos) // BUFFER_SIZE)
+        return self._signal(chan, index.astype(np.float64))
+
+    def _data_reply(self, chan, start, count, now):
+        key = (chan, start, count, self.get('ACQ:DATA:UNITS'), self.get('ACQ:DATA:FORMAT'))
+        # A filled buffer does not change - its replies are encoded once
+        if self._cache is not None and self._cache[0] == key:
+            return self._cache[1]
+        volts = self._samples(chan, start, count, now).astype(np.float32)
+        if self.get('ACQ:DATA:UNITS') == 'RAW':
+            full_scale = 20.0 if self.get(f'ACQ:SOUR{chan}:GAIN') == 'HV' else 1.0
+            values = np.clip(np.round(volts / full_scale * 8192), -8192, 8191).astype('>i2')
+        else:
+            values = volts.astype('>f4')
+        if self.get('ACQ:DATA:FORMAT') == 'BIN':
+            payload = values.tobytes()
+            size = str(len(payload)).encode()
+            reply = b'#' + str(len(size)).encode() + size + payload
+        else:
+            fmt = '%d' if values.dtype.kind == 'i' else '%.6f'
+            reply = ('{' + ','.join(fmt % v for v in values.tolist()) + '}\r\n').encode()
+        if self._filled(now):
+            self._cache = (key, reply)
+        return reply
+
+    # Commands
+
+    def _text(self, value):
+        return f'{value}\r\n'.encode()
+
+    def _error(self, error):
+        self.errors.append(error)
+        return None
+
+    def _data_query(self, cmd, args, now):
+        # ACQ:SOUR<n>:DATA[:STA:END|:STA:N|:OLD:N|:LAT:N]?
+        chan = int(cmd[8])
+        kind = cmd[9:].rstrip('?')
+        written = self._written(now)
+        wpos = written % BUFFER_SIZE
+        try:
+            values = [int(v) for v in args.split(',')] if args else []
+            if kind == ':DATA':
+                start, count = wpos, BUFFER_SIZE
+            elif kind == ':DATA:STA:END':
+                start, count = values[0], (values[1] - values[0]) % BUFFER_SIZE
+            elif kind == ':DATA:STA:N':
+                start, count = values
+            elif kind == ':DATA:OLD:N':
+                start, count = wpos, values[0]
+            elif kind == ':DATA:LAT:N':
+                start, count = (wpos - values[0]) % BUFFER_SIZE, values[0]
+            else:
+                return self._error(_ERR_HEADER)
+        except (ValueError, IndexError):
+            return self._error(_ERR_DATA)
+        if not (0 <= start <= BUFFER_SIZE and 0 <= count <= BUFFER_SIZE):
+            return self._error(_ERR_DATA)
+        return self._data_reply(chan, start, count, now)
+
+    def execute(self, line: str, now: float = None):
+        """Execute one command line. Returns the reply (bytes) or None."""
+        now = time.monotonic() if now is None else now
+        cmd, _, args = line.strip().partition(' ')
+        cmd = cmd.upper()
+        args = args.strip()
+
+        # IEEE mandated commands and the error queue
+        if cmd == '*IDN?':
+            return self._text('REDPITAYA,INSTR2020,0,SIMULATOR')
+        if cmd == '*RST':
+            self.reset()
+            return None
+        if cmd == '*OPC?':
+            return self._text(1)
+        if cmd == '*CLS':
+            self.errors.clear()
+            return None
+        if cmd == '*STB?':
+            return self._text(0x4 if self.errors else 0)
+        if cmd == 'SYST:ERR:COUN?':
+            return self._text(len(self.errors))
+        if cmd == 'SYST:ERR:NEXT?':
+            return self._text(self.errors.pop(0) if self.errors else '0,"No error"')
+
+        # Acquisition control
+        if cmd == 'ACQ:RST':
+            self.acq_reset()
+            return None
+        if cmd == 'ACQ:START':
+            self.t_start, self.t_trigger, self.t_arm_src, self._cache = now, None, None, None
+            return None
+        if cmd == 'ACQ:STOP':
+            self.t_start = None
+            return None
+        if cmd == 'ACQ:TRIG' and args:
+            source = args.upper()
+            self.settings['ACQ:TRIG'] = source
+            if self.t_start is not None and self.t_trigger is None:
+                if source == 'NOW':
+                    self.t_trigger = now
+                elif source not in ('DISABLED', 'AWG_PE', 'AWG_NE'):
+                    self.t_arm_src = now
+            return None
+        if cmd in ('SOUR1:TRIG:INT', 'SOUR2:TRIG:INT', 'SOUR:TRIG:INT'):
+            # Generator trigger - triggers an acquisition waiting for the generator edge
+            if self.t_start is not None and self.t_trigger is None \
+                    and self.settings.get('ACQ:TRIG') in ('AWG_PE', 'AWG_NE'):
+                self.t_trigger = now
+            return None
+        if cmd == 'ACQ:TRIG:STAT?':
+            self._update_trigger(now)
+            return self._text('TD' if self.t_trigger is not None else 'WAIT')
+        if cmd == 'ACQ:TRIG:FILL?':
+            return self._text(1 if self._filled(now) else 0)
+        if cmd == 'ACQ:WPOS?':
+            return self._text(self._written(now) % BUFFER_SIZE)
+        if cmd == 'ACQ:TPOS?':
+            self._update_trigger(now)
+            return self._text(self._trigger_sample() % BUFFER_SIZE if self.t_trigger is not None else 0)
+        if cmd.startswith('ACQ:SOUR') and ':DATA' in cmd and cmd.endswith('?'):
+            return self._data_query(cmd, args, now)
+
+        if cmd == 'GEN:RST':
+            for key in [key for key in self.settings if key.startswith(('SOUR', 'OUTPUT'))]:
+                del self.settings[key]
+            return None
+
+        # Generic settings
+        header = cmd.rstrip('?')
+        if not header.startswith(SETTER_ROOTS):
+            return self._error(_ERR_HEADER)
+        if cmd.endswith('?'):
+            value = self.get(header)
+            return self._error(_ERR_HEADER) if value is None else self._text(value)
+        if header == 'ACQ:DEC':
+            try:
+                assert int(args) >= 1
+            except (AssertionError, ValueError):
+                return self._error(_ERR_DATA)
+            if self.t_start is not None:
+                # Keep the write position continuous when the sample rate changes
+                self.t_start = now - self._written(now) / (BASE_RATE / int(args))
+        self.settings[header] = args.upper() if len(args) < 64 else args
+        return None
+
+
+class simulator (object):
+    """Asyncio TCP server speaking SCPI for one simulated board."""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: float = None,
+        process_time: float = 0.0,
+        board: board_state = None,
+        seed: int = None
+    ):
+        """
+        Parameters
+        ----------
+            host (str, optional) :
+                Listening address.
+                Defaults to '127.0.0.1'.
+            port (int, optional) :
+                Listening port, 0 - any free port (read it from 'port' after start).
+                Defaults to 0.
+            latency (float, optional) :
+                Delay of every reply in seconds (round trip time of the network).
+                Defaults to 0.
+            jitter (float, optional) :
+                Largest random extra delay of a reply in seconds.
+                Defaults to 0.
+            bandwidth (float, optional) :
+                Reply bandwidth in bytes/s per connection. `None` - unlimited.
+                Defaults to None.
+            process_time (float, optional) :
+                Time the board spends on every command in seconds (blocks the connection).
+                Defaults to 0.
+            board (board_state, optional) :
+                Simulated board. Defaults to a new board_state.
+            seed (int, optional) :
+                Seed of the jitter generator.
+                Defaults to None.
+        """
+        self.host         = host
+        self.port         = port
+        self.latency      = latency
+        self.jitter       = jitter
+        self.bandwidth    = bandwidth
+        self.process_time = process_time
+        self.board        = board_state(seed=seed) if board is None else board
+        self.rng          = random.Random(seed)
+        self.commands     = 0
+        self.bytes_sent   = 0
+
+        self._server  = None
+        self._writers = set()
+        self._loop    = None
+        self._thread = None
+
+    async def start(self):
+        """Start listening (in the running event loop)."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=2**24)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """Stop listening and close the open connections."""
+        self._server.close()
+        for writer in self._writers:
+            writer.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    def start_in_thread(self):
+        """Run the server on its own event loop in a daemon thread (for synchronous clients)."""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='rp-simulator', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_in_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _handle(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self._send(writer, replies))
+        self._writers.add(writer)
+        last_due = 0.0
+        try:
+            while 1:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self.process_time:
+                    await asyncio.sleep(self.process_time)
+                self.commands += 1
+                reply = self.board.execute(line.decode('utf-8', 'replace'))
+                if reply is not None:
+                    # Replies leave in order, each not earlier than its own network delay
+                    delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+                    last_due = max(loop.time() + delay, last_due)
+                    replies.put_nowait((last_due, reply))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            replies.put_nowait(None)
+            await sender
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _send(self, writer, replies):
+        loop = asyncio.get_running_loop()
+        link_free = 0.0
+        while 1:
+            item = await replies.get()
+            if item is None:
+                return
+            due, reply = item
+            if self.bandwidth:
+                # The link sends one reply after another at 'bandwidth' bytes/s
+                link_free = max(link_free, due) + len(reply) / self.bandwidth
+                due = link_free
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                writer.write(reply)
+                await writer.drain()
+            except ConnectionError:
+                return
+            self.bytes_sent += len(reply)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Red Pitaya SCPI server simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help='reply delay [s]')
+    parser.add_argument('--jitter', type=float, default=0.0, help='largest random extra delay [s]')
+    parser.add_argument('--bandwidth', type=float, default=None, help='reply bandwidth [bytes/s]')
+    parser.add_argument('--process-time', type=float, default=0.0, help='time per command [s]')
+    args = parser.parse_args()
+
+    sim = simulator(args.host, args.port, args.latency, args.jitter, args.bandwidth, args.process_time)
+    print(f'Red Pitaya simulator on {args.host}:{args.port}')
+    try:
+        asyncio.run(sim.serve_forever())
+    except KeyboardInterrupt:
+        pass
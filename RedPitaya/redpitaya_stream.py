@@ -0,0 +1,358 @@
+"""Continuous streaming acquisition from Red Pitaya.
+
+The board acquires continuously into its circular buffer (16384 samples per channel).
+A producer thread follows the write pointer (ACQ:WPOS?), reads only the samples written since
+the previous read (ACQ:SOUR<n>:DATA:STA:N?) and appends them to a host-side ring buffer.
+The consumer reads blocks from the ring buffer with a generator or a callback on its own
+thread, so processing never stalls the socket.
+
+Example
+-------
+    rp = scpi.scpi('rp-f0ad96.local')
+    with stream_reader(rp, chan=1, dec=64) as stream:
+        for block in stream.blocks():
+            process(block)
+"""
+
+import time
+import unittest
+import threading
+import numpy as np
+
+from redpitaya_scpi import decode_acq_data
+
+# Size of the board's circular acquisition buffer in samples
+BOARD_BUFFER = 16384
+
+# Reads later than this many samples after the board passed the read position are treated as
+# overwritten (the write pointer is seen with network delay, so the full buffer is not safe)
+OVERRUN_LIMIT = BOARD_BUFFER * 7 // 8
+
+
+class ring_buffer (object):
+    """Single-producer single-consumer ring buffer of samples.
+
+    The producer only advances 'written' and the consumer only advances 'read' (both are total
+    sample counts since the start), so no lock is needed between them. When the buffer is full,
+    new samples are dropped and counted in 'dropped'.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self._data    = np.empty(self.capacity, dtype=dtype)
+        self.written  = 0
+        self.read     = 0
+        self.dropped  = 0
+        self._ready   = threading.Event()
+
+    def available(self):
+        """Number of samples waiting for the consumer."""
+        return self.written - self.read
+
+    def put(self, samples):
+        """Append samples (producer side). Returns the number of samples stored."""
+        samples = np.asarray(samples)
+        n = min(len(samples), self.capacity - self.available())
+        self.dropped += len(samples) - n
+        i = self.written % self.capacity
+        first = min(n, self.capacity - i)
+        self._data[i:i + first] = samples[:first]
+        self._data[:n - first] = samples[first:n]
+        # The count is published only after the samples are in place
+        self.written += n
+        self._ready.set()
+        return n
+
+    def get(self, max_samples=None, timeout=None):
+        """Remove and return up to max_samples samples (consumer side).
+
+        Waits up to 'timeout' seconds (None - without a limit) for data and returns an empty
+        array if nothing arrived or the wait was ended by wake().
+        """
+        if self.available() == 0:
+            self._ready.clear()
+            if self.available() == 0:
+                self._ready.wait(timeout)
+        n = self.available()
+        if n == 0:
+            return self._data[:0].copy()
+        if max_samples is not None:
+            n = min(n, max_samples)
+        i = self.read % self.capacity
+        first = min(n, self.capacity - i)
+        out = np.concatenate((self._data[i:i + first], self._data[:n - first]))
+        self.read += n
+        return out
+
+    def wake(self):
+        """Wake a consumer waiting in get()."""
+        self._ready.set()
+
+
+class stream_reader (object):
+    """Background streaming of one channel into a ring_buffer.
+
+    Attributes
+    ----------
+        ring (ring_buffer) :
+            Samples received and not yet consumed.
+        sample_rate (float) :
+            Sample rate in Hz (base_rate / decimation).
+        gaps (list of tuple) :
+            (sample index in the stream, estimated number of lost samples) for every read that
+            came too late - the board overwrote samples before they were read.
+        error (Exception) :
+            Exception that stopped the stream (raised in the producer thread or by the callback),
+            None otherwise. stop() and join() raise it.
+    """
+
+    def __init__(
+        self,
+        rp,
+        chan: int = 1,
+        dec: int = None,
+        binary: bool = True,
+        capacity: int = 2**22,
+        poll_interval: float = 0.002,
+        base_rate: float = 125e6,
+        callback = None,
+        block_size: int = None
+    ):
+        """
+        Parameters
+        ----------
+            rp (redpitaya_scpi.scpi) :
+                Connected board. It must not be used by other code while streaming.
+            chan (int, optional) :
+                Input channel.
+                Defaults to 1.
+            dec (int, optional) :
+                Decimation to set. `None` keeps (and reads) the board's decimation.
+                Defaults to None.
+            binary (bool, optional) :
+                Transfer samples in binary format (ACQ:DATA:FORMAT BIN).
+                Defaults to True.
+            capacity (int, optional) :
+                Ring buffer size in samples.
+                Defaults to 2**22.
+            poll_interval (float, optional) :
+                Pause after a read shorter than a quarter of the board buffer, in seconds.
+                Defaults to 0.002.
+            base_rate (float, optional) :
+                ADC sample rate without decimation (125e6 for STEMlab 125-14).
+                Defaults to 125e6.
+            callback (callable, optional) :
+                Called as callback(block) on a consumer thread for every block read from the
+                ring buffer. Without a callback use blocks() or ring.get().
+                Defaults to None.
+            block_size (int, optional) :
+                Largest block passed to the callback / yielded by blocks().
+                Defaults to None (everything available).
+        """
+        self.rp            = rp
+        self.chan          = chan
+        self.dec           = dec
+        self.binary        = binary
+        self.capacity      = capacity
+        self.poll_interval = poll_interval
+        self.base_rate     = base_rate
+        self.callback      = callback
+        self.block_size    = block_size
+
+        self.ring        = None
+        self.sample_rate = None
+        self.units       = None
+        self.gaps        = []
+        self.error       = None
+        self._stop       = threading.Event()
+        self._threads    = []
+
+    def start(self):
+        """Configure continuous acquisition and start the background threads."""
+        rp = self.rp
+        with rp.batch():
+            rp.tx_txt('ACQ:RST')
+            if self.dec is not None:
+                rp.tx_txt(f'ACQ:DEC {self.dec}')
+            rp.tx_txt(f"ACQ:DATA:FORMAT {'BIN' if self.binary else 'ASCII'}")
+            dec = rp.query('ACQ:DEC?')
+            units = rp.query('ACQ:DATA:UNITS?')
+            # No trigger - a triggered acquisition stops writing once the buffer is filled after it
+            rp.tx_txt('ACQ:START')
+        self.units = units.value
+        self.sample_rate = self.base_rate / int(dec.value)
+        self.ring = ring_buffer(self.capacity, np.int16 if self.units == 'RAW' else np.float32)
+
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._produce, name='rp-stream', daemon=True)]
+        if self.callback is not None:
+            self._threads.append(threading.Thread(target=self._consume, name='rp-stream-callback', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, raise_error=True):
+        """Stop reading, wait for the threads and stop the acquisition.
+
+        Raises the exception that stopped the stream (see error) if raise_error is True.
+        """
+        self._stop.set()
+        self.ring.wake()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        try:
+            self.rp.tx_txt('ACQ:STOP')
+        except Exception:
+            # The connection may be the reason why the stream stopped
+            if self.error is None:
+                raise
+        if raise_error and self.error is not None:
+            raise self.error
+
+    def join(self, timeout=None):
+        """Wait until the stream is stopped (by stop() on another thread or by an error).
+
+        Raises the exception that stopped the stream. Returns False if the stream is still
+        running after 'timeout' seconds, True otherwise.
+        """
+        if not self._stop.wait(timeout):
+            return False
+        self.stop()
+        return True
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        # An exception leaving the block is not replaced by the error of the stream
+        self.stop(raise_error=exc[0] is None)
+
+    def _produce(self):
+        rp = self.rp
+        try:
+            # 'last' - first unread position, seen as the write pointer at 't_last'
+            # 'wpos' - newest write pointer, seen at 't_wpos'
+            last = wpos = int(rp.txrx_txt('ACQ:WPOS?'))
+            t_last = t_wpos = time.monotonic()
+            while not self._stop.is_set():
+                n = (wpos - last) % BOARD_BUFFER
+                if n == 0:
+                    new_wpos = int(rp.txrx_txt('ACQ:WPOS?'))
+                else:
+                    # Samples up to the known write pointer and the new write pointer in one round trip
+                    with rp.batch():
+                        data = rp.query(f'ACQ:SOUR{self.chan}:DATA:STA:N? {last},{n}', arb=self.binary)
+                        reply = rp.query('ACQ:WPOS?')
+                    new_wpos = int(reply.value)
+                t_now = time.monotonic()
+
+                # (Almost) a whole board buffer written since the board was at 'last': the unread samples
+                # were overwritten and the write pointer difference is ambiguous (it wraps around).
+                written = (t_now - t_last) * self.sample_rate
+                if written >= OVERRUN_LIMIT:
+                    lost = max(int(written) - (new_wpos - last) % BOARD_BUFFER, 0)
+                    self.gaps.append((self.ring.written + self.ring.dropped, lost))
+                    last = wpos = new_wpos
+                    t_last = t_wpos = t_now
+                    continue
+
+                if n:
+                    self.ring.put(decode_acq_data(data.value, self.units, self.binary, True))
+                    last, t_last = wpos, t_wpos
+                wpos, t_wpos = new_wpos, t_now
+
+                # Short reads load the board with round trips - wait for more samples, but never
+                # longer than a quarter of the time in which the board buffer wraps around
+                if n < BOARD_BUFFER // 4:
+                    self._stop.wait(min(self.poll_interval, BOARD_BUFFER / 4 / self.sample_rate))
+        except Exception as exc:
+            self.error = exc
+            self._stop.set()
+            self.ring.wake()
+
+    def _consume(self):
+        try:
+            for block in self.blocks():
+                self.callback(block)
+        except Exception as exc:
+            # The producer's error is already stored; a callback error stops the stream
+            if self.error is None:
+                self.error = exc
+            self._stop.set()
+            self.ring.wake()
+
+    def blocks(self):
+        """Yield blocks of samples until the stream is stopped and the ring buffer is empty.
+
+        Raises the producer's exception (e.g. a lost connection) after the remaining samples.
+        """
+        while 1:
+            stopped = self._stop.is_set()
+            block = self.ring.get(self.block_size, 0.1)
+            if len(block):
+                yield block
+            elif stopped:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class test_stream_reader (unittest.TestCase):
+
+    def setUp(self):
+        import redpitaya_scpi as scpi
+        from redpitaya_sim import simulator, board_state
+        self.sim = simulator(board=board_state(noise=0.0)).start_in_thread()
+        self.rp = scpi.scpi('127.0.0.1', timeout=5, port=self.sim.port)
+        self.rp.sour_set(1, volt=0.5, freq=1000)
+        self.rp.tx_txt('OUTPUT1:STATE ON')
+
+    def tearDown(self):
+        self.rp.close()
+        self.sim.stop_in_thread()
+
+    def test_continuity(self):
+        blocks = []
+        with stream_reader(self.rp, chan=1, dec=1024) as stream:
+            for block in stream.blocks():
+                blocks.append(block)
+                if sum(len(b) for b in blocks) > 3 * BOARD_BUFFER:
+                    break
+        data = np.concatenate(blocks).astype(np.float64)
+        self.assertEqual(stream.gaps, [])
+        self.assertEqual(stream.ring.dropped, 0)
+        # A continuous 1 kHz sine: x[k+1] + x[k-1] = 2 cos(w) x[k] for every sample
+        w = 2 * np.pi * 1000 / stream.sample_rate
+        residual = data[2:] + data[:-2] - 2 * np.cos(w) * data[1:-1]
+        self.assertLess(np.abs(residual).max(), 1e-4)
+        self.assertAlmostEqual(float(np.abs(data).max()), 0.5, places=3)
+
+    def test_gaps(self):
+        # Replies slower than the board buffer wraps around (16384 samples at 125e6 / 64 - 8 ms)
+        self.sim.latency = 0.05
+        with stream_reader(self.rp, chan=1, dec=64) as stream:
+            time.sleep(0.5)
+        self.assertGreater(len(stream.gaps), 0)
+        self.assertTrue(all(lost > 0 for _, lost in stream.gaps))
+
+    def test_callback_error(self):
+        calls = []
+
+        def callback(block):
+            calls.append(len(block))
+            if len(calls) == 3:
+                raise ValueError('callback')
+
+        stream = stream_reader(self.rp, chan=1, dec=1024, callback=callback, block_size=1024).start()
+        with self.assertRaises(ValueError):
+            stream.join(timeout=5)
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(any(thread.is_alive() for thread in threading.enumerate()
+                             if thread.name.startswith('rp-stream')))
+        # The connection is still usable after the stream stopped
+        self.assertEqual(self.rp.txrx_txt('ACQ:DEC?'), '1024')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+"""Stepped-sine FRF measurement.
+
+The generator drives the structure with a sine at one frequency per step; input 1 sees the
+excitation (reference) and input 2 the response. Amplitude and phase of both are estimated by
+lock-in demodulation (a windowed projection on exp(-j*2*pi*f*t)), H = response / reference.
+
+Per step the board acquires with the smallest decimation that still covers 'periods' periods
+of the sine, so high frequencies take microseconds and low frequencies are not undersampled.
+The steps are pipelined: the data of step k, the generator frequency and decimation of step k+1
+and its ACQ:START go out in one batch, and step k is demodulated on a worker thread while step
+k+1 settles and acquires.
+
+sweep() starts on a coarse grid and bisects only the intervals next to a peak of |H| or with a
+large change of level or phase, until they are narrower than the requested resolution - the
+steps end up around the resonances instead of everywhere.
+
+Example
+-------
+    rp = scpi.scpi('rp-f0ad96.local')
+    engine = stepped_sine(rp, volt=0.5)
+    freq, H = engine.sweep(1e3, 100e3, points=41, resolution=5)
+"""
+
+import time
+import unittest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from redpitaya_scpi import acq_data_command, decode_acq_data
+
+# Size of the acquisition buffer in samples and the ADC sample rate without decimation
+BUFFER_SIZE = 16384
+BASE_RATE   = 125e6
+
+
+def lockin(data, fs: float, freq):
+    """
+    Complex amplitudes (phasors) of the sine at 'freq' in every row of 'data'.
+
+    Parameters
+    ----------
+        data (array) :
+            Samples, shape (..., samples) - e.g. (channels, samples) for one step or
+            (steps, channels, samples) for a batch of steps.
+        fs (float or array) :
+            Sample rate in Hz (per step for a batch).
+        freq (float or array) :
+            Demodulation frequency in Hz (per step for a batch).
+
+    Returns an array of shape data.shape[:-1]; abs() is the amplitude, angle() the phase of
+    the sine relative to the first sample.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n = data.shape[-1]
+    window = np.hanning(n)
+    # Reference per step: (steps, 1, samples), broadcast over the channels
+    t = np.arange(n) / np.asarray(fs, dtype=np.float64)[..., None, None]
+    ref = window * np.exp(-2j * np.pi * np.asarray(freq, dtype=np.float64)[..., None, None] * t)
+    data = data - data.mean(axis=-1, keepdims=True)
+    return 2 * np.sum(data * ref, axis=-1) / window.sum()
+
+
+def decimation_for(freq: float, periods: float = 10) -> int:
+    """Smallest decimation (power of 2) at which one buffer covers 'periods' periods of 'freq'."""
+    dec = periods * BASE_RATE / (BUFFER_SIZE * freq)
+    return int(min(max(2 ** np.ceil(np.log2(max(dec, 1))), 1), 65536))
+
+
+class stepped_sine (object):
+    """Stepped-sine FRF measurement with one Red Pitaya.
+
+    Attributes
+    ----------
+        freq (ndarray) :
+            Measured frequencies in Hz, increasing (all steps measured so far).
+        H (ndarray) :
+            Complex FRF response/reference at 'freq'.
+        reference (ndarray) :
+            Complex amplitude of the excitation at 'freq'.
+    """
+
+    def __init__(
+        self,
+        rp,
+        out_chan: int = 1,
+        chans: tuple = (1, 2),
+        volt: float = 0.5,
+        periods: float = 10,
+        settle_periods: float = 20,
+        settle_time: float = 0.0,
+        timeout: float = 10
+    ):
+        """
+        Parameters
+        ----------
+            rp (redpitaya_scpi.scpi) :
+                Connected board.
+            out_chan (int, optional) :
+                Generator output driving the structure.
+                Defaults to 1.
+            chans (tuple, optional) :
+                Inputs (reference, response).
+                Defaults to (1, 2).
+            volt (float, optional) :
+                Amplitude of the excitation in Volts.
+                Defaults to 0.5.
+            periods (float, optional) :
+                Minimal number of sine periods in one acquisition (sets the decimation).
+                Defaults to 10.
+            settle_periods (float, optional) :
+                Periods waited after a frequency change before the trigger (transient decay).
+                Defaults to 20.
+            settle_time (float, optional) :
+                Additional fixed wait before the trigger in seconds.
+                Defaults to 0.
+            timeout (float, optional) :
+                Longest wait for a filled buffer in seconds.
+                Defaults to 10.
+        """
+        self.rp             = rp
+        self.out_chan       = out_chan
+        self.chans          = tuple(chans)
+        self.volt           = volt
+        self.periods        = periods
+        self.settle_periods = settle_periods
+        self.settle_time    = settle_time
+        self.timeout        = timeout
+
+        self._freq    = []
+        self._phasors = []
+        self._started = False
+
+    @property
+    def freq(self):
+        return np.sort(np.asarray(self._freq, dtype=np.float64))
+
+    @property
+    def reference(self):
+        order = np.argsort(self._freq)
+        return np.asarray(self._phasors)[order, 0] if self._phasors else np.empty(0, complex)
+
+    @property
+    def H(self):
+        order = np.argsort(self._freq)
+        if not self._phasors:
+            return np.empty(0, complex)
+        phasors = np.asarray(self._phasors)[order]
+        return phasors[:, 1] / phasors[:, 0]
+
+    def _configure(self, freq):
+        """Queue the generator frequency, decimation and ACQ:START of the next step (inside a batch).
+        Unchanged settings are skipped by the settings cache of scpi."""
+        rp = self.rp
+        rp.sour_set(self.out_chan, func='sine', volt=self.volt, freq=freq)
+        # The whole buffer is acquired after the trigger
+        rp.acq_set(dec=decimation_for(freq, self.periods), trig_delay=BUFFER_SIZE // 2,
+                   units='volts', sample_format='bin')
+        if not self._started:
+            rp.tx_txt(f'OUTPUT{self.out_chan}:STATE ON')
+            self._started = True
+        rp.tx_txt('ACQ:START')
+
+    def _process(self, data, units, freq):
+        rows = np.stack([decode_acq_data(reply, units, True, True) for reply in data])
+        fs = BASE_RATE / decimation_for(freq, self.periods)
+        return lockin(rows, fs, freq)
+
+    def measure(self, freqs) -> np.ndarray:
+        """
+        Measure the FRF at the given frequencies (in this order, pipelined).
+
+        Returns the complex H at 'freqs'; the steps are also added to freq/H.
+        """
+        freqs = [float(f) for f in freqs]
+        if not freqs:
+            return np.empty(0, complex)
+        rp = self.rp
+        with rp.batch():
+            self._configure(freqs[0])
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            for i, freq in enumerate(freqs):
+                time.sleep(self.settle_time + self.settle_periods / freq)
+                rp.tx_txt('ACQ:TRIG NOW')
+                rp.wait_for_fill(timeout=self.timeout)
+
+                # Data of this step and the configuration of the next one in one round trip
+                with rp.batch():
+                    units = rp.query_cached('ACQ:DATA:UNITS?')
+                    replies = [rp.query(acq_data_command(chan), arb=True) for chan in self.chans]
+                    if i + 1 < len(freqs):
+                        self._configure(freqs[i + 1])
+
+                # Demodulation runs while the next step settles and acquires
+                futures.append(pool.submit(self._process, [reply.value for reply in replies], units.value, freq))
+            phasors = [future.result() for future in futures]
+
+        self._freq.extend(freqs)
+        self._phasors.extend(phasors)
+        phasors = np.asarray(phasors)
+        return phasors[:, 1] / phasors[:, 0]
+
+    def sweep(
+        self,
+        f_start: float,
+        f_stop: float,
+        points: int = 41,
+        resolution: float = None,
+        max_steps: int = 500,
+        max_level_step: float = 3.0,
+        max_phase_step: float = 30.0,
+        log: bool = True
+    ):
+        """
+        Adaptive FRF sweep.
+
+        Parameters
+        ----------
+            f_start, f_stop (float) :
+                Frequency range in Hz.
+            points (int, optional) :
+                Steps of the initial coarse grid.
+                Defaults to 41.
+            resolution (float, optional) :
+                Target frequency resolution in Hz around resonances.
+                Defaults to 0.1 % of the frequency.
+            max_steps (int, optional) :
+                Largest total number of steps.
+                Defaults to 500.
+            max_level_step (float, optional) :
+                Intervals with a larger change of |H| in dB are refined.
+                Defaults to 3.
+            max_phase_step (float, optional) :
+                Intervals with a larger change of phase in degrees are refined.
+                Defaults to 30.
+            log (bool, optional) :
+                Logarithmic coarse grid and geometric midpoints.
+                Defaults to True.
+
+        Returns (freq, H) within [f_start, f_stop].
+        """
+        grid = np.geomspace(f_start, f_stop, points) if log else np.linspace(f_start, f_stop, points)
+        steps = 0
+        new = grid
+        while len(new) and steps < max_steps:
+            new = new[:max_steps - steps]
+            self.measure(new)
+            steps += len(new)
+
+            band = (self.freq >= f_start) & (self.freq <= f_stop)
+            new = self._refine(self.freq[band], self.H[band], resolution, max_level_step, max_phase_step, log)
+
+        band = (self.freq >= f_start) & (self.freq <= f_stop)
+        return self.freq[band], self.H[band]
+
+    @staticmethod
+    def _refine(freq, H, resolution, max_level_step, max_phase_step, log):
+        """Midpoints of the intervals that need more steps (all intervals checked at once)."""
+        if len(freq) < 2:
+            return np.empty(0)
+        level = 20 * np.log10(np.maximum(np.abs(H), np.finfo(np.float64).tiny))
+        phase = np.rad2deg(np.unwrap(np.angle(H)))
+
+        need = (np.abs(np.diff(level)) > max_level_step) | (np.abs(np.diff(phase)) > max_phase_step)
+        # Both intervals next to a local maximum of |H| (a resonance between the steps)
+        peak = np.zeros(len(freq), dtype=bool)
+        peak[1:-1] = (level[1:-1] >= level[:-2]) & (level[1:-1] >= level[2:])
+        need |= peak[:-1] | peak[1:]
+
+        mid = np.sqrt(freq[:-1] * freq[1:]) if log else (freq[:-1] + freq[1:]) / 2
+        width = np.diff(freq)
+        need &= width > (1e-3 * mid if resolution is None else resolution)
+        return mid[need]
+
+
+class test_stepped_sine (unittest.TestCase):
+
+    # Two modes (frequency in Hz, damping ratio, static gain)
+    MODES = ((5e3, 0.02, 0.05), (12e3, 0.03, 0.1))
+
+    @classmethod
+    def dut(cls, freq):
+        """Receptance-like FRF of the two modes."""
+        H = 0j
+        for f0, zeta, gain in cls.MODES:
+            r = freq / f0
+            H += gain / (1 - r**2 + 2j * zeta * r)
+        return H
+
+    def test_lockin(self):
+        fs, freq = 1e6, 12.5e3
+        t = np.arange(4096) / fs
+        data = np.stack([0.3 * np.sin(2 * np.pi * freq * t), 0.6 * np.sin(2 * np.pi * freq * t - 1.0) + 0.1])
+        phasors = lockin(data, fs, freq)
+        np.testing.assert_allclose(np.abs(phasors), [0.3, 0.6], rtol=1e-3)
+        self.assertAlmostEqual(float(np.angle(phasors[1] / phasors[0])), -1.0, places=3)
+
+    def test_sweep_two_modes(self):
+        import redpitaya_scpi as scpi
+        from redpitaya_sim import simulator, board_state
+        sim = simulator(board=board_state(dut=self.dut, seed=1)).start_in_thread()
+        rp = scpi.scpi('127.0.0.1', timeout=5, port=sim.port)
+        try:
+            freq, H = stepped_sine(rp, volt=0.5).sweep(1e3, 30e3, points=15, resolution=50)
+        finally:
+            rp.close()
+            sim.stop_in_thread()
+
+        self.assertTrue(np.all(np.diff(freq) > 0))
+        self.assertTrue(freq[0] >= 1e3 and freq[-1] <= 30e3)
+        expected = np.array([self.dut(f) for f in freq])
+        np.testing.assert_allclose(H, expected, rtol=0.02)
+        # Both resonances are bracketed by steps not farther apart than the resolution
+        for f0, zeta, _ in self.MODES:
+            peak = f0 * np.sqrt(1 - 2 * zeta**2)
+            self.assertLess(np.min(np.abs(freq - peak)), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()